@@ -5,30 +5,35 @@
 - команды: /admin, /stats, /orders, /neworders, /users, /spam, /broadcast, /setadmin
 - callback-обработчики админ-меню: admin_menu_callback, admin_view_order,
   change_order_status, contact_client, open_web_admin
-- интеграция с utils.database и keyboards
+- интеграция с utils.async_database и keyboards
 - безопасные проверки прав (ENV ADMIN_ID + флаг is_admin из БД)
 """
 import os
 import logging
-import asyncio
 from typing import List, Optional
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
 # Локальные зависимости (должны существовать в проекте)
-from utils.database import (
+from utils.async_database import (
+    run_in_db_executor,
     get_statistics,
     get_all_orders,
     get_all_users,
     get_spam_logs,
     set_admin,
-    is_admin,
     get_orders_by_status,
     get_order,
     update_order_status,
     get_admins,
+    load_user_state,
+    create_broadcast,
+    get_unfinished_broadcasts,
 )
+from utils.broadcast import run_broadcast
+from utils.gigachat_api import gigachat
+from utils.anti_spam import anti_spam
 from keyboards import (
     get_admin_main_menu,
     get_admin_orders_submenu,
@@ -55,13 +60,13 @@ def _get_web_admin_orders_url() -> str:
     return ""
 
 
-def get_admin_ids() -> List[int]:
+async def get_admin_ids() -> List[int]:
     """Вернуть список admin ids (ENV + БД)"""
     ids = []
     if ENV_ADMIN_ID:
         ids.append(int(ENV_ADMIN_ID))
     try:
-        db_admins = get_admins() if callable(get_admins) else []
+        db_admins = await get_admins() if callable(get_admins) else []
         for a in db_admins:
             try:
                 ids.append(int(a.user_id))
@@ -72,7 +77,7 @@ def get_admin_ids() -> List[int]:
     return ids
 
 
-def is_user_admin(user_id: int) -> bool:
+async def is_user_admin(user_id: int) -> bool:
     """Проверка прав администратора: ENV_ADMIN_ID или is_admin из БД"""
     if not user_id:
         return False
@@ -82,7 +87,8 @@ def is_user_admin(user_id: int) -> bool:
     except (ValueError, TypeError):
         pass
     try:
-        return bool(is_admin(user_id))
+        # Флаг берётся из кэшированного состояния пользователя
+        return (await load_user_state(user_id)).is_admin
     except Exception:
         return False
 
@@ -94,12 +100,12 @@ async def admin_panel_command(update: Update,
                               context: ContextTypes.DEFAULT_TYPE) -> None:
     """/admin — показать главное админ-меню"""
     user_id = update.effective_user.id
-    if not is_user_admin(user_id):
+    if not await is_user_admin(user_id):
         await update.message.reply_text("⛔ У вас нет доступа к этой команде.")
         return
 
     try:
-        stats = get_statistics()
+        stats = await get_statistics()
     except Exception:
         stats = {}
     text = "📋 *Админ-панель*\n\nВыберите раздел для управления:"
@@ -107,17 +113,21 @@ async def admin_panel_command(update: Update,
         text, reply_markup=get_admin_main_menu(), parse_mode="Markdown")
 
 
+# Без подчёркиваний: текст статистики уходит с parse_mode=Markdown
+BREAKER_STATES = {'closed': 'работает', 'open': 'отключён',
+                  'half_open': 'проверка'}
+
+
 async def admin_stats(update: Update,
                       context: ContextTypes.DEFAULT_TYPE) -> None:
     """/stats — показать статистику"""
     user_id = update.effective_user.id
-    if not is_user_admin(user_id):
+    if not await is_user_admin(user_id):
         await update.effective_message.reply_text("⛔ У вас нет доступа.")
         return
 
     try:
-        from utils.database import get_statistics
-        stats = get_statistics()
+        stats = await get_statistics()
         text = ("📊 *Статистика бота*\n\n"
                 f"👥 Пользователей: {stats.get('total_users', 0)}\n"
                 f"📦 Всего заказов: {stats.get('total_orders', 0)}\n"
@@ -128,6 +138,27 @@ async def admin_stats(update: Update,
                 f"🚫 Заблокировано: {stats.get('blocked_users', 0)}\n"
                 f"🛑 Спам-записей: {stats.get('spam_count', 0)}")
         
+        ai = gigachat.get_metrics()
+        text += ("\n\n🤖 *AI-ответы*\n"
+                 f"💾 Из кэша: {ai['cache']['hits']} "
+                 f"({ai['cache']['hit_rate']:.0%}), в кэше: {ai['cache']['entries']}\n"
+                 f"🧠 Похожие вопросы: {ai['semantic_cache']['hits']} "
+                 f"({ai['semantic_cache']['hit_rate']:.0%})\n"
+                 f"🔗 Объединено одинаковых запросов: {ai['single_flight']['coalesced']}\n"
+                 f"⚡ GigaChat: {BREAKER_STATES.get(ai['breaker']['state'])}, ошибок "
+                 f"{ai['breaker']['error_rate']:.0%}, p50 {ai['breaker']['p50_seconds']}с\n"
+                 f"📚 Из базы знаний: по теме {ai['routes'].get('intent', 0)}, "
+                 f"простые {ai['routes'].get('local_simple', 0)}, "
+                 f"при медленной модели {ai['routes'].get('local_slow', 0)}, "
+                 f"при сбое {ai['routes'].get('circuit_open', 0)}")
+        
+        spam = await run_in_db_executor(anti_spam.stats)
+        text += ("\n\n🛡 *Антиспам*\n"
+                 f"🗄 Хранилище: {spam['backend']}, в муте: {spam['muted_users']}")
+        if 'tracked_users' in spam:
+            text += (f"\n👥 Отслеживается: {spam['tracked_users']} / "
+                     f"{spam['max_users']}")
+        
         keyboard = InlineKeyboardMarkup([[
             InlineKeyboardButton("🔄 Обновить", callback_data="admin_stats"),
             InlineKeyboardButton("◀️ Назад", callback_data="admin_back_menu")
@@ -150,12 +181,12 @@ async def admin_orders(update: Update,
                        context: ContextTypes.DEFAULT_TYPE) -> None:
     """/orders — вывести последние заказы с кнопками управления"""
     user_id = update.effective_user.id
-    if not is_user_admin(user_id):
+    if not await is_user_admin(user_id):
         await update.effective_message.reply_text("⛔ У вас нет доступа.")
         return
 
     try:
-        orders = get_all_orders(limit=20)
+        orders = await get_all_orders(limit=20)
         if not orders:
             await update.effective_message.reply_text("📋 Заказов пока нет.")
             return
@@ -194,12 +225,12 @@ async def admin_new_orders(update: Update,
                            context: ContextTypes.DEFAULT_TYPE) -> None:
     """/neworders — показать новые заказы"""
     user_id = update.effective_user.id
-    if not is_user_admin(user_id):
+    if not await is_user_admin(user_id):
         await update.message.reply_text("⛔ У вас нет доступа.")
         return
 
     try:
-        orders = get_orders_by_status("new")
+        orders = await get_orders_by_status("new")
         if not orders:
             await update.message.reply_text("✅ Новых заказов нет.")
             return
@@ -219,12 +250,12 @@ async def admin_users(update: Update,
                       context: ContextTypes.DEFAULT_TYPE) -> None:
     """/users — список пользователей"""
     user_id = update.effective_user.id
-    if not is_user_admin(user_id):
+    if not await is_user_admin(user_id):
         await update.message.reply_text("⛔ У вас нет доступа.")
         return
 
     try:
-        users = get_all_users()
+        users = await get_all_users()
         if not users:
             if update.callback_query:
                 await update.callback_query.edit_message_text("👥 Пользователей нет.")
@@ -256,12 +287,12 @@ async def admin_spam(update: Update,
                      context: ContextTypes.DEFAULT_TYPE) -> None:
     """/spam — показать журнал спама"""
     user_id = update.effective_user.id
-    if not is_user_admin(user_id):
+    if not await is_user_admin(user_id):
         await update.message.reply_text("⛔ У вас нет доступа.")
         return
 
     try:
-        logs = get_spam_logs(limit=50)
+        logs = await get_spam_logs(limit=50)
         if not logs:
             await update.message.reply_text("🛑 Записей спама нет.")
             return
@@ -282,7 +313,7 @@ async def broadcast_start(update: Update,
                           context: ContextTypes.DEFAULT_TYPE) -> None:
     """Запустить режим рассылки (следующий текст — рассылка)"""
     user_id = update.effective_user.id
-    if not is_user_admin(user_id):
+    if not await is_user_admin(user_id):
         await update.message.reply_text("⛔ У вас нет доступа.")
         return
     context.user_data["broadcast_mode"] = True
@@ -292,13 +323,22 @@ async def broadcast_start(update: Update,
 
 
 async def broadcast_send(update: Update,
-                         context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Отправить рассылку всем пользователям"""
+                         context: ContextTypes.DEFAULT_TYPE,
+                         message_text: Optional[str] = None) -> None:
+    """Запустить рассылку всем пользователям в фоне"""
+    # Текст рассылки видят два хендлера (messages и main), которые идут
+    # параллельно: запускает тот, кто первым снял флаг — до любого await
+    if not context.user_data.pop("broadcast_mode", False) and not context.args:
+        return
+    context.user_data["broadcast_update_id"] = update.update_id
+
     user_id = update.effective_user.id
-    if not is_user_admin(user_id):
+    if not await is_user_admin(user_id):
         return
 
-    if context.args:
+    if message_text:
+        pass
+    elif context.args:
         message_text = " ".join(context.args)
     elif update.message and update.message.text:
         message_text = update.message.text
@@ -312,39 +352,53 @@ async def broadcast_send(update: Update,
         return
 
     try:
-        users = get_all_users()
+        broadcast_id = await create_broadcast(message_text, user_id, "Markdown")
     except Exception:
-        logger.exception("Ошибка при получении списка пользователей")
-        await update.message.reply_text(
-            "❌ Не удалось получить список пользователей.")
+        logger.exception("Ошибка при создании рассылки")
+        await update.message.reply_text("❌ Не удалось запустить рассылку.")
         return
 
-    sent = 0
-    failed = 0
-    delay = float(os.getenv("BROADCAST_DELAY", "0.05"))
+    status_msg = await update.message.reply_text("📤 Запускаю рассылку...")
+    # Рассылка идёт в фоне: хендлер не держит очередь обновлений бота
+    context.application.create_task(
+        _run_broadcast_with_status(context.bot, broadcast_id, message_text,
+                                   "Markdown", status_msg))
 
-    status_msg = await update.message.reply_text(
-        f"📤 Запускаю рассылку {len(users)} пользователям...")
-    
-    for u in users:
+
+async def _run_broadcast_with_status(bot, broadcast_id: int, text: str,
+                                     parse_mode: Optional[str], status_msg) -> None:
+    """Выполнить рассылку, обновляя сообщение с прогрессом"""
+
+    async def on_progress(progress):
+        if status_msg is None:
+            return
         try:
-            await context.bot.send_message(chat_id=int(u.user_id),
-                                           text=message_text,
-                                           parse_mode="Markdown")
-            sent += 1
-            if delay:
-                await asyncio.sleep(delay)
-            
-            if sent % 10 == 0:
-                try:
-                    await status_msg.edit_text(f"📤 Отправлено: {sent} / {len(users)}...")
-                except: pass
+            await status_msg.edit_text(progress.format())
         except Exception:
-            failed += 1
-            # logger.warning(f"Не удалось отправить пользователю {u.user_id}")
-            
-    await update.message.reply_text(
-        f"✅ Рассылка завершена.\nОтправлено: {sent}\nОшибок: {failed}.")
+            pass
+
+    try:
+        await run_broadcast(bot, broadcast_id, text, parse_mode,
+                            on_progress=on_progress)
+    except Exception:
+        logger.exception(f"Рассылка {broadcast_id} прервана")
+
+
+async def resume_broadcasts(application) -> None:
+    """Продолжить рассылки, прерванные остановкой бота"""
+    for broadcast in await get_unfinished_broadcasts():
+        logger.info(f"Продолжаю рассылку {broadcast.id}")
+        status_msg = None
+        try:
+            status_msg = await application.bot.send_message(
+                chat_id=broadcast.created_by,
+                text=f"📤 Продолжаю прерванную рассылку #{broadcast.id}...")
+        except Exception:
+            logger.warning(f"Не удалось уведомить о рассылке {broadcast.id}")
+        application.create_task(
+            _run_broadcast_with_status(application.bot, broadcast.id,
+                                       broadcast.text, broadcast.parse_mode,
+                                       status_msg))
 
 
 # ---------------- Управление правами ----------------
@@ -354,7 +408,7 @@ async def set_admin_command(update: Update,
                             context: ContextTypes.DEFAULT_TYPE) -> None:
     """/setadmin <user_id> — назначить пользователя админом"""
     user_id = update.effective_user.id
-    if not is_user_admin(user_id):
+    if not await is_user_admin(user_id):
         await update.message.reply_text("⛔ У вас нет доступа.")
         return
 
@@ -364,7 +418,7 @@ async def set_admin_command(update: Update,
 
     try:
         new_admin_id = int(context.args[0])
-        ok = set_admin(new_admin_id, True)
+        ok = await set_admin(new_admin_id, True)
         if ok:
             await update.message.reply_text(
                 f"✅ Пользователь {new_admin_id} назначен админом.")
@@ -386,7 +440,7 @@ async def admin_menu_callback(update: Update,
     query = update.callback_query
     await query.answer()
     user_id = update.effective_user.id
-    if not is_user_admin(user_id):
+    if not await is_user_admin(user_id):
         await query.answer("⛔ Нет доступа", show_alert=True)
         return
 
@@ -443,7 +497,7 @@ async def admin_menu_callback(update: Update,
     if data in status_map:
         status, title = status_map[data]
         try:
-            orders = get_orders_by_status(status)
+            orders = await get_orders_by_status(status)
             if not orders:
                 await query.edit_message_text(
                     f"{title}\n\n📭 Заказов нет",
@@ -498,8 +552,8 @@ async def admin_menu_callback(update: Update,
     if data.startswith("status_deleted_"):
         try:
             order_id = int(data.replace("status_deleted_", ""))
-            from utils.database import delete_order
-            if delete_order(order_id):
+            from utils.async_database import delete_order
+            if await delete_order(order_id):
                 await query.answer("✅ Заказ удален")
                 await query.message.edit_text(f"🗑 Заказ #{order_id} был удален из базы данных.")
             else:
@@ -518,7 +572,7 @@ async def admin_view_order(update: Update,
     query = update.callback_query
     await query.answer()
     user_id = update.effective_user.id
-    if not is_user_admin(user_id):
+    if not await is_user_admin(user_id):
         await query.answer("⛔ Нет доступа", show_alert=True)
         return
 
@@ -528,7 +582,7 @@ async def admin_view_order(update: Update,
         await query.answer("❌ Неверный ID заказа", show_alert=True)
         return
 
-    order = get_order(order_id)
+    order = await get_order(order_id)
     if not order:
         await query.answer("❌ Заказ не найден", show_alert=True)
         return
@@ -600,7 +654,7 @@ async def change_order_status(update: Update,
     query = update.callback_query
     await query.answer()
     user = update.effective_user
-    if not is_user_admin(user.id):
+    if not await is_user_admin(user.id):
         await query.answer("⛔ Нет доступа", show_alert=True)
         return
 
@@ -629,7 +683,7 @@ async def change_order_status(update: Update,
     new_status_norm = mapping.get(new_status, new_status)
 
     try:
-        updated = update_order_status(order_id, new_status_norm)
+        updated = await update_order_status(order_id, new_status_norm)
     except Exception:
         logger.exception("Ошибка при обновлении статуса заказа в БД")
         await query.answer("❌ Ошибка при обновлении статуса", show_alert=True)
@@ -640,7 +694,7 @@ async def change_order_status(update: Update,
                            show_alert=True)
         return
 
-    order = get_order(order_id)
+    order = await get_order(order_id)
     try:
         from handlers.orders import format_order_id
         formatted = format_order_id(
@@ -708,7 +762,7 @@ async def contact_client(update: Update,
     query = update.callback_query
     await query.answer()
     user_id = update.effective_user.id
-    if not is_user_admin(user_id):
+    if not await is_user_admin(user_id):
         await query.answer("⛔ Нет доступа", show_alert=True)
         return
 
@@ -718,7 +772,7 @@ async def contact_client(update: Update,
         await query.answer("❌ Неверный ID заказа", show_alert=True)
         return
 
-    order = get_order(order_id)
+    order = await get_order(order_id)
     if not order:
         await query.answer("❌ Заказ не найден", show_alert=True)
         return
@@ -745,7 +799,7 @@ async def open_web_admin(update: Update,
     query = update.callback_query
     await query.answer()
     user_id = update.effective_user.id
-    if not is_user_admin(user_id):
+    if not await is_user_admin(user_id):
         await query.answer("⛔ Нет доступа", show_alert=True)
         return
 
@@ -765,12 +819,12 @@ async def open_web_admin(update: Update,
 # ---------------- Вспомогательные функции ----------------
 
 
-def get_admin_menu_keyboard(
+async def get_admin_menu_keyboard(
         stats: Optional[dict] = None) -> InlineKeyboardMarkup:
     """Клавиатура админ-меню (с метриками)"""
     if stats is None:
         try:
-            stats = get_statistics()
+            stats = await get_statistics()
         except Exception:
             stats = {}
     new_count = stats.get("new_orders", 0)
@@ -3,7 +3,7 @@ import os
 from datetime import datetime, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand, BotCommandScopeChat
 from telegram.ext import ContextTypes, ConversationHandler
-from utils.database import (
+from utils.async_database import (
     get_statistics, get_all_orders, get_all_users, get_spam_logs, 
     get_orders_by_status, update_order_status, get_order, delete_order
 )
@@ -28,7 +28,7 @@ async def set_admin_commands(bot, user_id: int):
         logger.error(f"Error setting bot commands for admin {user_id}: {e}")
 
 async def show_admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    stats = get_statistics()
+    stats = await get_statistics()
     text = (
         f"📊 *Статистика за всё время*\n\n"
         f"🆕 Новых заказов: {stats.get('new_orders', 0)}\n"
@@ -49,7 +49,7 @@ async def show_admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
             logger.error(f"Error in show_admin_stats (message): {e}")
 
 async def show_spam_candidates(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    orders = get_orders_by_status("new")
+    orders = await get_orders_by_status("new")
     if not orders:
         if update.message:
             await update.message.reply_text("Нет новых заказов для проверки на спам.")
@@ -85,7 +85,7 @@ async def mark_as_spam_callback(update: Update, context: ContextTypes.DEFAULT_TY
             
         order_id = int(order_id_str)
         
-        if update_order_status(order_id, "spam"):
+        if await update_order_status(order_id, "spam"):
             await query.answer("Заказ помечен как спам")
             await query.message.edit_text(f"✅ Заказ #{order_id} помечен как спам и скрыт.")
         else:
@@ -4,7 +4,7 @@ from datetime import datetime
 from telegram import Update
 from telegram.ext import ContextTypes
 from keyboards import get_main_menu, get_admin_main_menu, remove_keyboard, get_faq_menu, get_back_button
-from utils.database import add_user, check_today_first_visit, get_user_orders
+from utils.async_database import add_user, check_today_first_visit, get_user_orders
 from handlers.admin_panel.handlers import set_admin_commands
 from handlers.admin import is_user_admin
 
@@ -44,14 +44,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
         # Добавляем пользователя в базу
         try:
-            add_user(user.id, user.username or "", user.first_name or "", user.last_name or "")
+            await add_user(user.id, user.username or "", user.first_name or "", user.last_name or "")
         except Exception as e:
             logger.error(f"Error adding user {user.id} to DB: {e}")
             
-        today_first_visit = check_today_first_visit(user.id)
+        today_first_visit = await check_today_first_visit(user.id)
 
         # Проверяем администратора
-        user_is_admin = is_user_admin(user.id)
+        user_is_admin = await is_user_admin(user.id)
 
         if user_is_admin:
             caption = (
@@ -173,7 +173,7 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """Команда /status - проверка статуса заказов"""
     try:
         user_id = update.effective_user.id
-        orders = get_user_orders(user_id)
+        orders = await get_user_orders(user_id)
 
         if not orders:
             text = (
@@ -1,11 +1,15 @@
+import asyncio
 import logging
+import os
+import time
 from datetime import datetime
 from telegram import Update
 from telegram.ext import ContextTypes
 from telegram.constants import ChatAction
+from telegram.error import BadRequest, RetryAfter
 from utils.gigachat_api import get_ai_response
 from utils.anti_spam import anti_spam
-from utils.database import add_user, is_user_blocked, get_user_info
+from utils.async_database import load_user_state, save_user_state
 from keyboards import get_main_menu, get_ai_response_keyboard
 from handlers.admin import is_user_admin
 
@@ -14,6 +18,80 @@ logger = logging.getLogger(__name__)
 # Максимальная длина сообщения для обработки AI
 MAX_MESSAGE_LENGTH = 1000
 
+# Не чаще одной правки сообщения с ответом в столько секунд (лимиты Bot API)
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))
+STREAM_CURSOR = " ▌"
+
+
+class StreamingReply:
+    """Одно сообщение с ответом, которое дописывается по мере генерации.
+
+    Первый кусок текста отправляется сразу, дальше сообщение правится не
+    чаще STREAM_EDIT_INTERVAL; промежуточный текст — без разметки, финальный
+    — с Markdown и клавиатурой. После finish() или discard() update()
+    ничего не делает: объединённый запрос к модели может продолжать
+    присылать текст, когда этот обработчик уже отменён.
+    """
+
+    def __init__(self, message, prefix: str = "💭 ",
+                 interval: float = STREAM_EDIT_INTERVAL):
+        self.message = message
+        self.prefix = prefix
+        self.interval = interval
+        self.sent = None
+        self.closed = False
+        self._shown = ""
+        self._next_edit = 0.0
+
+    async def update(self, text: str) -> None:
+        """Показать накопленный текст, если подошло время правки"""
+        now = time.monotonic()
+        if (self.closed or not text.strip() or now < self._next_edit
+                or text == self._shown):
+            return
+        self._next_edit = now + self.interval
+        content = f"{self.prefix}{text.rstrip()}{STREAM_CURSOR}"
+        try:
+            if self.sent is None:
+                self.sent = await self.message.reply_text(content)
+            else:
+                await self.sent.edit_text(content)
+            self._shown = text
+        except RetryAfter as e:
+            self._next_edit = now + float(e.retry_after)
+        except BadRequest as e:
+            logger.debug(f"Не удалось обновить ответ: {e}")
+
+    async def finish(self, text: str, reply_markup=None) -> None:
+        """Итоговый ответ: правка показанного сообщения или новое"""
+        self.closed = True
+        if self.sent is not None:
+            try:
+                await self.sent.edit_text(text, reply_markup=reply_markup,
+                                          parse_mode="Markdown")
+                return
+            except BadRequest as e:
+                # Разметка модели не разобралась — показываем как есть
+                logger.warning(f"Не удалось отправить ответ с Markdown: {e}")
+                try:
+                    await self.sent.edit_text(text, reply_markup=reply_markup)
+                    return
+                except BadRequest:
+                    pass
+        await self.message.reply_text(text, reply_markup=reply_markup,
+                                      parse_mode="Markdown")
+
+    async def discard(self) -> None:
+        """Убрать недописанный ответ (вопрос заменён новым или ошибка)"""
+        self.closed = True
+        if self.sent is None:
+            return
+        try:
+            await self.sent.delete()
+        except Exception as e:
+            logger.debug(f"Не удалось удалить недописанный ответ: {e}")
+        self.sent = None
+
 
 async def handle_message(update: Update,
                          context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -27,86 +105,93 @@ async def handle_message(update: Update,
         user_id = user.id
         text = update.message.text.strip()
 
-        # Проверяем режим администратора (например, для рассылки)
-        if await handle_admin_mode(update, context, user_id, text):
-            return
-
-        # Добавляем/обновляем пользователя в базе
-        add_user(user_id=user_id,
-                 username=user.username,
-                 first_name=user.first_name,
-                 last_name=user.last_name)
+        # Состояние пользователя (админ, блокировка, тон, темы) — из кэша
+        # или одним запросом; профиль и история чата запишутся одним upsert
+        state = await load_user_state(user_id)
+        state.update_profile(username=user.username,
+                             first_name=user.first_name,
+                             last_name=user.last_name)
 
-        # Проверяем, не заблокирован ли пользователь
-        if is_user_blocked(user_id):
-            logger.warning(
-                f"Заблокированный пользователь {user_id} пытался отправить сообщение"
-            )
-            await update.message.reply_text(
-                "🚫 Ваш доступ к боту ограничен. Пожалуйста, свяжитесь с администратором."
-            )
-            return
-
-        # Проверяем на спам
-        is_spam, spam_reason = anti_spam.is_spam(user_id, text)
-        if is_spam:
-            logger.warning(f"Спам от {user_id}: {spam_reason}")
-            await update.message.reply_text(
-                f"⚠️ {spam_reason}\n\nПожалуйста, подождите немного перед следующим сообщением.",
-                reply_markup=get_main_menu())
-            return
+        try:
+            # Проверяем режим администратора (например, для рассылки)
+            if await handle_admin_mode(update, context, user_id, text):
+                return
 
-        # Ограничиваем длину сообщения для AI
-        if len(text) > MAX_MESSAGE_LENGTH:
-            await update.message.reply_text(
-                f"📝 Ваше сообщение слишком длинное ({len(text)} символов). "
-                f"Пожалуйста, сократите его до {MAX_MESSAGE_LENGTH} символов.")
-            return
+            # Проверяем, не заблокирован ли пользователь
+            if state.is_blocked:
+                logger.warning(
+                    f"Заблокированный пользователь {user_id} пытался отправить сообщение"
+                )
+                await update.message.reply_text(
+                    "🚫 Ваш доступ к боту ограничен. Пожалуйста, свяжитесь с администратором."
+                )
+                return
 
-        # Логируем полученное сообщение
-        user_info = get_user_info(user_id)
-        username_display = f"@{user_info.username}" if user_info and user_info.username else user_info.first_name if user_info else f"Пользователь {user_id}"
-        logger.info(
-            f"Сообщение от {username_display} (ID: {user_id}): {text[:100]}..."
-        )
+            # Проверяем на спам
+            is_spam, spam_reason = await anti_spam.check(user_id, text)
+            if is_spam:
+                logger.warning(f"Спам от {user_id}: {spam_reason}")
+                await update.message.reply_text(
+                    f"⚠️ {spam_reason}\n\nПожалуйста, подождите немного перед следующим сообщением.",
+                    reply_markup=get_main_menu())
+                return
 
-        # Показываем индикатор "печатает"
-        try:
-            await context.bot.send_chat_action(
-                chat_id=update.effective_chat.id, action=ChatAction.TYPING)
-        except Exception as e:
-            logger.warning(f"Не удалось отправить ChatAction: {e}")
+            # Ограничиваем длину сообщения для AI
+            if len(text) > MAX_MESSAGE_LENGTH:
+                await update.message.reply_text(
+                    f"📝 Ваше сообщение слишком длинное ({len(text)} символов). "
+                    f"Пожалуйста, сократите его до {MAX_MESSAGE_LENGTH} символов.")
+                return
 
-        # Получаем ответ от AI
-        try:
-            # Проверка на запрос отзыва
-            review_keywords = ['как оставить отзыв', 'где оставить отзыв', 'написать отзыв', 'оставить отзыв']
-            if any(keyword in text.lower() for keyword in review_keywords):
-                response = "Будем очень благодарны за ваш отзыв! Вы можете оставить его на Яндекс Картах по ссылке: https://yandex.ru/maps/org/shveynyy_hub/204285863268/"
-                keyboard = get_ai_response_keyboard()
-            else:
-                response, needs_human = await get_ai_response(text, user_id)
-                # Формируем клавиатуру ответа
-                keyboard = get_ai_response_keyboard()
-
-            # Отправляем ответ
-            await update.message.reply_text(
-                f"💭 {response}",
-                reply_markup=keyboard,
-                parse_mode="Markdown"
+            # Логируем полученное сообщение
+            username_display = f"@{user.username}" if user.username else user.first_name or f"Пользователь {user_id}"
+            logger.info(
+                f"Сообщение от {username_display} (ID: {user_id}): {text[:100]}..."
             )
 
-            # Логируем успешный ответ
-            logger.info(f"AI ответил пользователю {user_id}")
-
-        except Exception as e:
-            logger.error(f"Ошибка при получении ответа от AI: {e}")
-            await update.message.reply_text(
-                "🤖 Извините, у меня возникли технические трудности. "
-                "Пожалуйста, попробуйте позже или свяжитесь с нами напрямую:\n\n"
-                "📞 +7 (968) 396-91-52\n"
-                "📍 г. Москва, ул. Маршала Федоренко д.12, ТЦ \"Бусиново\"",
-                reply_markup=get_main_menu())
+            # Показываем индикатор "печатает"
+            try:
+                await context.bot.send_chat_action(
+                    chat_id=update.effective_chat.id, action=ChatAction.TYPING)
+            except Exception as e:
+                logger.warning(f"Не удалось отправить ChatAction: {e}")
+
+            # Получаем ответ от AI; текст показывается по мере генерации
+            reply = StreamingReply(update.message)
+            try:
+                # Проверка на запрос отзыва
+                review_keywords = ['как оставить отзыв', 'где оставить отзыв', 'написать отзыв', 'оставить отзыв']
+                if any(keyword in text.lower() for keyword in review_keywords):
+                    response = "Будем очень благодарны за ваш отзыв! Вы можете оставить его на Яндекс Картах по ссылке: https://yandex.ru/maps/org/shveynyy_hub/204285863268/"
+                    keyboard = get_ai_response_keyboard()
+                else:
+                    response, needs_human = await ask_ai(
+                        context, text, user_id, state,
+                        on_partial=reply.update)
+                    if response is None:
+                        # Пользователь уже задал новый вопрос — отвечаем на него
+                        await reply.discard()
+                        return
+                    # Формируем клавиатуру ответа
+                    keyboard = get_ai_response_keyboard()
+
+                # Отправляем ответ
+                await reply.finish(f"💭 {response}", reply_markup=keyboard)
+
+                # Логируем успешный ответ
+                logger.info(f"AI ответил пользователю {user_id}")
+
+            except Exception as e:
+                logger.error(f"Ошибка при получении ответа от AI: {e}")
+                await reply.discard()
+                await update.message.reply_text(
+                    "🤖 Извините, у меня возникли технические трудности. "
+                    "Пожалуйста, попробуйте позже или свяжитесь с нами напрямую:\n\n"
+                    "📞 +7 (968) 396-91-52\n"
+                    "📍 г. Москва, ул. Маршала Федоренко д.12, ТЦ \"Бусиново\"",
+                    reply_markup=get_main_menu())
+        finally:
+            await save_user_state(state)
 
     except Exception as e:
         logger.error(f"Критическая ошибка в обработке сообщения: {e}")
@@ -114,11 +199,38 @@ async def handle_message(update: Update,
             "😔 Произошла непредвиденная ошибка. Пожалуйста, попробуйте позже.")
 
 
+async def ask_ai(context: ContextTypes.DEFAULT_TYPE, text: str, user_id: int,
+                 state, on_partial=None) -> tuple:
+    """Запрос к AI, который отменяется новым сообщением того же пользователя.
+
+    Возвращает (None, False), если ответ больше не нужен.
+    """
+    previous = context.user_data.get('ai_task')
+    if previous and not previous.done():
+        previous.cancel()
+
+    task = asyncio.create_task(
+        get_ai_response(text, user_id, user_state=state,
+                        on_partial=on_partial))
+    context.user_data['ai_task'] = task
+    try:
+        return await task
+    except asyncio.CancelledError:
+        # Отменили сам запрос (новое сообщение), а не этот хендлер
+        if task.cancelled() and not asyncio.current_task().cancelling():
+            logger.info(f"AI-запрос пользователя {user_id} заменён новым сообщением")
+            return None, False
+        raise
+    finally:
+        if context.user_data.get('ai_task') is task:
+            context.user_data.pop('ai_task', None)
+
+
 async def handle_admin_mode(update: Update, context: ContextTypes.DEFAULT_TYPE,
                             user_id: int, text: str) -> bool:
     """Обработка режима администратора (например, для рассылки)"""
     try:
-        if not is_user_admin(user_id):
+        if not await is_user_admin(user_id):
             return False
 
         # Проверяем специальные административные команды
@@ -126,8 +238,9 @@ async def handle_admin_mode(update: Update, context: ContextTypes.DEFAULT_TYPE,
             # Пропускаем команды для обработки в других хендлерах
             return False
 
-        # Проверяем режим рассылки
-        if context.user_data.get('broadcast_mode'):
+        # Проверяем режим рассылки (текст мог уже забрать хендлер из main)
+        if (context.user_data.get('broadcast_mode') or
+                context.user_data.get('broadcast_update_id') == update.update_id):
             from handlers.admin import broadcast_send
             await broadcast_send(update, context, text)
             return True
@@ -237,7 +350,7 @@ async def handle_callback_query(update: Update,
 
         elif data.startswith('admin_'):
             # Административные действия
-            if is_user_admin(user_id):
+            if await is_user_admin(user_id):
                 await handle_admin_callback(query, context, data)
             else:
                 await query.edit_message_text(
@@ -264,8 +377,8 @@ async def handle_admin_callback(query, context, data: str):
                 parse_mode="Markdown")
 
         elif data == 'admin_stats':
-            from utils.database import get_statistics
-            stats = get_statistics()
+            from utils.async_database import get_statistics
+            stats = await get_statistics()
 
             stats_text = ("📊 *Статистика бота:*\n\n"
                           f"👥 Пользователей: {stats.get('total_users', 0)}\n"
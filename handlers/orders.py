@@ -8,7 +8,7 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 
 from keyboards import get_services_menu, get_main_menu, get_admin_main_menu
-from utils.database import create_order, get_admins, add_user, get_order, update_order_status
+from utils.async_database import create_order, get_admins, add_user, get_order, update_order_status
 from utils.knowledge_loader import knowledge
 from handlers.admin import is_user_admin
 
@@ -125,7 +125,7 @@ async def order_start(update: Update,
         logger.info(f"Начало оформления заказа от пользователя {user_id}")
 
         # Проверяем, является ли пользователь администратором
-        if is_user_admin(user_id):
+        if await is_user_admin(user_id):
             if update.callback_query:
                 await update.callback_query.answer()
                 await update.callback_query.edit_message_text(
@@ -546,11 +546,11 @@ async def confirm_order(update: Update,
         user_id = user.id
 
         # Добавляем/обновляем пользователя
-        add_user(user_id=user_id,
-                 username=user.username,
-                 first_name=user.first_name,
-                 last_name=user.last_name,
-                 phone=context.user_data.get('client_phone'))
+        await add_user(user_id=user_id,
+                       username=user.username,
+                       first_name=user.first_name,
+                       last_name=user.last_name,
+                       phone=context.user_data.get('client_phone'))
 
         # Создаем заказ
         problem_desc = context.user_data.get('problem_description')
@@ -558,7 +558,7 @@ async def confirm_order(update: Update,
         if problem_desc:
             full_description = f"{full_description}: {problem_desc}"
 
-        order_id = create_order(
+        order_id = await create_order(
             user_id=user_id,
             service_type=context.user_data.get('service', 'unknown'),
             description=full_description,
@@ -664,7 +664,7 @@ async def notify_admins(context: ContextTypes.DEFAULT_TYPE,
                         user_id: int = None):
     """Уведомить админов о новом заказе"""
     try:
-        admins = get_admins() or []
+        admins = await get_admins() or []
         admin_ids = [admin.user_id for admin in admins if admin.user_id]
 
         # Добавляем основного администратора из переменных окружения
@@ -762,10 +762,10 @@ async def handle_order_status_change(update: Update,
             return
 
         # Обновляем статус в базе данных
-        update_order_status(order_id, new_status)
+        await update_order_status(order_id, new_status)
 
         # Получаем информацию о заказе
-        order = get_order(order_id)
+        order = await get_order(order_id)
         if not order:
             logger.error(f"Заказ {order_id} не найден")
             await query.edit_message_text(
@@ -3,17 +3,17 @@
 """
 
 import logging
-import re
 from datetime import datetime
 from typing import Optional, Dict, Any, List
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler, CallbackQueryHandler, MessageHandler, filters
 
-from utils.database import (create_review, has_review, get_order,
-                            get_average_rating, get_user_reviews,
-                            update_review_status, get_admins, get_review_stats,
-                            get_recent_reviews)
+from utils.async_database import (create_review, has_review, get_order,
+                                  get_average_rating, get_user_reviews,
+                                  update_review_status, get_admins, get_review_stats,
+                                  get_recent_reviews)
+from utils.profanity import profanity
 from keyboards import get_main_menu, get_admin_main_menu
 from handlers.admin import is_user_admin
 
@@ -29,52 +29,6 @@ MIN_COMMENT_LENGTH = 10
 # URL для отзывов на Яндекс.Карты
 YANDEX_REVIEWS_URL = "https://yandex.ru/maps/org/shveyny_hub/1233246900?si=qazrp3fnzwhkjgancr36aquutw"
 
-# Паттерны для фильтрации нецензурной лексики (расширенный список)
-PROFANITY_PATTERNS = [
-    r'\b(бля|блять|блядь|блядина|ёб|еб|ебан|ебать|ебло|ебуч|пизд|пизда|пиздец|хуй|хуя|хуе|хуи|сука|сучк|мудак|мудил|дебил|долбо|залуп|говн|срать|сран|жоп|ёпт|нах)\w*',
-    r'\b(fuck|shit|bitch|asshole|dick|pussy|cunt|motherfucker|damn|ass)\w*',
-    r'(б+л+я+|п+и+з+д+|х+у+й+|е+б+а+|с+у+к+а+)',
-    r'(f+u+c+k+|s+h+i+t+|b+i+t+c+h+)',
-]
-
-# Маппинг для декодирования leetspeak
-LEETSPEAK_MAP = {
-    '0': 'о',
-    '@': 'а',
-    '3': 'е',
-    '1': 'и',
-    '4': 'а',
-    '5': 's',
-    '$': 's',
-    '6': 'б',
-    '8': 'в',
-    '!': 'i',
-    '7': 't',
-    '9': 'g',
-    '&': 'и'
-}
-
-
-def normalize_text(text: str) -> str:
-    """Нормализация текста: удаление обфускации и приведение к нижнему регистру"""
-    if not text:
-        return ""
-
-    result = text.lower()
-
-    # Замена leetspeak символов
-    for char, replacement in LEETSPEAK_MAP.items():
-        result = result.replace(char, replacement)
-
-    # Удаление специальных символов
-    result = re.sub(r'[._\-*#~^<>]+', '', result)
-
-    # Удаление повторяющихся символов (более 3 раз)
-    result = re.sub(r'(.)\1{3,}', r'\1\1', result)
-
-    return result
-
-
 def contains_profanity(text: str) -> bool:
     """Проверка текста на наличие нецензурной лексики"""
     if not text or len(text.strip()) == 0:
@@ -83,17 +37,11 @@ def contains_profanity(text: str) -> bool:
     if len(text) > MAX_COMMENT_LENGTH:
         return True
 
-    normalized = normalize_text(text)
-
-    for pattern in PROFANITY_PATTERNS:
-        try:
-            if re.search(pattern, normalized, re.IGNORECASE):
-                logger.info(
-                    f"Обнаружена нецензурная лексика в тексте: {text[:50]}...")
-                return True
-        except re.error as e:
-            logger.error(f"Ошибка в регулярном выражении {pattern}: {e}")
-            continue
+    term = profanity.check(text)
+    if term:
+        logger.info(f"Обнаружена нецензурная лексика ('{term}') в тексте: "
+                    f"{text[:50]}...")
+        return True
 
     return False
 
@@ -128,20 +76,20 @@ def get_stars_keyboard(order_id: int,
 async def request_review(bot_or_context, user_id: int, order_id: int) -> bool:
     """Отправить запрос на отзыв пользователю"""
     try:
-        order = get_order(order_id)
+        order = await get_order(order_id)
         if not order:
             logger.warning(f"Заказ {order_id} не найден при запросе отзыва")
             return False
 
         # Проверяем, не оставлял ли уже пользователь отзыв на этот заказ
-        if has_review(order_id):
+        if await has_review(order_id):
             logger.info(
                 f"Пользователь {user_id} уже оставил отзыв на заказ {order_id}"
             )
             return False
 
         # Получаем средний рейтинг мастерской
-        avg_rating = get_average_rating()
+        avg_rating = await get_average_rating()
 
         # Формируем текст в зависимости от наличия рейтинга
         if avg_rating and avg_rating > 0:
@@ -209,7 +157,7 @@ async def handle_rating(update: Update,
             return ConversationHandler.END
 
         # Проверяем, существует ли заказ
-        order = get_order(order_id)
+        order = await get_order(order_id)
         if not order:
             logger.error(f"Заказ {order_id} не найден")
             if query.message:
@@ -219,7 +167,7 @@ async def handle_rating(update: Update,
             return ConversationHandler.END
 
         # Проверяем, не оставлял ли уже пользователь отзыв на этот заказ
-        if has_review(order_id):
+        if await has_review(order_id):
             if query.message:
                 await query.edit_message_text(
                     "✅ Вы уже оставили отзыв на этот заказ. Спасибо!",
@@ -323,12 +271,12 @@ async def handle_comment(update: Update,
             return ENTER_COMMENT
 
         # Создаем отзыв в базе данных
-        review_id = create_review(order_id=order_id,
-                                  user_id=user_id,
-                                  rating=rating,
-                                  comment=comment,
-                                  is_approved=is_approved,
-                                  rejected_reason=rejected_reason)
+        review_id = await create_review(order_id=order_id,
+                                        user_id=user_id,
+                                        rating=rating,
+                                        comment=comment,
+                                        is_approved=is_approved,
+                                        rejected_reason=rejected_reason)
 
         if review_id:
             stars = "⭐" * rating
@@ -407,11 +355,11 @@ async def skip_comment(update: Update,
             return ConversationHandler.END
 
         # Создаем отзыв только с оценкой
-        review_id = create_review(order_id=order_id,
-                                  user_id=user_id,
-                                  rating=rating,
-                                  comment=None,
-                                  is_approved=True)
+        review_id = await create_review(order_id=order_id,
+                                        user_id=user_id,
+                                        rating=rating,
+                                        comment=None,
+                                        is_approved=True)
 
         if review_id:
             stars = "⭐" * rating
@@ -496,7 +444,7 @@ async def notify_admins_about_review(context: ContextTypes.DEFAULT_TYPE,
     try:
         import os
 
-        admins = get_admins() or []
+        admins = await get_admins() or []
         admin_ids: List[int] = [
             admin.user_id for admin in admins if admin.user_id
         ]
@@ -578,7 +526,7 @@ async def show_review_stats(update: Update,
 
         user_id = update.effective_user.id
 
-        if not is_user_admin(user_id):
+        if not await is_user_admin(user_id):
             if query.message:
                 await query.edit_message_text(
                     "❌ У вас нет прав для просмотра статистики отзывов.",
@@ -586,7 +534,7 @@ async def show_review_stats(update: Update,
             return
 
         # Получаем статистику
-        stats = get_review_stats()
+        stats = await get_review_stats()
 
         if not stats or stats.get('total_reviews', 0) == 0:
             if query.message:
@@ -625,7 +573,7 @@ async def show_review_stats(update: Update,
                 stats_text += f"{stars}: {count} ({percentage:.1f}%) {bar}\n"
 
         # Получаем последние отзывы
-        recent_reviews = get_recent_reviews(limit=5)
+        recent_reviews = await get_recent_reviews(limit=5)
         if recent_reviews:
             stats_text += "\n*Последние отзывы:*\n"
             for review in recent_reviews:
@@ -666,7 +614,7 @@ async def handle_admin_review_action(update: Update,
 
         user_id = update.effective_user.id
 
-        if not is_user_admin(user_id):
+        if not await is_user_admin(user_id):
             if query.message:
                 await query.edit_message_text(
                     "❌ У вас нет прав для выполнения этого действия.",
@@ -691,12 +639,12 @@ async def handle_admin_review_action(update: Update,
         action_text = ""
 
         if action == "admin_review_approve":
-            success = update_review_status(review_id, is_approved=True)
+            success = await update_review_status(review_id, is_approved=True)
             action_text = "одобрен"
         elif action == "admin_review_reject":
-            success = update_review_status(review_id,
-                                           is_approved=False,
-                                           rejected_reason="rejected_by_admin")
+            success = await update_review_status(review_id,
+                                                 is_approved=False,
+                                                 rejected_reason="rejected_by_admin")
             action_text = "отклонён"
         else:
             logger.error(f"Неизвестное действие: {action}")
@@ -747,7 +695,7 @@ async def request_review_command(update: Update,
     try:
         user_id = update.effective_user.id
 
-        if not is_user_admin(user_id):
+        if not await is_user_admin(user_id):
             await update.message.reply_text(
                 "❌ У вас нет прав для выполнения этой команды.")
             return
@@ -47,10 +47,15 @@ from handlers.orders import (
 from handlers.reviews import get_review_conversation_handler, request_review
 from keyboards import (get_main_menu, get_prices_menu, get_faq_menu,
                        get_back_button, get_admin_main_menu)
-from utils.database import (init_db, get_user_orders,
-                            get_orders_pending_feedback,
-                            mark_feedback_requested)
+from utils.database import init_db
+from utils.async_database import (get_user_orders,
+                                  get_orders_pending_feedback,
+                                  mark_feedback_requested,
+                                  flush_pending_writes,
+                                  run_in_db_executor)
 from utils.prices import format_prices_text, import_prices_data
+from utils.retrieval import retriever
+from utils.knowledge_reloader import knowledge_reloader
 
 _lock = None
 logger = logging.getLogger(__name__)
@@ -114,7 +119,7 @@ async def callback_services(update, context):
 
 async def callback_price_category(update, context, category):
     await update.callback_query.answer()
-    prices_text = format_prices_text(category)
+    prices_text = await run_in_db_executor(format_prices_text, category)
     if prices_text:
         await update.callback_query.edit_message_text(
             text=prices_text,
@@ -161,7 +166,7 @@ async def callback_price_dress(update, context):
 async def callback_check_status(update, context):
     await update.callback_query.answer()
     user_id = update.effective_user.id
-    orders = get_user_orders(user_id)
+    orders = await get_user_orders(user_id)
     if not orders:
         text = "🔍 У вас нет заказов.\n\nПозвоните нам: " + WORKSHOP_INFO[
             "phone"]
@@ -335,7 +340,7 @@ async def menu_command(update, context):
 async def admin_panel_command(update, context):
     user_id = update.effective_user.id
     from handlers.admin import is_user_admin
-    if not is_user_admin(user_id):
+    if not await is_user_admin(user_id):
         if update.message:
             await update.message.reply_text(
                 "⛔ У вас нет доступа к этой команде.")
@@ -407,7 +412,7 @@ def main() -> None:
             await asyncio.sleep(60)
             while True:
                 try:
-                    orders = get_orders_pending_feedback()
+                    orders = await get_orders_pending_feedback()
                     for order in orders:
                         try:
                             user_id = int(
@@ -415,7 +420,7 @@ def main() -> None:
                             order_id = int(order.id) if order.id else 0
                             await request_review(application, user_id,
                                                  order_id)
-                            mark_feedback_requested(order_id)
+                            await mark_feedback_requested(order_id)
                         except Exception as e:
                             logger.error(f"Failed review request: {e}")
                 except Exception as e:
@@ -427,8 +432,26 @@ def main() -> None:
         except Exception as e:
             logger.error(f"Не удалось запустить фоновую задачу: {e}")
 
+        try:
+            await admin.resume_broadcasts(application)
+        except Exception as e:
+            logger.error(f"Не удалось продолжить рассылки: {e}")
+
+        # Индекс базы знаний для промптов строим до первого вопроса; при
+        # ошибке бот стартует с пустым индексом и отвечает без фрагментов
+        try:
+            await retriever.refresh(force=True)
+        except Exception as e:
+            logger.error(f"Не удалось построить индекс базы знаний: {e}")
+        knowledge_reloader.start()
+
+    async def post_shutdown(application):
+        knowledge_reloader.stop()
+        # Дописываем в БД накопленную активность и историю чатов
+        await flush_pending_writes()
+
     app_bot = ApplicationBuilder().token(BOT_TOKEN).post_init(
-        post_init).build()
+        post_init).post_shutdown(post_shutdown).build()
     app_bot.add_handler(TypeHandler(Update, log_all_updates), group=-1)
 
     order_conversation = ConversationHandler(
@@ -480,7 +503,7 @@ def main() -> None:
     async def handle_broadcast_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Проверяем, является ли пользователь админом
         from handlers.admin import is_user_admin, broadcast_send
-        if not update.effective_user or not is_user_admin(update.effective_user.id):
+        if not update.effective_user or not await is_user_admin(update.effective_user.id):
             return
 
         if context.user_data.get("broadcast_mode"):
@@ -575,9 +598,12 @@ def main() -> None:
             CallbackQueryHandler(globals()[f"callback_faq_{sub}"],
                                  pattern=f"^faq_{sub}$"))
 
+    # block=False: ответы AI готовятся параллельно и не задерживают
+    # обработку остальных обновлений (кнопки, заказы, другие пользователи)
     app_bot.add_handler(
         MessageHandler(filters.TEXT & ~filters.COMMAND,
-                       messages.handle_message))
+                       messages.handle_message,
+                       block=False))
 
     async def error_handler(update, context):
         logger.error(f"Exception: {context.error}")
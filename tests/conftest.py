@@ -0,0 +1,29 @@
+import os
+import sys
+import time
+
+import pytest
+
+# Модули бота импортируются как в main.py — от корня репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# utils.database создаёт engine при импорте; тесты не трогают workshop.db
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+
+class Clock:
+    """Ручные часы: тест сам двигает now"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Подменяет time.monotonic и time.time на ручные часы"""
+    clock = Clock()
+    monkeypatch.setattr(time, 'monotonic', clock)
+    monkeypatch.setattr(time, 'time', clock)
+    return clock
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from utils import broadcast as broadcast_module
+from utils.broadcast import TokenBucket, run_broadcast
+
+RECIPIENTS = [(i, 1000 + i) for i in range(1, 6)]
+
+
+class Bot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        self.sent.append(chat_id)
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    """Фейковые функции БД рассылки; fail_writes — сколько записей провалить"""
+    real_sleep = asyncio.sleep
+    storage = {'fail_writes': 0, 'writes': 0, 'recorded': [],
+               'finished': False, 'delays': []}
+
+    async def count(broadcast_id):
+        return len(RECIPIENTS)
+
+    async def recipients(broadcast_id, after_id, limit):
+        return [row for row in RECIPIENTS if row[0] > after_id][:limit]
+
+    async def record(broadcast_id, results):
+        # Как database.record_broadcast_deliveries: ошибка БД — это False
+        storage['writes'] += 1
+        if storage['writes'] <= storage['fail_writes']:
+            return False
+        storage['recorded'].extend(results)
+        return True
+
+    async def finish(broadcast_id):
+        storage['finished'] = True
+
+    async def sleep(delay):
+        storage['delays'].append(delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(broadcast_module, 'count_broadcast_recipients', count)
+    monkeypatch.setattr(broadcast_module, 'get_broadcast_recipients', recipients)
+    monkeypatch.setattr(broadcast_module, 'record_broadcast_deliveries', record)
+    monkeypatch.setattr(broadcast_module, 'finish_broadcast', finish)
+    monkeypatch.setattr(broadcast_module.asyncio, 'sleep', sleep)
+    return storage
+
+
+def test_all_recipients_recorded_and_finished(storage):
+    bot = Bot()
+    progress = asyncio.run(run_broadcast(bot, 1, "Акция"))
+    assert sorted(bot.sent) == [user_id for _, user_id in RECIPIENTS]
+    assert progress.sent == 5 and progress.done
+    assert len(storage['recorded']) == 5
+    assert storage['finished']
+
+
+def test_failed_write_is_retried(storage):
+    storage['fail_writes'] = 2
+    progress = asyncio.run(run_broadcast(Bot(), 1, "Акция"))
+    assert storage['writes'] == 3
+    # Пауза перед повтором растёт: 1 с, 2 с
+    assert [d for d in storage['delays'] if d in (1, 2, 4)] == [1, 2]
+    assert sorted(r[0] for r in storage['recorded']) == [u for _, u in RECIPIENTS]
+    assert storage['finished'] and progress.done
+
+
+def test_unrecorded_broadcast_stays_running(storage):
+    storage['fail_writes'] = 100
+    with pytest.raises(RuntimeError, match='5 deliveries not recorded'):
+        asyncio.run(run_broadcast(Bot(), 1, "Акция"))
+    # Три попытки плюс последняя в finally, каждая с полной пачкой
+    assert storage['writes'] == 4
+    assert storage['recorded'] == []
+    assert not storage['finished']
+
+
+def test_pause_does_not_accumulate_tokens(clock):
+    bucket = TokenBucket(rate=10)
+    bucket.pause(30)
+    clock.now += 30.5
+    asyncio.run(bucket.acquire())
+    # За 0.5 с после паузы накопилось 5 токенов, а не весь запас
+    assert bucket._tokens == 4
@@ -0,0 +1,97 @@
+from utils.cache import ResponseCache, make_cache_key
+
+
+def test_key_ignores_case_punctuation_and_yo():
+    assert make_cache_key("Где вы? ") == make_cache_key("где  вы")
+    assert make_cache_key("Ещё") == make_cache_key("еще")
+
+
+def test_key_depends_on_variant():
+    assert make_cache_key("адрес", ('a', 1)) != make_cache_key("адрес", ('a', 2))
+
+
+def test_get_returns_value_for_same_variant_only():
+    cache = ResponseCache()
+    cache.set("Сколько стоит?", "500 ₽", ('friendly',))
+    assert cache.get("сколько стоит", ('friendly',)) == "500 ₽"
+    assert cache.get("сколько стоит", ('formal',)) is None
+
+
+def test_lru_evicts_least_recently_used():
+    cache = ResponseCache(max_entries=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a")
+    cache.set("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+    assert cache.stats()['evictions'] == 1
+
+
+def test_byte_limit_evicts_oldest():
+    cache = ResponseCache(max_bytes=10)
+    cache.set("a", "12345")
+    cache.set("b", "12345")
+    cache.set("c", "1")
+    assert cache.get("a") is None
+    assert cache.stats()['bytes'] == 6
+
+
+def test_bytes_are_counted_in_utf8():
+    cache = ResponseCache()
+    cache.set("a", "ё")
+    assert cache.stats()['bytes'] == 2
+
+
+def test_oversized_response_is_not_cached():
+    cache = ResponseCache(max_bytes=4)
+    cache.set("a", "12345")
+    assert len(cache) == 0
+
+
+def test_overwrite_keeps_byte_count_exact():
+    cache = ResponseCache()
+    cache.set("a", "12345")
+    cache.set("a", "12")
+    assert len(cache) == 1
+    assert cache.stats()['bytes'] == 2
+
+
+def test_entry_expires_after_ttl(clock):
+    cache = ResponseCache(ttl=10)
+    cache.set("a", "1")
+    clock.now += 9
+    assert cache.get("a") == "1"
+    clock.now += 1
+    assert cache.get("a") is None
+    assert cache.stats()['expirations'] == 1
+    assert cache.stats()['bytes'] == 0
+
+
+def test_set_expires_old_entries_without_full_scan(clock):
+    cache = ResponseCache(ttl=10)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    clock.now += 20
+    cache.set("c", "3")
+    assert len(cache) == 1
+
+
+def test_clear_old_removes_only_expired(clock):
+    cache = ResponseCache(ttl=10)
+    cache.set("a", "1")
+    clock.now += 5
+    cache.set("b", "2")
+    clock.now += 6
+    cache.clear_old()
+    assert cache.get("a") is None
+    assert cache.get("b") == "2"
+
+
+def test_hit_rate():
+    cache = ResponseCache()
+    cache.set("a", "1")
+    cache.get("a")
+    cache.get("b")
+    assert cache.stats()['hit_rate'] == 0.5
@@ -0,0 +1,132 @@
+import pytest
+
+from utils.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+)
+
+
+def make_breaker(**kwargs):
+    options = dict(window=10, window_seconds=60, min_calls=4,
+                   failure_rate=0.5, slow_call_seconds=5, slow_rate=0.8,
+                   open_seconds=30)
+    options.update(kwargs)
+    return CircuitBreaker('test', **options)
+
+
+def call(breaker, success=True, duration=0.1):
+    breaker.acquire()
+    breaker.record(success, duration)
+
+
+def test_stays_closed_below_min_calls(clock):
+    breaker = make_breaker()
+    for _ in range(3):
+        call(breaker, success=False)
+    assert breaker.state == CLOSED
+
+
+def test_opens_on_failure_rate(clock):
+    breaker = make_breaker()
+    call(breaker)
+    call(breaker)
+    call(breaker, success=False)
+    assert breaker.state == CLOSED
+    call(breaker, success=False)
+    assert breaker.state == OPEN
+    assert breaker.stats()['opened'] == 1
+
+
+def test_opens_on_slow_calls(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        call(breaker, duration=6)
+    assert breaker.state == OPEN
+
+
+def test_old_calls_leave_the_window(clock):
+    breaker = make_breaker()
+    for _ in range(3):
+        call(breaker, success=False)
+    clock.now += 61
+    call(breaker, success=False)
+    assert breaker.state == CLOSED
+
+
+def test_open_rejects_until_timeout(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        call(breaker, success=False)
+    assert not breaker.available()
+    with pytest.raises(CircuitOpenError):
+        breaker.acquire()
+    assert breaker.stats()['rejected'] == 1
+    assert breaker.stats()['retry_in_seconds'] == 30
+    clock.now += 30
+    assert breaker.available()
+
+
+def test_half_open_allows_single_probe(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        call(breaker, success=False)
+    clock.now += 30
+    breaker.acquire()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.available()
+    with pytest.raises(CircuitOpenError):
+        breaker.acquire()
+
+
+def test_successful_probe_closes(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        call(breaker, success=False)
+    clock.now += 30
+    call(breaker)
+    assert breaker.state == CLOSED
+    # Ошибки до размыкания забыты
+    call(breaker, success=False)
+    assert breaker.state == CLOSED
+
+
+@pytest.mark.parametrize('success, duration', [(False, 0.1), (True, 6)])
+def test_failed_or_slow_probe_reopens(clock, success, duration):
+    breaker = make_breaker()
+    for _ in range(4):
+        call(breaker, success=False)
+    clock.now += 30
+    call(breaker, success=success, duration=duration)
+    assert breaker.state == OPEN
+    assert breaker.stats()['opened'] == 2
+    assert not breaker.available()
+
+
+def test_released_probe_frees_the_slot(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        call(breaker, success=False)
+    clock.now += 30
+    breaker.acquire()
+    breaker.release()
+    assert breaker.state == HALF_OPEN
+    breaker.acquire()
+
+
+def test_latency_quantiles_use_successful_calls(clock):
+    breaker = make_breaker(min_calls=100)
+    for duration in (1, 2, 3, 4):
+        call(breaker, duration=duration)
+    call(breaker, success=False, duration=50)
+    assert breaker.latency(0.5) == 3
+    assert breaker.latency(0.95) == 4
+    stats = breaker.stats()
+    assert stats['calls'] == 5
+    assert stats['error_rate'] == 0.2
+
+
+def test_latency_without_calls_is_zero():
+    assert make_breaker().latency() == 0.0
@@ -0,0 +1,126 @@
+import random
+import re
+
+import pytest
+
+from utils.adaptive_prompts import (
+    COMPLEX_KEYWORDS,
+    SIMPLE_KEYWORDS,
+    TOPIC_KEYWORDS,
+    analyze_question_complexity,
+    detect_topic,
+)
+from utils.anti_spam import BLACKLIST_WORDS, WHITELIST_WORDS
+from utils.gigachat_api import ESCALATION_KEYWORDS, UNCERTAIN_PHRASES
+from utils.keyword_matcher import KeywordMatcher, _trie_regex
+
+GROUPS = {
+    'spam': BLACKLIST_WORDS,
+    'whitelist': WHITELIST_WORDS,
+    'complexity:simple': SIMPLE_KEYWORDS,
+    'complexity:complex': COMPLEX_KEYWORDS,
+    'escalation': ESCALATION_KEYWORDS,
+    'uncertain': UNCERTAIN_PHRASES,
+    **{f'topic:{topic}': words for topic, words in TOPIC_KEYWORDS},
+}
+
+
+def legacy_scan(text: str) -> dict:
+    """Как раньше: `word in text.lower()` по каждому списку"""
+    text_lower = text.lower()
+    found = {}
+    for group, words in GROUPS.items():
+        hits = sorted(w for w in words if w in text_lower)
+        if hits:
+            found[group] = hits
+    return found
+
+
+def legacy_complexity(message: str) -> str:
+    message_lower = message.lower()
+    word_count = len(message.split())
+    if any(kw in message_lower for kw in SIMPLE_KEYWORDS) and word_count < 10:
+        return 'simple'
+    elif any(kw in message_lower for kw in COMPLEX_KEYWORDS) or word_count > 20:
+        return 'complex'
+    return 'medium'
+
+
+def legacy_topic(message: str) -> str:
+    message_lower = message.lower()
+    for topic, words in TOPIC_KEYWORDS:
+        if any(kw in message_lower for kw in words):
+            return topic
+    return 'general'
+
+
+def random_messages(count: int) -> list:
+    rng = random.Random(17)
+    vocabulary = [w for words in GROUPS.values() for w in words]
+    filler = ('здравствуйте подскажите пожалуйста мне нужно вещь сегодня '
+              'завтра вечером дочке сыну старую новую КАК Сколько').split()
+    return [' '.join(rng.choice(filler if rng.random() < 0.7 else vocabulary)
+                     for _ in range(rng.randint(1, 25)))
+            for _ in range(count)]
+
+
+@pytest.fixture(scope='module')
+def matcher():
+    matcher = KeywordMatcher()
+    for group, words in GROUPS.items():
+        matcher.set_group(group, words)
+    return matcher
+
+
+def test_scan_matches_legacy_loops(matcher):
+    for text in random_messages(2000):
+        actual = {group: sorted(words)
+                  for group, words in matcher.scan(text).items()}
+        assert actual == legacy_scan(text), text
+
+
+def test_topic_and_complexity_match_legacy():
+    for text in random_messages(2000):
+        assert detect_topic(text) == legacy_topic(text), text
+        assert analyze_question_complexity(text) == legacy_complexity(text), text
+
+
+def test_nested_words_are_all_found(matcher):
+    found = matcher.scan("Сколько стоит?")
+    assert 'сколько стоит' in found['whitelist']
+    assert 'сколько' in found['complexity:simple']
+
+
+def test_substring_prefixes_still_match(matcher):
+    assert matcher.first("Инвестиции без риска", 'spam') == 'инвестиц'
+    assert matcher.has("Порвалась куртка", 'whitelist')
+
+
+def test_empty_text_and_no_hits(matcher):
+    assert matcher.scan("") == {}
+    assert matcher.scan("добрый день") == {}
+
+
+def test_runtime_changes_recompile_and_reset_cache():
+    matcher = KeywordMatcher()
+    matcher.set_group('spam', ['казино'])
+    assert matcher.has("Лучшее казино", 'spam')
+    version = matcher.version
+    matcher.remove_words('spam', ['казино'])
+    assert not matcher.has("Лучшее казино", 'spam')
+    matcher.add_words('spam', ['Лучшее'])
+    assert matcher.first("Лучшее казино", 'spam') == 'лучшее'
+    assert matcher.version == version + 2
+    assert matcher.words('spam') == ['лучшее']
+
+
+def test_trie_regex_prefers_longest_word():
+    pattern = re.compile(_trie_regex(['сколько', 'сколько стоит', 'ско']))
+    assert pattern.match("сколько стоит брюки").group() == 'сколько стоит'
+    assert pattern.match("сколь").group() == 'ско'
+
+
+def test_trie_regex_with_repeats():
+    pattern = re.compile(_trie_regex(['бля'], repeats=True))
+    assert pattern.fullmatch("бббляяяя")
+    assert not pattern.fullmatch("бя")
@@ -0,0 +1,67 @@
+import pytest
+
+from handlers.reviews import contains_profanity
+from utils.profanity import ProfanityFilter, normalize_text, profanity
+
+
+@pytest.mark.parametrize('text, term', [
+    ("бля", 'бля'),
+    ("Ну бля, опять", 'бля'),
+    ("БЛЯЯЯЯ", 'бля'),
+    ("б.л.я", 'бля'),
+    ("блядь", 'блядь'),
+    ("Сука", 'сука'),
+    ("пиздец", 'пиздец'),
+    ("х.у.й", 'хуй'),
+    ("х-у-й-н-я", 'хуй'),
+    ("п1зд@", 'пизда'),
+    ("36ать", 'ебать'),
+    ("подъебать", 'еба'),
+    ("fuck you", 'fuck'),
+    ("SHIIIT", 'shit'),
+    ("говно", 'говн'),
+])
+def test_swears_are_found(text, term):
+    assert profanity.check(text) == term
+
+
+@pytest.mark.parametrize('text', [
+    "Заменили молнию за 800 рублей",
+    "Отдала 2 рубля сверху",
+    "Мастер меня оскорбляет",
+    "Часто употребляю это ателье",
+    "Шов не ослабляет ткань",
+    "Это только усугубляет дело",
+    "Мой спорт — гребля",
+    "Ателье находится у метро",
+    "Застрахуйте вещи перед химчисткой",
+    "Купила хлеба по дороге",
+    "Учеба в ателье видна",
+    "Читаю Dickens в очереди",
+    "We assist with assembly",
+    "",
+])
+def test_ordinary_words_pass(text):
+    assert profanity.check(text) is None
+
+
+def test_normalize_text_decodes_leetspeak_and_drops_separators():
+    assert normalize_text("П1.З-Д*") == "пизд"
+    assert normalize_text("h3llo") == "hеllo"
+
+
+def test_custom_lists():
+    words = ProfanityFilter(word_prefixes=['дурак'], inner_terms=[],
+                            safe_prefixes=['дураков'])
+    assert not words.contains("Сам дурачина")
+    assert words.check("ты дураккк") == 'дурак'
+    assert not words.contains("дураковатый вид")
+
+
+def test_empty_lists_match_nothing():
+    assert not ProfanityFilter(word_prefixes=[], inner_terms=[]).contains("что угодно")
+
+
+def test_review_check_uses_filter():
+    assert contains_profanity("Отличное ателье, сука")
+    assert not contains_profanity("Мастер меня оскорбляет, но шьёт хорошо")
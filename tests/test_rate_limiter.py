@@ -0,0 +1,143 @@
+import asyncio
+import random
+import threading
+
+from utils import anti_spam as anti_spam_module
+from utils.anti_spam import AntiSpamSystem, MemorySpamState, RateLimiter
+
+
+class LegacyLimiter:
+    """Прежнее скользящее окно: фильтрация списка отметок на каждом сообщении"""
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.messages = {}
+
+    def hit(self, user_id, now):
+        stamps = [t for t in self.messages.get(user_id, []) if t > now - self.window]
+        self.messages[user_id] = stamps
+        if len(stamps) >= self.limit:
+            return False
+        stamps.append(now)
+        return True
+
+    def wait_time(self, user_id, now):
+        stamps = self.messages.get(user_id)
+        if not stamps:
+            return 0
+        return max(0, int(stamps[0] + self.window - now) + 1)
+
+
+def test_matches_legacy_sliding_window():
+    rng = random.Random(18)
+    limiter = RateLimiter(limit=5, window=60)
+    legacy = LegacyLimiter(limit=5, window=60)
+    now = 1000.0
+    for _ in range(20000):
+        now += rng.expovariate(1 / 3)
+        user_id = rng.randint(1, 20)
+        allowed = limiter.hit(user_id, now)
+        assert allowed == legacy.hit(user_id, now)
+        if not allowed:
+            # Время ожидания показывается только отклонённому сообщению
+            assert limiter.wait_time(user_id, now) == legacy.wait_time(user_id, now)
+
+
+def test_limit_and_window_boundary():
+    limiter = RateLimiter(limit=3, window=60)
+    assert all(limiter.hit(1, 100 + i) for i in range(3))
+    assert not limiter.hit(1, 103)
+    # Отклонённое сообщение не продлевает окно
+    assert not limiter.hit(1, 159.9)
+    assert limiter.hit(1, 160.1)
+
+
+def test_wait_time():
+    limiter = RateLimiter(limit=2, window=60)
+    assert limiter.wait_time(1, 100) == 0
+    limiter.hit(1, 100)
+    limiter.hit(1, 110)
+    assert limiter.wait_time(1, 130) == 31
+
+
+def test_users_are_independent_and_reset():
+    limiter = RateLimiter(limit=1, window=60)
+    assert limiter.hit(1, 100)
+    assert limiter.hit(2, 100)
+    assert not limiter.hit(1, 101)
+    limiter.reset(1)
+    assert limiter.hit(1, 102)
+
+
+def test_memory_stays_bounded():
+    limiter = RateLimiter(limit=5, window=60, max_users=100)
+    for user_id in range(1000):
+        limiter.hit(user_id, 100)
+    assert len(limiter) == 100
+    assert limiter.evicted == 900
+    # Вытесняются самые давние по активности
+    limiter.hit(0, 101)
+    assert limiter.evicted == 901
+    assert len(limiter) == 100
+
+
+def test_idle_users_are_swept():
+    limiter = RateLimiter(limit=5, window=60)
+    for user_id in range(10):
+        limiter.hit(user_id, 100 + user_id)
+    limiter.hit(42, 165)
+    # Отметки пользователей 0–5 не новее now - window, 6–9 ещё в окне
+    assert len(limiter) == 5
+    assert limiter.swept == 6
+
+
+def test_memory_state_mute_expires():
+    state = MemorySpamState(limit=5, window=60)
+    state.mute(1, until=200)
+    assert state.get_mute(1, 150) == 200
+    assert state.get_mute(1, 200) is None
+    state.mute(2, until=300)
+    state.unmute(2)
+    assert state.get_mute(2, 150) is None
+
+
+def test_memory_check_logs_spam_off_event_loop(monkeypatch):
+    logged = []
+    monkeypatch.setattr(anti_spam_module.database, 'log_spam',
+                        lambda *args: logged.append((threading.get_ident(), args)))
+    system = AntiSpamSystem(state=MemorySpamState(limit=5, window=60))
+
+    async def run():
+        return threading.get_ident(), await system.check(1, "Лучшее казино")
+
+    loop_thread, (is_spam, _) = asyncio.run(run())
+    assert is_spam
+    assert len(logged) == 1
+    assert logged[0][0] != loop_thread
+    assert logged[0][1][0] == 1
+
+
+def test_memory_mute_lifted_from_admin_panel(monkeypatch):
+    stored = {}
+    monkeypatch.setattr(anti_spam_module.database, 'log_spam', lambda *args: None)
+    monkeypatch.setattr(anti_spam_module.database, 'set_mute',
+                        lambda user_id, until, reason=None: stored.update({user_id: until}))
+    monkeypatch.setattr(anti_spam_module.database, 'get_active_mute_ids',
+                        lambda user_ids: set(user_ids) & set(stored))
+    state = MemorySpamState(limit=5, window=60, sync_interval=0)
+    system = AntiSpamSystem(state=state)
+
+    async def run():
+        first = await system.check(1, "Лучшее казино")
+        assert 1 in stored
+        second = await system.check(1, "Добрый день")
+        # Веб-админка удалила мут из spam_mutes
+        del stored[1]
+        third = await system.check(1, "Добрый день")
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    assert first[0] and second[0]
+    assert third == (False, "")
+    assert state.mutes == {}
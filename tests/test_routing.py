@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from utils import gigachat_api as gigachat_module
+from utils.cache import ResponseCache
+from utils.gigachat_api import GigaChatAPI
+from utils.semantic_cache import SemanticCache
+
+
+@pytest.fixture
+def api(monkeypatch):
+    monkeypatch.setattr(gigachat_module, 'ROUTE_SIMPLE_LOCAL', True)
+    # Маршрутизация проверяется без интентов и общих кэшей
+    monkeypatch.setattr(gigachat_module, 'ROUTE_INTENTS', False)
+    monkeypatch.setattr(gigachat_module, 'cache', ResponseCache())
+    monkeypatch.setattr(gigachat_module, 'semantic_cache', SemanticCache())
+    api = GigaChatAPI()
+    api.client = object()
+    api.asked = []
+
+    async def complete(payload, on_partial=None):
+        api.asked.append(payload)
+        return "Ответ модели"
+
+    monkeypatch.setattr(api, '_complete', complete)
+    return api
+
+
+def test_short_question_without_good_match_reaches_model(api):
+    answer, _ = asyncio.run(api.get_response("сколько у вас мастеров"))
+    assert answer == "Ответ модели"
+    assert len(api.asked) == 1
+    assert api.routes == {'model': 1}
+
+
+def test_short_question_with_confident_match_stays_local(api):
+    answer, needs_human = asyncio.run(
+        api.get_response("сколько стоит укоротить джинсы"))
+    assert "Укоротить джинсы" in answer and not needs_human
+    assert api.asked == []
+    assert api.routes == {'local_simple': 1}
+
+
+def test_local_route_is_off_by_default(api, monkeypatch):
+    monkeypatch.setattr(gigachat_module, 'ROUTE_SIMPLE_LOCAL', False)
+    asyncio.run(api.get_response("сколько стоит укоротить джинсы"))
+    assert len(api.asked) == 1
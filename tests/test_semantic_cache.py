@@ -0,0 +1,93 @@
+import pytest
+
+from utils.semantic_cache import SemanticCache
+
+
+def test_reworded_question_hits():
+    cache = SemanticCache()
+    cache.add("Сколько стоит подшить брюки?", "от 500 ₽")
+    assert cache.get("Подшить брюки, какая стоимость?") == "от 500 ₽"
+    assert cache.stats()['hits'] == 1
+
+
+def test_word_forms_hit():
+    cache = SemanticCache()
+    cache.add("цена подшива брюк", "от 500 ₽")
+    assert cache.get("сколько стоит подшить брюки") == "от 500 ₽"
+    assert cache.get("почём подшивка брюк?") == "от 500 ₽"
+
+
+def test_different_question_misses():
+    cache = SemanticCache()
+    cache.add("Сколько стоит подшить брюки?", "от 500 ₽")
+    assert cache.get("Сколько стоит ушить платье?") is None
+    assert cache.get("Где вы находитесь?") is None
+    assert cache.get("Сколько стоит подшить джинсы?") is None
+
+
+def test_similar_verbs_miss():
+    cache = SemanticCache()
+    cache.add("ушить платье", "от 900 ₽")
+    assert cache.get("расшить платье") is None
+
+
+def test_threshold_is_respected():
+    cache = SemanticCache(threshold=0.95)
+    cache.add("Сколько стоит подшить брюки?", "от 500 ₽")
+    assert cache.get("Подшить брюки, какая стоимость?") is None
+    assert cache.get("сколько стоит подшить брюки") == "от 500 ₽"
+
+
+def test_numbers_must_match_exactly():
+    cache = SemanticCache()
+    cache.add("Статус заказа 1234", "Готов")
+    assert cache.get("Статус заказа 1235") is None
+    assert cache.get("статус заказа 1234") == "Готов"
+
+
+def test_other_prompt_variant_misses():
+    cache = SemanticCache()
+    cache.add("Какой у вас адрес?", "Бусиново", ('friendly',))
+    assert cache.get("Какой у вас адрес?", ('formal',)) is None
+    assert cache.get("Какой у вас адрес?", ('friendly',)) == "Бусиново"
+
+
+def test_entry_expires_after_ttl(clock):
+    cache = SemanticCache(ttl=10)
+    cache.add("Какой у вас адрес?", "Бусиново")
+    clock.now += 11
+    assert cache.get("Какой у вас адрес?") is None
+
+
+def test_full_cache_evicts_expired_slot_first(clock):
+    cache = SemanticCache(max_entries=2, ttl=10)
+    cache.add("Какой у вас адрес?", "Бусиново")
+    clock.now += 5
+    cache.add("Сколько стоит подшить брюки?", "от 500 ₽")
+    cache.get("Сколько стоит подшить брюки?")
+    clock.now += 6
+    cache.add("Принимаете карты?", "Да")
+    assert cache.stats()['evictions'] == 1
+    assert cache.get("Сколько стоит подшить брюки?") == "от 500 ₽"
+    assert cache.get("Принимаете карты?") == "Да"
+
+
+def test_full_cache_evicts_least_used(clock):
+    cache = SemanticCache(max_entries=2)
+    cache.add("Какой у вас адрес?", "Бусиново")
+    cache.add("Сколько стоит подшить брюки?", "от 500 ₽")
+    cache.get("Какой у вас адрес?")
+    cache.add("Принимаете карты?", "Да")
+    assert cache.get("Какой у вас адрес?") == "Бусиново"
+    assert cache.get("Сколько стоит подшить брюки?") is None
+
+
+def test_knowledge_change_clears_cache():
+    cache = SemanticCache()
+    cache.sync_knowledge(1, lambda: ["Подшив брюк — 500 ₽"])
+    cache.add("Какой у вас адрес?", "Бусиново")
+    cache.sync_knowledge(1, lambda: pytest.fail("IDF пересчитан без изменений"))
+    assert cache.get("Какой у вас адрес?") == "Бусиново"
+    cache.sync_knowledge(2, lambda: ["Подшив брюк — 600 ₽"])
+    assert cache.get("Какой у вас адрес?") is None
+    assert cache.stats()['knowledge_version'] == 2
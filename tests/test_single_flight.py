@@ -0,0 +1,163 @@
+import asyncio
+
+import pytest
+
+from utils.cache import SingleFlight
+
+
+def test_concurrent_calls_share_one_request():
+    async def scenario():
+        flights = SingleFlight()
+        calls = 0
+        release = asyncio.Event()
+
+        async def request():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return "ответ"
+
+        tasks = [asyncio.create_task(flights.do('k', request)) for _ in range(5)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*tasks)
+        return calls, results, flights.stats()
+
+    calls, results, stats = asyncio.run(scenario())
+    assert calls == 1
+    assert [answer for answer, _ in results] == ["ответ"] * 5
+    assert [leader for _, leader in results].count(True) == 1
+    assert stats == {'in_flight': 0, 'leaders': 1, 'coalesced': 4}
+
+
+def test_different_keys_do_not_coalesce():
+    async def scenario():
+        flights = SingleFlight()
+
+        async def request():
+            await asyncio.sleep(0)
+            return 1
+
+        await asyncio.gather(flights.do('a', request), flights.do('b', request))
+        return flights.stats()
+
+    assert asyncio.run(scenario())['leaders'] == 2
+
+
+def test_sequential_calls_start_new_request():
+    async def scenario():
+        flights = SingleFlight()
+        calls = 0
+
+        async def request():
+            nonlocal calls
+            calls += 1
+            return calls
+
+        first = await flights.do('k', request)
+        second = await flights.do('k', request)
+        return first, second
+
+    assert asyncio.run(scenario()) == ((1, True), (2, True))
+
+
+def test_error_reaches_every_waiter():
+    async def scenario():
+        flights = SingleFlight()
+
+        async def request():
+            await asyncio.sleep(0)
+            raise ValueError("boom")
+
+        return await asyncio.gather(flights.do('k', request),
+                                    flights.do('k', request),
+                                    return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    async def scenario():
+        flights = SingleFlight()
+        release = asyncio.Event()
+        cancelled = False
+
+        async def request():
+            nonlocal cancelled
+            try:
+                await release.wait()
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            return "ответ"
+
+        leader = asyncio.create_task(flights.do('k', request))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.do('k', request))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        result = await follower
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return result, cancelled
+
+    (answer, was_leader), cancelled = asyncio.run(scenario())
+    assert answer == "ответ"
+    assert not was_leader
+    assert not cancelled
+
+
+def test_request_cancelled_when_all_waiters_cancel():
+    async def scenario():
+        flights = SingleFlight()
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def request():
+            started.set()
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        waiters = [asyncio.create_task(flights.do('k', request)) for _ in range(2)]
+        await started.wait()
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.wait_for(cancelled.wait(), 1)
+        await asyncio.sleep(0)
+        return flights.stats()
+
+    assert asyncio.run(scenario())['in_flight'] == 0
+
+
+def test_new_caller_does_not_join_cancelling_request():
+    async def scenario():
+        flights = SingleFlight()
+        calls = 0
+
+        async def request():
+            nonlocal calls
+            calls += 1
+            try:
+                await asyncio.sleep(60 if calls == 1 else 0)
+            except asyncio.CancelledError:
+                # Отмена обрабатывается не мгновенно
+                await asyncio.sleep(0)
+                raise
+            return calls
+
+        first = asyncio.create_task(flights.do('k', request))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        result = await flights.do('k', request)
+        await asyncio.gather(first, return_exceptions=True)
+        return result
+
+    assert asyncio.run(scenario()) == (2, True)
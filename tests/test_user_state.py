@@ -0,0 +1,48 @@
+import pytest
+
+from utils import database
+from utils.database import WriteBehindBuffer
+
+
+@pytest.fixture
+def buffer(monkeypatch):
+    database.init_db()
+    # Писатель не сработает сам — сбрасывать буфер должны только чтения
+    buffer = WriteBehindBuffer(flush_interval=60, batch_size=1000)
+    monkeypatch.setattr(database, 'write_behind', buffer)
+    yield buffer
+    buffer.stop()
+
+
+def chat(user_id, count):
+    state = database.load_user_state(user_id)
+    state.update_profile(first_name='Анна')
+    for i in range(count):
+        state.record_chat(f"Вопрос {i}", f"Ответ {i}", topic='цены')
+    database.save_user_state(state)
+
+
+def test_reload_sees_buffered_writes(buffer):
+    chat(501, 3)
+    assert buffer.pending()['users'] == 1
+    database.invalidate_user_state(501)
+    state = database.load_user_state(501)
+    assert state.exists
+    assert state.questions_count == 3
+    assert state.name == 'Анна'
+    assert [turn.message for turn in state.recent_turns][-1] == "Вопрос 2"
+    assert buffer.pending() == {'users': 0, 'history': 0}
+
+
+def test_counters_survive_repeated_eviction(buffer):
+    chat(502, 2)
+    database.invalidate_user_state(502)
+    chat(502, 2)
+    database.invalidate_user_state(502)
+    assert database.load_user_state(502).questions_count == 4
+
+
+def test_first_visit_sees_buffered_user(buffer):
+    chat(503, 1)
+    assert database.check_today_first_visit(503)
+    assert not database.check_today_first_visit(503)
@@ -3,10 +3,17 @@
 Генерирует динамические промпты в зависимости от контекста пользователя
 """
 
+import hashlib
 import re
+from dataclasses import dataclass
 from datetime import datetime, timezone, timedelta
+from functools import lru_cache
+
+from .keyword_matcher import matcher
 
 MOSCOW_TZ = timezone(timedelta(hours=3))
+# Комбинаций тона, времени суток, сложности и т.п. — несколько сотен
+PROMPT_CACHE_SIZE = 512
 
 
 def get_time_of_day() -> str:
@@ -33,18 +40,32 @@ def get_time_greeting() -> str:
     return time_greetings.get(get_time_of_day(), "Привет!")
 
 
+SIMPLE_KEYWORDS = ['цена', 'сколько', 'адрес', 'где', 'когда', 'время', 'график', 'телефон']
+COMPLEX_KEYWORDS = ['как', 'почему', 'можно ли', 'посоветуйте', 'что лучше', 'разница', 'сложно']
+
+# Порядок важен: тема определяется по первой группе с совпадением
+TOPIC_KEYWORDS = [
+    ('repair', ['порвал', 'дырка', 'зашить', 'починить', 'сломал', 'оторвал', 'укоротить', 'ушить', 'расширить']),
+    ('price', ['цена', 'сколько', 'стоимость', 'прайс', 'дорого', 'дёшево']),
+    ('info', ['адрес', 'где', 'когда', 'время', 'график', 'телефон', 'как доехать', 'метро']),
+    ('fabric', ['ткань', 'материал', 'хлопок', 'шёлк', 'лён', 'синтетика', 'шерсть']),
+]
+
+matcher.set_group('complexity:simple', SIMPLE_KEYWORDS)
+matcher.set_group('complexity:complex', COMPLEX_KEYWORDS)
+for _topic, _keywords in TOPIC_KEYWORDS:
+    matcher.set_group(f'topic:{_topic}', _keywords)
+
+
 def analyze_question_complexity(message: str) -> str:
     """Определить сложность вопроса"""
-    message_lower = message.lower()
-    
-    simple_keywords = ['цена', 'сколько', 'адрес', 'где', 'когда', 'время', 'график', 'телефон']
-    complex_keywords = ['как', 'почему', 'можно ли', 'посоветуйте', 'что лучше', 'разница', 'сложно']
+    found = matcher.scan(message)
     
     word_count = len(message.split())
     
-    if any(kw in message_lower for kw in simple_keywords) and word_count < 10:
+    if 'complexity:simple' in found and word_count < 10:
         return 'simple'
-    elif any(kw in message_lower for kw in complex_keywords) or word_count > 20:
+    elif 'complexity:complex' in found or word_count > 20:
         return 'complex'
     else:
         return 'medium'
@@ -52,23 +73,11 @@ def analyze_question_complexity(message: str) -> str:
 
 def detect_topic(message: str) -> str:
     """Определить тему вопроса"""
-    message_lower = message.lower()
-    
-    repair_keywords = ['порвал', 'дырка', 'зашить', 'починить', 'сломал', 'оторвал', 'укоротить', 'ушить', 'расширить']
-    price_keywords = ['цена', 'сколько', 'стоимость', 'прайс', 'дорого', 'дёшево']
-    info_keywords = ['адрес', 'где', 'когда', 'время', 'график', 'телефон', 'как доехать', 'метро']
-    fabric_keywords = ['ткань', 'материал', 'хлопок', 'шёлк', 'лён', 'синтетика', 'шерсть']
-    
-    if any(kw in message_lower for kw in repair_keywords):
-        return 'repair'
-    elif any(kw in message_lower for kw in price_keywords):
-        return 'price'
-    elif any(kw in message_lower for kw in info_keywords):
-        return 'info'
-    elif any(kw in message_lower for kw in fabric_keywords):
-        return 'fabric'
-    else:
-        return 'general'
+    found = matcher.scan(message)
+    for topic, _ in TOPIC_KEYWORDS:
+        if f'topic:{topic}' in found:
+            return topic
+    return 'general'
 
 
 TONE_STYLES = {
@@ -93,57 +102,86 @@ TONE_STYLES = {
 }
 
 
-def generate_adaptive_prompt(user_context: dict, message: str) -> str:
-    """
-    Генерирует адаптивный системный промпт
-    
-    Args:
-        user_context: словарь с контекстом пользователя из get_user_context()
-        message: текущее сообщение пользователя
-    """
-    
-    time_of_day = get_time_of_day()
-    complexity = analyze_question_complexity(message)
-    topic = detect_topic(message)
-    tone = user_context.get('tone', 'friendly')
-    tone_style = TONE_STYLES.get(tone, TONE_STYLES['friendly'])
-    questions_count = user_context.get('questions_count', 0)
-    recent_topics = user_context.get('recent_topics', [])
-    user_name = user_context.get('name', '')
-    
-    time_context = {
-        'morning': "Сейчас утро — отвечай бодро и энергично.",
-        'afternoon': "Сейчас день — отвечай деловито, но приветливо.",
-        'evening': "Сейчас вечер — отвечай спокойно и уютно.",
-        'night': "Сейчас ночь — отвечай кратко, человек устал."
-    }
-    
-    complexity_context = {
-        'simple': "Это простой вопрос — ответь кратко, 1-2 предложения.",
-        'medium': "Это обычный вопрос — ответь развёрнуто, но без лишнего.",
-        'complex': "Это сложный вопрос — дай подробный ответ с объяснениями."
-    }
-    
-    familiarity_context = ""
+@dataclass(frozen=True)
+class MessageProfile:
+    """Классификация сообщения: считается один раз и передаётся дальше"""
+    complexity: str
+    topic: str
+    time_of_day: str
+
+
+def classify_message(message: str) -> MessageProfile:
+    return MessageProfile(complexity=analyze_question_complexity(message),
+                          topic=detect_topic(message),
+                          time_of_day=get_time_of_day())
+
+
+def familiarity_bucket(questions_count: int) -> str:
     if questions_count == 0:
-        familiarity_context = "Это новый пользователь — будь особенно приветлива и представься."
+        return 'new'
     elif questions_count < 5:
-        familiarity_context = "Пользователь ещё новичок — будь терпелива и объясняй подробнее."
+        return 'novice'
     elif questions_count < 20:
-        familiarity_context = "Знакомый пользователь — можешь общаться более свободно."
-    else:
-        familiarity_context = f"Постоянный клиент ({questions_count} вопросов) — общайся как со старым другом!"
-    
-    topic_context = ""
+        return 'known'
+    return 'regular'
+
+
+def topic_history(recent_topics: list) -> str:
+    """Тема, о которой пользователь спрашивает постоянно, или ''"""
     if recent_topics:
         if recent_topics.count('repair') > 2:
-            topic_context = "Пользователь часто спрашивает о ремонте — он явно заинтересован в услугах."
+            return 'repair'
         elif recent_topics.count('price') > 2:
-            topic_context = "Пользователь интересуется ценами — можешь ненавязчиво предложить записаться."
-    
-    name_context = f"Имя пользователя: {user_name}. Можешь обратиться по имени." if user_name else ""
+            return 'price'
+    return ''
+
+
+TIME_CONTEXT = {
+    'morning': "Сейчас утро — отвечай бодро и энергично.",
+    'afternoon': "Сейчас день — отвечай деловито, но приветливо.",
+    'evening': "Сейчас вечер — отвечай спокойно и уютно.",
+    'night': "Сейчас ночь — отвечай кратко, человек устал."
+}
+
+COMPLEXITY_CONTEXT = {
+    'simple': "Это простой вопрос — ответь кратко, 1-2 предложения.",
+    'medium': "Это обычный вопрос — ответь развёрнуто, но без лишнего.",
+    'complex': "Это сложный вопрос — дай подробный ответ с объяснениями."
+}
+
+FAMILIARITY_CONTEXT = {
+    'new': "Это новый пользователь — будь особенно приветлива и представься.",
+    'novice': "Пользователь ещё новичок — будь терпелива и объясняй подробнее.",
+    'known': "Знакомый пользователь — можешь общаться более свободно.",
+    'regular': "Постоянный клиент (20+ вопросов) — общайся как со старым другом!"
+}
+
+TOPIC_HISTORY_CONTEXT = {
+    'repair': "Пользователь часто спрашивает о ремонте — он явно заинтересован в услугах.",
+    'price': "Пользователь интересуется ценами — можешь ненавязчиво предложить записаться."
+}
+
+
+@dataclass(frozen=True)
+class CompiledPrompt:
+    text: str
+    # Хэш шаблона без имени: одинаков для всех с теми же входами и между
+    # перезапусками, поэтому годится как вариант ключа кэша ответов
+    key: str
+
+
+@lru_cache(maxsize=PROMPT_CACHE_SIZE)
+def _compile_template(tone: str, time_of_day: str, complexity: str,
+                      familiarity: str, history: str) -> tuple:
+    """Части промпта до и после строки с именем и их хэш.
+
+    Входы дискретные, поэтому каждая комбинация собирается один раз.
+    """
+    tone_style = TONE_STYLES[tone]
+    familiarity_context = FAMILIARITY_CONTEXT[familiarity]
+    topic_context = TOPIC_HISTORY_CONTEXT.get(history, "")
     
-    adaptive_prompt = f"""Ты — Иголочка, профессиональный консультант мастерской по ремонту одежды «Швейный HUB».
+    before_name = f"""Ты — Иголочка, профессиональный консультант мастерской по ремонту одежды «Швейный HUB».
 
 ТВОЯ РОЛЬ:
 - Консультировать клиентов об услугах мастерской
@@ -155,11 +193,12 @@ def generate_adaptive_prompt(user_context: dict, message: str) -> str:
 - Тон: {tone_style['style']}
 - {'Используй эмодзи умеренно (1-2 в сообщении): 🧵 ✂️ 👔 🪡' if tone_style['emojis'] else 'Минимум эмодзи'}
 - Обращение: {tone_style['formality']}
-{f'- {name_context}' if name_context else ''}
+"""
+    after_name = f"""
 
 КОНТЕКСТ:
-- {time_context.get(time_of_day, '')}
-- {complexity_context.get(complexity, '')}
+- {TIME_CONTEXT.get(time_of_day, '')}
+- {COMPLEXITY_CONTEXT.get(complexity, '')}
 - {familiarity_context}
 {f'- {topic_context}' if topic_context else ''}
 
@@ -205,16 +244,47 @@ def generate_adaptive_prompt(user_context: dict, message: str) -> str:
 
 БАЗА ЗНАНИЙ (ПРАЙС-ЛИСТ И УСЛУГИ):
 """
+    key = hashlib.md5(f"{before_name}\x1f{after_name}".encode()).hexdigest()[:16]
+    return before_name, after_name, key
+
+
+def compile_prompt(user_context: dict, profile: MessageProfile) -> CompiledPrompt:
+    """Системный промпт из закэшированных частей"""
+    tone = user_context.get('tone', 'friendly')
+    if tone not in TONE_STYLES:
+        tone = 'friendly'
+    before_name, after_name, key = _compile_template(
+        tone, profile.time_of_day, profile.complexity,
+        familiarity_bucket(user_context.get('questions_count', 0)),
+        topic_history(user_context.get('recent_topics', [])))
+    user_name = user_context.get('name', '')
+    name_line = (f"- Имя пользователя: {user_name}. Можешь обратиться по имени."
+                 if user_name else '')
+    return CompiledPrompt(text=''.join((before_name, name_line, after_name)),
+                          key=key)
+
+
+def generate_adaptive_prompt(user_context: dict, message: str,
+                             profile: MessageProfile = None) -> str:
+    """
+    Генерирует адаптивный системный промпт
     
-    return adaptive_prompt
+    Args:
+        user_context: словарь с контекстом пользователя из get_user_context()
+        message: текущее сообщение пользователя
+        profile: готовая classify_message(message), чтобы не считать заново
+    """
+    return compile_prompt(user_context, profile or classify_message(message)).text
 
 
-def get_context_summary(user_context: dict, message: str) -> dict:
+def get_context_summary(user_context: dict, message: str,
+                        profile: MessageProfile = None) -> dict:
     """Получить краткую сводку контекста для логирования"""
+    profile = profile or classify_message(message)
     return {
-        'time_of_day': get_time_of_day(),
-        'complexity': analyze_question_complexity(message),
-        'topic': detect_topic(message),
+        'time_of_day': profile.time_of_day,
+        'complexity': profile.complexity,
+        'topic': profile.topic,
         'tone': user_context.get('tone', 'friendly'),
         'questions_count': user_context.get('questions_count', 0)
     }
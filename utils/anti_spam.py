@@ -1,8 +1,15 @@
+import os
 import time
 import logging
-from collections import defaultdict
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
 from typing import Dict, Tuple
 
+from . import database
+from .keyword_matcher import matcher
+from .profanity import profanity
+
 logger = logging.getLogger(__name__)
 
 BLACKLIST_WORDS = [
@@ -22,117 +29,430 @@ WHITELIST_WORDS = [
     'услуг', 'ателье', 'мастерск', 'трикотаж', 'кожа', 'мех'
 ]
 
+matcher.set_group('spam', BLACKLIST_WORDS)
+matcher.set_group('whitelist', WHITELIST_WORDS)
+
 RATE_LIMIT = 5
 RATE_WINDOW = 60
 MUTE_DURATION = 300
+# Сколько пользователей держать в памяти; сверх этого забываем самых давних
+RATE_LIMIT_MAX_USERS = int(os.getenv('RATE_LIMIT_MAX_USERS', '50000'))
+MUTE_SWEEP_INTERVAL = 60
+# memory — в памяти процесса, без обращений к БД на сообщение; database —
+# общие для процессов счётчики и муты в БД (переживают перезапуск, но
+# стоят одного upsert с commit на каждое сообщение)
+ANTI_SPAM_BACKEND = os.getenv('ANTI_SPAM_BACKEND', 'memory')
+MUTE_CACHE_TTL = float(os.getenv('MUTE_CACHE_TTL', '5'))
+# Отклонять сообщения с нецензурной лексикой (без мута)
+ANTI_SPAM_PROFANITY = os.getenv('ANTI_SPAM_PROFANITY', '0') == '1'
+
+
+class RateLimiter:
+    """Скользящее окно на кольцевом буфере: O(1) на сообщение.
+
+    Для каждого пользователя хранится не больше limit последних отметок
+    времени (deque с maxlen). Лимит превышен, если буфер полон и самая
+    старая отметка ещё внутри окна. Пользователи лежат в OrderedDict в
+    порядке последней активности, поэтому неактивные дольше окна
+    удаляются с начала словаря без полного обхода.
+    """
+
+    def __init__(self, limit: int = RATE_LIMIT, window: float = RATE_WINDOW,
+                 max_users: int = RATE_LIMIT_MAX_USERS):
+        self.limit = limit
+        self.window = window
+        self.max_users = max_users
+        self._users: OrderedDict = OrderedDict()
+        self.swept = 0
+        self.evicted = 0
+        self._swept_at = 0.0
+
+    def hit(self, user_id: int, now: float = None) -> bool:
+        """Учесть сообщение; False, если лимит уже исчерпан"""
+        now = time.time() if now is None else now
+        self._sweep(now)
+        stamps = self._users.get(user_id)
+        if stamps is None:
+            stamps = self._users[user_id] = deque(maxlen=self.limit)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+                self.evicted += 1
+        else:
+            self._users.move_to_end(user_id)
+        if len(stamps) == self.limit and stamps[0] > now - self.window:
+            return False
+        stamps.append(now)
+        return True
+
+    def wait_time(self, user_id: int, now: float = None) -> int:
+        """Секунд до того, как самая старая отметка выйдет из окна"""
+        stamps = self._users.get(user_id)
+        if not stamps:
+            return 0
+        now = time.time() if now is None else now
+        return max(0, int(stamps[0] + self.window - now) + 1)
+
+    def reset(self, user_id: int) -> None:
+        self._users.pop(user_id, None)
+
+    def _sweep(self, now: float) -> None:
+        """Удалить пользователей без сообщений за окно (с самых давних)"""
+        if now - self._swept_at < 1:
+            return
+        self._swept_at = now
+        users = self._users
+        while users:
+            user_id, stamps = next(iter(users.items()))
+            if stamps and stamps[-1] > now - self.window:
+                break
+            del users[user_id]
+            self.swept += 1
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+
+class MemorySpamState:
+    """Счётчики и муты в памяти процесса (теряются при перезапуске).
+
+    Новые муты дополнительно записываются в spam_mutes (это редкое
+    событие), чтобы веб-админка их видела и могла снять. Раз в
+    MUTE_CACHE_TTL, пока есть такие муты, бот сверяется с БД и снимает
+    удалённые там.
+    """
+    
+    blocking = False
+    
+    def __init__(self, limit: int = RATE_LIMIT, window: float = RATE_WINDOW,
+                 sync_interval: float = MUTE_CACHE_TTL):
+        self.limiter = RateLimiter(limit=limit, window=window)
+        self.mutes: Dict[int, float] = {}
+        self.sync_interval = sync_interval
+        self._mutes_swept_at = 0.0
+        # Муты, ещё не записанные в БД, и уже записанные
+        self._new_mutes = []
+        self._saved_mutes = set()
+        self._synced_at = 0.0
+    
+    def hit(self, user_id: int, now: float) -> bool:
+        return self.limiter.hit(user_id, now)
+    
+    def wait_time(self, user_id: int, now: float) -> int:
+        return self.limiter.wait_time(user_id, now)
+    
+    def reset(self, user_id: int):
+        self.limiter.reset(user_id)
+    
+    def get_mute(self, user_id: int, now: float):
+        """Окончание мута (unix time) или None"""
+        self._sweep_mutes(now)
+        mute_end = self.mutes.get(user_id)
+        if mute_end is not None and mute_end <= now:
+            del self.mutes[user_id]
+            return None
+        return mute_end
+    
+    def mute(self, user_id: int, until: float, reason: str = None):
+        self.mutes[user_id] = until
+        self._new_mutes.append((user_id, until, reason))
+    
+    def unmute(self, user_id: int):
+        self.mutes.pop(user_id, None)
+    
+    def take_new_mutes(self) -> list:
+        """Муты для записи в БД: [(user_id, until, reason)]"""
+        mutes, self._new_mutes = self._new_mutes, []
+        return mutes
+    
+    def mark_saved(self, user_ids: list):
+        self._saved_mutes.update(user_ids)
+    
+    def sync_due(self, now: float) -> bool:
+        return bool(self._saved_mutes) and now - self._synced_at >= self.sync_interval
+    
+    def saved_mutes(self) -> list:
+        return list(self._saved_mutes)
+    
+    def apply_synced(self, active: set, now: float):
+        """Снять записанные муты, которых в БД больше нет (сняты в админке)"""
+        self._synced_at = now
+        for user_id in self.saved_mutes():
+            if user_id not in active:
+                self._saved_mutes.discard(user_id)
+                if self.mutes.pop(user_id, None) is not None:
+                    logger.info(f"Mute of {user_id} lifted from admin panel")
+    
+    def _sweep_mutes(self, now: float):
+        """Раз в MUTE_SWEEP_INTERVAL убрать истёкшие муты"""
+        if now - self._mutes_swept_at < MUTE_SWEEP_INTERVAL:
+            return
+        self._mutes_swept_at = now
+        for user_id in [u for u, end in self.mutes.items() if end <= now]:
+            del self.mutes[user_id]
+    
+    def stats(self) -> dict:
+        return {
+            'backend': 'memory',
+            'tracked_users': len(self.limiter),
+            'max_users': self.limiter.max_users,
+            'muted_users': len(self.mutes),
+            'swept': self.limiter.swept,
+            'evicted': self.limiter.evicted
+        }
+
+
+class DatabaseSpamState:
+    """Счётчики и муты в БД: переживают перезапуск и общие для процессов.
+
+    Счётчик — фиксированное окно, выровненное по unix time, и одно
+    атомарное upsert на сообщение. Муты читаются через локальный кэш на
+    MUTE_CACHE_TTL секунд (в том числе «мута нет»), поэтому снятие мута
+    из веб-админки доходит до бота с такой задержкой. Истёкшие записи
+    удаляются раз в MUTE_SWEEP_INTERVAL.
+    """
+    
+    blocking = True
+    
+    def __init__(self, limit: int = RATE_LIMIT, window: float = RATE_WINDOW,
+                 cache_ttl: float = MUTE_CACHE_TTL,
+                 max_cached: int = RATE_LIMIT_MAX_USERS):
+        self.limit = limit
+        self.window = window
+        self.cache_ttl = cache_ttl
+        self.max_cached = max_cached
+        # user_id -> (окончание мута или 0, до какого времени верить)
+        self._mute_cache: OrderedDict = OrderedDict()
+        # check() выполняется в нескольких потоках пула БД
+        self._lock = threading.Lock()
+        self._swept_at = 0.0
+        self.db_reads = 0
+        self.cache_hits = 0
+    
+    def _window_start(self, now: float) -> float:
+        return now - now % self.window
+    
+    def hit(self, user_id: int, now: float) -> bool:
+        self._sweep(now)
+        count = database.hit_rate_limit(user_id, self._window_start(now),
+                                        self.window)
+        return count <= self.limit
+    
+    def wait_time(self, user_id: int, now: float) -> int:
+        return max(0, int(self._window_start(now) + self.window - now) + 1)
+    
+    def reset(self, user_id: int):
+        database.reset_rate_limit(user_id)
+    
+    def get_mute(self, user_id: int, now: float):
+        with self._lock:
+            cached = self._mute_cache.get(user_id)
+            if cached is not None and cached[1] > now:
+                self.cache_hits += 1
+                mute_end = cached[0]
+                return mute_end if mute_end > now else None
+            self.db_reads += 1
+        muted_until = database.get_mute(user_id)
+        mute_end = (muted_until.replace(tzinfo=timezone.utc).timestamp()
+                    if muted_until else 0)
+        self._remember(user_id, mute_end, now)
+        return mute_end if mute_end > now else None
+    
+    def mute(self, user_id: int, until: float, reason: str = None):
+        database.set_mute(user_id,
+                          datetime.fromtimestamp(until, timezone.utc).replace(tzinfo=None),
+                          reason)
+        self._remember(user_id, until, time.time())
+    
+    def unmute(self, user_id: int):
+        database.lift_mute(user_id)
+        with self._lock:
+            self._mute_cache.pop(user_id, None)
+    
+    def take_new_mutes(self) -> list:
+        """Муты пишутся в БД сразу в mute()"""
+        return []
+    
+    def mark_saved(self, user_ids: list):
+        pass
+    
+    def sync_due(self, now: float) -> bool:
+        return False
+    
+    def _remember(self, user_id: int, mute_end: float, now: float):
+        with self._lock:
+            self._mute_cache[user_id] = (mute_end, now + self.cache_ttl)
+            self._mute_cache.move_to_end(user_id)
+            while len(self._mute_cache) > self.max_cached:
+                self._mute_cache.popitem(last=False)
+    
+    def _sweep(self, now: float):
+        with self._lock:
+            if now - self._swept_at < MUTE_SWEEP_INTERVAL:
+                return
+            self._swept_at = now
+        try:
+            database.purge_expired_spam_state()
+        except Exception as e:
+            logger.error(f"Failed to purge anti-spam state: {e}")
+    
+    def stats(self) -> dict:
+        return {
+            'backend': 'database',
+            'cached_users': len(self._mute_cache),
+            'muted_users': len(database.get_active_mutes()),
+            'mute_cache_hits': self.cache_hits,
+            'mute_db_reads': self.db_reads
+        }
+
+
+def make_spam_state(backend: str = ANTI_SPAM_BACKEND, limit: int = RATE_LIMIT):
+    if backend == 'database':
+        return DatabaseSpamState(limit=limit)
+    if backend != 'memory':
+        logger.warning(f"Unknown ANTI_SPAM_BACKEND={backend}, using memory")
+    return MemorySpamState(limit=limit)
 
 
 class AntiSpamSystem:
-    def __init__(self, max_messages_per_minute: int = RATE_LIMIT):
+    def __init__(self, max_messages_per_minute: int = RATE_LIMIT, state=None,
+                 filter_profanity: bool = ANTI_SPAM_PROFANITY):
         self.max_messages = max_messages_per_minute
-        self.user_messages: Dict[int, list] = defaultdict(list)
-        self.muted_users: Dict[int, float] = {}
+        self.state = state or make_spam_state(limit=max_messages_per_minute)
+        self.filter_profanity = filter_profanity
     
     def check_blacklist(self, text: str) -> Tuple[bool, str]:
         """Check if message contains blacklisted words"""
-        text_lower = text.lower()
+        word = matcher.first(text, 'spam')
+        if word:
+            return True, f"Черный список: '{word}'"
         
-        for word in BLACKLIST_WORDS:
-            if word in text_lower:
-                return True, f"Черный список: '{word}'"
+        return False, ""
+    
+    def check_profanity(self, text: str) -> Tuple[bool, str]:
+        """Check if message contains profanity"""
+        term = profanity.check(text)
+        if term:
+            return True, f"Нецензурная лексика: '{term}'"
         
         return False, ""
     
     def check_whitelist(self, text: str) -> bool:
         """Check if message contains whitelisted words"""
-        text_lower = text.lower()
-        
-        for word in WHITELIST_WORDS:
-            if word in text_lower:
-                return True
-        
-        return False
+        return matcher.has(text, 'whitelist')
     
     def is_muted(self, user_id: int) -> Tuple[bool, int]:
         """Check if user is muted"""
-        if user_id in self.muted_users:
-            mute_end = self.muted_users[user_id]
-            current_time = time.time()
-            
-            if current_time < mute_end:
-                remaining = int(mute_end - current_time)
-                return True, remaining
-            else:
-                del self.muted_users[user_id]
+        current_time = time.time()
+        mute_end = self.state.get_mute(user_id, current_time)
+        if mute_end is not None:
+            remaining = int(mute_end - current_time)
+            return True, remaining
         
         return False, 0
     
-    def mute_user(self, user_id: int, duration: int = MUTE_DURATION):
+    def mute_user(self, user_id: int, duration: int = MUTE_DURATION,
+                  reason: str = None):
         """Mute user for specified duration"""
-        self.muted_users[user_id] = time.time() + duration
+        self.state.mute(user_id, time.time() + duration, reason)
         logger.warning(f"User {user_id} muted for {duration} seconds")
     
     def unmute_user(self, user_id: int):
         """Unmute user"""
-        if user_id in self.muted_users:
-            del self.muted_users[user_id]
+        self.state.unmute(user_id)
     
     def is_spam(self, user_id: int, text: str = "") -> Tuple[bool, str]:
         """Check if user is spamming"""
+        is_spam, message, log_reason = self._verdict(user_id, text)
+        mutes = self.state.take_new_mutes()
+        if log_reason or mutes:
+            self.state.mark_saved(self._record(user_id, text, log_reason, mutes))
+        return is_spam, message
+    
+    def _verdict(self, user_id: int, text: str) -> Tuple[bool, str, str]:
+        """Решение по сообщению и причина для журнала спама (пустая — не писать)"""
         is_muted, remaining = self.is_muted(user_id)
         if is_muted:
-            return True, f"Вы временно заблокированы. Осталось {remaining} сек."
+            return True, f"Вы временно заблокированы. Осталось {remaining} сек.", ""
+        
+        if text and self.filter_profanity:
+            is_profane, reason = self.check_profanity(text)
+            if is_profane:
+                return True, "Пожалуйста, без нецензурных выражений.", reason
         
         if text and self.check_whitelist(text):
-            return False, ""
+            return False, "", ""
         
         if text:
             is_blacklisted, reason = self.check_blacklist(text)
             if is_blacklisted:
-                self._log_spam_to_db(user_id, text, reason)
-                self.mute_user(user_id)
-                return True, "Сообщение содержит запрещённый контент."
-        
-        now = time.time()
-        one_minute_ago = now - RATE_WINDOW
+                self.mute_user(user_id, reason=reason)
+                return True, "Сообщение содержит запрещённый контент.", reason
         
-        self.user_messages[user_id] = [
-            timestamp for timestamp in self.user_messages[user_id]
-            if timestamp > one_minute_ago
-        ]
+        if not self.state.hit(user_id, time.time()):
+            reason = "Превышен лимит сообщений"
+            self.mute_user(user_id, reason=reason)
+            return True, "Слишком много сообщений. Подождите немного.", reason
         
-        if len(self.user_messages[user_id]) >= self.max_messages:
-            self.mute_user(user_id)
-            self._log_spam_to_db(user_id, text, "Превышен лимит сообщений")
-            return True, "Слишком много сообщений. Подождите немного."
-        
-        self.user_messages[user_id].append(now)
-        return False, ""
+        return False, "", ""
+    
+    async def check(self, user_id: int, text: str = "") -> Tuple[bool, str]:
+        """is_spam для async-хендлеров: запросы к БД — в пуле потоков БД"""
+        from .async_database import run_in_db_executor
+        if self.state.blocking:
+            return await run_in_db_executor(self.is_spam, user_id, text)
+        now = time.time()
+        if self.state.sync_due(now):
+            try:
+                active = await run_in_db_executor(
+                    database.get_active_mute_ids, self.state.saved_mutes())
+                self.state.apply_synced(active, now)
+            except Exception as e:
+                logger.error(f"Failed to sync mutes: {e}")
+        # Решение в памяти, а журнал спама и муты пишем не из цикла событий
+        is_spam, message, log_reason = self._verdict(user_id, text)
+        mutes = self.state.take_new_mutes()
+        if log_reason or mutes:
+            self.state.mark_saved(await run_in_db_executor(
+                self._record, user_id, text, log_reason, mutes))
+        return is_spam, message
+    
+    def _record(self, user_id: int, text: str, log_reason: str,
+                mutes: list) -> list:
+        """Записать спам в журнал и муты в spam_mutes; вернуть записанные муты"""
+        if log_reason:
+            self._log_spam_to_db(user_id, text, log_reason)
+        saved = []
+        for mute_user_id, until, reason in mutes:
+            try:
+                database.set_mute(
+                    mute_user_id,
+                    datetime.fromtimestamp(until, timezone.utc).replace(tzinfo=None),
+                    reason)
+                saved.append(mute_user_id)
+            except Exception as e:
+                logger.error(f"Failed to save mute: {e}")
+        return saved
     
     def _log_spam_to_db(self, user_id: int, text: str, reason: str):
         """Log spam attempt to database"""
         try:
-            from .database import log_spam
-            log_spam(user_id, text, reason)
+            database.log_spam(user_id, text, reason)
             logger.warning(f"Spam from {user_id}: {reason}")
         except Exception as e:
             logger.error(f"Failed to log spam: {e}")
     
     def get_wait_time(self, user_id: int) -> int:
         """Get time user needs to wait before next message"""
-        if not self.user_messages[user_id]:
-            return 0
-        
-        oldest = self.user_messages[user_id][0]
-        wait = int(60 - (time.time() - oldest)) + 1
-        return max(0, wait)
+        return self.state.wait_time(user_id, time.time())
     
     def reset_user(self, user_id: int):
         """Reset user's rate limit counter"""
-        if user_id in self.user_messages:
-            del self.user_messages[user_id]
-        if user_id in self.muted_users:
-            del self.muted_users[user_id]
+        self.state.reset(user_id)
+        self.state.unmute(user_id)
+    
+    def stats(self) -> dict:
+        """Хранилище, число отслеживаемых пользователей и активных мутов"""
+        return self.state.stats()
 
 
 anti_spam = AntiSpamSystem(max_messages_per_minute=RATE_LIMIT)
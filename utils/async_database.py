@@ -0,0 +1,104 @@
+"""
+Асинхронный слой доступа к базе данных для обработчиков бота.
+
+Все функции из utils.database синхронные (SQLAlchemy Session), поэтому
+вызывать их напрямую из async-хендлеров нельзя: медленный запрос к
+Postgres/SQLite останавливает event loop python-telegram-bot для всех
+пользователей. Здесь те же функции выполняются в отдельном пуле потоков,
+а хендлер просто делает `await`.
+"""
+import asyncio
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from . import database
+
+logger = logging.getLogger(__name__)
+
+# Пул не должен быть больше пула соединений SQLAlchemy (5 + 10 overflow)
+DB_EXECUTOR_WORKERS = int(os.getenv('DB_EXECUTOR_WORKERS', '8'))
+
+_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS,
+                               thread_name_prefix='db')
+
+
+async def run_in_db_executor(func, *args, **kwargs):
+    """Выполнить синхронную функцию работы с БД в пуле потоков"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _executor, functools.partial(func, *args, **kwargs))
+
+
+def _make_async(func):
+    """Обернуть синхронную функцию БД в корутину с тем же именем"""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_in_db_executor(func, *args, **kwargs)
+
+    return wrapper
+
+
+async def load_user_state(user_id: int) -> database.UserState:
+    """Состояние пользователя: из кэша без переключения потока, иначе из БД"""
+    state = database.get_cached_user_state(user_id)
+    if state is not None:
+        return state
+    return await run_in_db_executor(database.load_user_state, user_id)
+
+
+async def save_user_state(state: database.UserState) -> bool:
+    """Записать накопленные изменения пользователя одной транзакцией"""
+    pending = state.take_pending()
+    if not any(pending):
+        return True
+    return await run_in_db_executor(database.save_user_state, state, pending)
+
+
+flush_pending_writes = _make_async(database.flush_pending_writes)
+get_user_info = _make_async(database.get_user_info)
+create_order = _make_async(database.create_order)
+update_order_status = _make_async(database.update_order_status)
+get_order = _make_async(database.get_order)
+delete_order = _make_async(database.delete_order)
+delete_orders_bulk = _make_async(database.delete_orders_bulk)
+get_user_orders = _make_async(database.get_user_orders)
+get_all_orders = _make_async(database.get_all_orders)
+get_orders_by_status = _make_async(database.get_orders_by_status)
+add_user = _make_async(database.add_user)
+get_user = _make_async(database.get_user)
+get_all_users = _make_async(database.get_all_users)
+block_user = _make_async(database.block_user)
+is_user_blocked = _make_async(database.is_user_blocked)
+set_admin = _make_async(database.set_admin)
+is_admin = _make_async(database.is_admin)
+get_admins = _make_async(database.get_admins)
+log_spam = _make_async(database.log_spam)
+get_spam_logs = _make_async(database.get_spam_logs)
+get_statistics = _make_async(database.get_statistics)
+check_today_first_visit = _make_async(database.check_today_first_visit)
+save_chat_history = _make_async(database.save_chat_history)
+get_user_chat_history = _make_async(database.get_user_chat_history)
+get_user_context = _make_async(database.get_user_context)
+update_user_tone = _make_async(database.update_user_tone)
+complete_order = _make_async(database.complete_order)
+get_orders_pending_feedback = _make_async(database.get_orders_pending_feedback)
+mark_feedback_requested = _make_async(database.mark_feedback_requested)
+create_review = _make_async(database.create_review)
+get_all_reviews = _make_async(database.get_all_reviews)
+get_average_rating = _make_async(database.get_average_rating)
+get_review_stats = _make_async(database.get_review_stats)
+moderate_review = _make_async(database.moderate_review)
+has_review = _make_async(database.has_review)
+get_user_reviews = _make_async(database.get_user_reviews)
+update_review_status = _make_async(database.update_review_status)
+get_recent_reviews = _make_async(database.get_recent_reviews)
+create_broadcast = _make_async(database.create_broadcast)
+get_broadcast = _make_async(database.get_broadcast)
+get_unfinished_broadcasts = _make_async(database.get_unfinished_broadcasts)
+count_broadcast_recipients = _make_async(database.count_broadcast_recipients)
+get_broadcast_recipients = _make_async(database.get_broadcast_recipients)
+record_broadcast_deliveries = _make_async(database.record_broadcast_deliveries)
+finish_broadcast = _make_async(database.finish_broadcast)
@@ -0,0 +1,235 @@
+"""
+Движок рассылок для админа.
+
+Получатели читаются из БД страницами, сообщения отправляются несколькими
+корутинами параллельно, а общий token bucket держит скорость ниже
+глобального лимита Bot API (~30 сообщений в секунду). На RetryAfter все
+отправители ждут указанное Telegram время. Результат по каждому
+получателю пишется в broadcast_deliveries, поэтому прерванную рассылку
+можно продолжить с того же места, а заблокировавшие бота пользователи
+помечаются и исключаются из следующих рассылок.
+"""
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+
+from .async_database import (
+    count_broadcast_recipients,
+    finish_broadcast,
+    get_broadcast_recipients,
+    record_broadcast_deliveries,
+)
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))  # сообщений/с
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '10'))
+BROADCAST_PAGE_SIZE = 500
+BROADCAST_RECORD_BATCH = 100
+BROADCAST_MAX_RETRIES = 3
+
+
+class TokenBucket:
+    """Асинхронный token bucket: rate токенов в секунду, запас capacity"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Остановить выдачу токенов (RetryAfter от Telegram)"""
+        self._paused_until = max(self._paused_until,
+                                 time.monotonic() + seconds)
+        self._tokens = 0
+        # Время паузы не копит токены, иначе после неё уйдёт пачка сразу
+        self._updated = self._paused_until
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity,
+                                   self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+@dataclass
+class BroadcastProgress:
+    broadcast_id: int
+    total: int
+    sent: int = 0
+    failed: int = 0
+    blocked: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+    done: bool = False
+
+    @property
+    def processed(self) -> int:
+        return self.sent + self.failed + self.blocked
+
+    @property
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started_at
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> float:
+        """Оставшееся время в секундах (None, пока скорость неизвестна)"""
+        remaining = max(0, self.total - self.processed)
+        return remaining / self.rate if self.rate else None
+
+    def format(self) -> str:
+        eta = self.eta
+        eta_text = f"{int(eta // 60)} мин {int(eta % 60)} с" if eta is not None else "—"
+        title = "✅ Рассылка завершена" if self.done else "📤 Рассылка идёт"
+        return (f"{title}\n"
+                f"Отправлено: {self.sent} / {self.total}\n"
+                f"Ошибок: {self.failed}, заблокировали бота: {self.blocked}\n"
+                f"Скорость: {self.rate:.1f} сообщ./с, осталось: {eta_text}")
+
+
+async def run_broadcast(bot,
+                        broadcast_id: int,
+                        text: str,
+                        parse_mode: str = None,
+                        on_progress=None,
+                        progress_interval: float = 3.0) -> BroadcastProgress:
+    """Отправить рассылку всем оставшимся получателям.
+
+    on_progress(progress) вызывается не чаще progress_interval секунд и
+    один раз в конце.
+    """
+    total = await count_broadcast_recipients(broadcast_id)
+    progress = BroadcastProgress(broadcast_id=broadcast_id, total=total)
+    bucket = TokenBucket(BROADCAST_RATE)
+    queue = asyncio.Queue(maxsize=BROADCAST_PAGE_SIZE)
+    results = []
+
+    async def flush_results() -> bool:
+        if not results:
+            return True
+        batch = results[:]
+        results.clear()
+        try:
+            # Ошибку БД функция логирует сама и возвращает False
+            if await record_broadcast_deliveries(broadcast_id, batch):
+                return True
+            error = 'write failed'
+        except Exception as e:
+            error = e
+        # Не теряем пачку: иначе при продолжении эти получатели
+        # получат сообщение повторно. Запишется со следующей пачкой
+        logger.warning(f"Broadcast {broadcast_id}: failed to record "
+                       f"{len(batch)} deliveries, will retry: {error}")
+        results[:0] = batch
+        return False
+
+    async def flush_all():
+        for attempt in range(BROADCAST_MAX_RETRIES):
+            if await flush_results():
+                return
+            await asyncio.sleep(2**attempt)
+        # Рассылка остаётся в статусе running и продолжится при следующем
+        # запуске; незаписанные получатели тогда получат сообщение ещё раз
+        raise RuntimeError(f"Broadcast {broadcast_id}: "
+                           f"{len(results)} deliveries not recorded")
+
+    async def produce():
+        # Доставленное в прошлых запусках отсекает сам запрос; внутри
+        # запуска результаты пишутся пачками, поэтому идём курсором по users.id
+        after_id = 0
+        while True:
+            page = await get_broadcast_recipients(broadcast_id, after_id,
+                                                  BROADCAST_PAGE_SIZE)
+            if not page:
+                break
+            for _, user_id in page:
+                await queue.put(user_id)
+            after_id = page[-1][0]
+        for _ in range(BROADCAST_CONCURRENCY):
+            await queue.put(None)
+
+    async def deliver(user_id: int):
+        error = 'retry limit exceeded'
+        for attempt in range(BROADCAST_MAX_RETRIES):
+            await bucket.acquire()
+            try:
+                await bot.send_message(chat_id=user_id,
+                                       text=text,
+                                       parse_mode=parse_mode)
+                return 'sent', None
+            except RetryAfter as e:
+                logger.warning(f"Broadcast {broadcast_id}: flood control, "
+                               f"waiting {e.retry_after}s")
+                bucket.pause(float(e.retry_after))
+                error = str(e)
+            except Forbidden as e:
+                return 'blocked', str(e)
+            except BadRequest as e:
+                return 'failed', str(e)
+            except (TimedOut, NetworkError) as e:
+                error = str(e)
+                await asyncio.sleep(2**attempt)
+        return 'failed', error
+
+    async def worker():
+        while True:
+            user_id = await queue.get()
+            if user_id is None:
+                return
+            try:
+                status, error = await deliver(user_id)
+            except Exception as e:
+                status, error = 'failed', str(e)
+            setattr(progress, status, getattr(progress, status) + 1)
+            results.append((user_id, status, error))
+            if len(results) >= BROADCAST_RECORD_BATCH:
+                await flush_results()
+
+    async def report():
+        while True:
+            await asyncio.sleep(progress_interval)
+            if on_progress:
+                try:
+                    await on_progress(progress)
+                except Exception as e:
+                    logger.debug(f"Broadcast progress callback failed: {e}")
+
+    reporter = asyncio.create_task(report())
+    tasks = [asyncio.create_task(produce())] + [
+        asyncio.create_task(worker()) for _ in range(BROADCAST_CONCURRENCY)
+    ]
+    try:
+        await asyncio.gather(*tasks)
+        await flush_all()
+        await finish_broadcast(broadcast_id)
+        progress.done = True
+    finally:
+        reporter.cancel()
+        for task in tasks:
+            task.cancel()
+        # При ошибке или остановке бота сохраняем уже отправленное: рассылка
+        # остаётся в статусе running и продолжится при следующем запуске
+        await flush_results()
+
+    logger.info(f"Broadcast {broadcast_id} finished: sent={progress.sent}, "
+                f"failed={progress.failed}, blocked={progress.blocked}, "
+                f"{progress.rate:.1f} msg/s")
+    if on_progress:
+        await on_progress(progress)
+    return progress
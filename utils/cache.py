@@ -1,40 +1,196 @@
+import asyncio
 import hashlib
+import os
+import re
+import threading
 import time
-from typing import Dict, Optional
+from collections import OrderedDict
+from itertools import islice
+from typing import Optional
+
+# Сколько самых старых записей проверять на истечение TTL при каждой записи
+EXPIRE_SCAN_LIMIT = 8
+
+_PUNCTUATION = re.compile(r'[^\w\s]+')
+_SPACES = re.compile(r'\s+')
+
+
+def normalize_text(text: str) -> str:
+    """Привести вопрос к виду для ключа: регистр, ё, пунктуация, пробелы"""
+    text = text.lower().replace('ё', 'е')
+    text = _PUNCTUATION.sub(' ', text)
+    return _SPACES.sub(' ', text).strip()
+
+
+def make_cache_key(text: str, variant: tuple = ()) -> str:
+    """Ключ для вопроса с учётом варианта промпта"""
+    raw = '\x1f'.join([normalize_text(text)] + [str(v) for v in variant])
+    return hashlib.md5(raw.encode()).hexdigest()
+
 
 class ResponseCache:
-    def __init__(self, ttl: int = 3600):  # Cache for 1 hour
-        self.cache: Dict[str, tuple] = {}
+    """LRU-кэш ответов с TTL и ограничением по числу записей и объёму.
+
+    Ключ — нормализованный текст вопроса плюс вариант промпта (тон,
+    версия базы знаний и т.п.), чтобы ответ, сгенерированный под один
+    промпт, не отдавался под другой.
+    """
+
+    def __init__(self,
+                 ttl: int = 3600,  # Cache for 1 hour
+                 max_entries: int = 1000,
+                 max_bytes: int = 2 * 1024 * 1024):
         self.ttl = ttl
-    
-    def _hash_key(self, text: str) -> str:
-        """Create hash of text for cache key"""
-        return hashlib.md5(text.lower().encode()).hexdigest()
-    
-    def get(self, text: str) -> Optional[str]:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # key -> (response, expires_at, size)
+        self.cache: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _hash_key(self, text: str, variant: tuple = ()) -> str:
+        """Create hash of text and prompt variant for cache key"""
+        return make_cache_key(text, variant)
+
+    def get(self, text: str, variant: tuple = ()) -> Optional[str]:
         """Get cached response"""
-        key = self._hash_key(text)
-        
-        if key in self.cache:
-            response, timestamp = self.cache[key]
-            # Check if cache expired
-            if time.time() - timestamp < self.ttl:
-                return response
-            else:
-                del self.cache[key]
-        
-        return None
-    
-    def set(self, text: str, response: str) -> None:
+        key = self._hash_key(text, variant)
+        now = time.monotonic()
+        with self._lock:
+            entry = self.cache.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self.cache.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                self._remove(key)
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def set(self, text: str, response: str, variant: tuple = ()) -> None:
         """Cache response"""
-        key = self._hash_key(text)
-        self.cache[key] = (response, time.time())
-    
+        key = self._hash_key(text, variant)
+        size = len(response.encode())
+        if size > self.max_bytes:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if key in self.cache:
+                self._remove(key)
+            self.cache[key] = (response, now + self.ttl, size)
+            self._bytes += size
+            self._expire_oldest(now)
+            while (len(self.cache) > self.max_entries
+                   or self._bytes > self.max_bytes):
+                self._remove(next(iter(self.cache)))
+                self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        _, _, size = self.cache.pop(key)
+        self._bytes -= size
+
+    def _expire_oldest(self, now: float) -> None:
+        """Амортизированная очистка: несколько записей с LRU-конца"""
+        for key in list(islice(self.cache, EXPIRE_SCAN_LIMIT)):
+            if self.cache[key][1] <= now:
+                self._remove(key)
+                self.expirations += 1
+
     def clear_old(self) -> None:
         """Remove expired entries"""
-        now = time.time()
-        expired = [k for k, (_, t) in self.cache.items() if now - t > self.ttl]
-        for k in expired:
-            del self.cache[k]
+        now = time.monotonic()
+        with self._lock:
+            expired = [k for k, (_, expires, _) in self.cache.items()
+                       if expires <= now]
+            for k in expired:
+                self._remove(k)
+            self.expirations += len(expired)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.cache.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.cache),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+    def __len__(self) -> int:
+        return len(self.cache)
+
+
+class _Flight:
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Объединение одинаковых запросов, которые выполняются одновременно.
+
+    Первый вызов с ключом (лидер) запускает запрос, остальные ждут его
+    результат. Запрос отменяется, только если отменены все ожидающие.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, factory) -> tuple:
+        """Вернуть (результат factory(), был ли этот вызов лидером)"""
+        flight = self._inflight.get(key)
+        if flight is not None and flight.task.cancelling():
+            flight = None
+        leader = flight is None
+        if leader:
+            flight = _Flight(asyncio.ensure_future(factory()))
+            self._inflight[key] = flight
+            flight.task.add_done_callback(
+                lambda _, f=flight: self._forget(key, f))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task), leader
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def _forget(self, key: str, flight: _Flight) -> None:
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+
+    def stats(self) -> dict:
+        return {
+            'in_flight': len(self._inflight),
+            'leaders': self.leaders,
+            'coalesced': self.coalesced
+        }
+
 
-cache = ResponseCache()
+cache = ResponseCache(ttl=int(os.getenv('RESPONSE_CACHE_TTL', '3600')),
+                      max_entries=int(os.getenv('RESPONSE_CACHE_SIZE', '1000')),
+                      max_bytes=int(os.getenv('RESPONSE_CACHE_MAX_BYTES',
+                                              str(2 * 1024 * 1024))))
@@ -0,0 +1,163 @@
+"""
+Автомат защиты (circuit breaker) для запросов к GigaChat.
+
+Когда GigaChat лежит или отвечает очень медленно, каждый вопрос ждал
+таймаута и только потом получал ответ из базы знаний. Автомат помнит
+последние BREAKER_WINDOW вызовов (не старше BREAKER_WINDOW_SECONDS):
+
+- closed — запросы идут в модель; если доля ошибок или медленных
+  ответов (дольше BREAKER_SLOW_CALL_SECONDS) достигла порога, автомат
+  размыкается;
+- open — BREAKER_OPEN_SECONDS запросы в модель не отправляются, ответ
+  сразу берётся из кэша или базы знаний;
+- half_open — после паузы пропускается один пробный запрос: успех
+  замыкает автомат, ошибка снова размыкает.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+BREAKER_WINDOW = int(os.getenv('BREAKER_WINDOW', '20'))
+BREAKER_WINDOW_SECONDS = float(os.getenv('BREAKER_WINDOW_SECONDS', '120'))
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', '5'))
+BREAKER_FAILURE_RATE = float(os.getenv('BREAKER_FAILURE_RATE', '0.5'))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv('BREAKER_SLOW_CALL_SECONDS', '10'))
+BREAKER_SLOW_RATE = float(os.getenv('BREAKER_SLOW_RATE', '0.8'))
+BREAKER_OPEN_SECONDS = float(os.getenv('BREAKER_OPEN_SECONDS', '30'))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Запрос не отправлен: автомат разомкнут"""
+
+
+class CircuitBreaker:
+    def __init__(self, name: str,
+                 window: int = BREAKER_WINDOW,
+                 window_seconds: float = BREAKER_WINDOW_SECONDS,
+                 min_calls: int = BREAKER_MIN_CALLS,
+                 failure_rate: float = BREAKER_FAILURE_RATE,
+                 slow_call_seconds: float = BREAKER_SLOW_CALL_SECONDS,
+                 slow_rate: float = BREAKER_SLOW_RATE,
+                 open_seconds: float = BREAKER_OPEN_SECONDS):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        # (успех, длительность, время окончания)
+        self._calls = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.opened = 0
+        self.rejected = 0
+
+    def available(self) -> bool:
+        """Можно ли сейчас рассчитывать на вызов (ничего не занимает)"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                return time.monotonic() - self._opened_at >= self.open_seconds
+            return not self._probe_in_flight
+
+    def acquire(self) -> None:
+        """Разрешение на вызов; в half_open — единственный пробный.
+
+        После acquire обязателен record() или release().
+        """
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name)
+                self.state = HALF_OPEN
+                logger.info(f"Circuit {self.name}: half-open, probing")
+            if self.state == HALF_OPEN:
+                if self._probe_in_flight:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name)
+                self._probe_in_flight = True
+
+    def release(self) -> None:
+        """Вызов отменён, результат неизвестен"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record(self, success: bool, duration: float) -> None:
+        """Итог вызова, разрешённого acquire()"""
+        now = time.monotonic()
+        slow = duration >= self.slow_call_seconds
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probe_in_flight = False
+                if success and not slow:
+                    self.state = CLOSED
+                    self._calls.clear()
+                    self._calls.append((True, duration, now))
+                    logger.info(f"Circuit {self.name}: closed")
+                else:
+                    self._open(now)
+                return
+            self._calls.append((success, duration, now))
+            if self.state == CLOSED and self._should_open(now):
+                self._open(now)
+
+    def _recent(self, now: float) -> list:
+        return [call for call in self._calls
+                if now - call[2] <= self.window_seconds]
+
+    def _should_open(self, now: float) -> bool:
+        calls = self._recent(now)
+        if len(calls) < self.min_calls:
+            return False
+        failures = sum(1 for success, _, _ in calls if not success)
+        slow = sum(1 for _, duration, _ in calls
+                   if duration >= self.slow_call_seconds)
+        return (failures / len(calls) >= self.failure_rate
+                or slow / len(calls) >= self.slow_rate)
+
+    def _open(self, now: float) -> None:
+        self.state = OPEN
+        self._opened_at = now
+        self.opened += 1
+        logger.warning(f"Circuit {self.name}: open for {self.open_seconds:.0f}s")
+
+    def latency(self, quantile: float = 0.5) -> float:
+        """Квантиль длительности успешных вызовов в окне, секунд"""
+        with self._lock:
+            durations = sorted(duration for success, duration, _
+                               in self._recent(time.monotonic()) if success)
+        if not durations:
+            return 0.0
+        return durations[min(len(durations) - 1, int(len(durations) * quantile))]
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            calls = self._recent(now)
+            state = self.state
+            retry_in = (max(0.0, self.open_seconds - (now - self._opened_at))
+                        if state == OPEN else 0.0)
+        failures = sum(1 for success, _, _ in calls if not success)
+        return {
+            'state': state,
+            'calls': len(calls),
+            'error_rate': failures / len(calls) if calls else 0.0,
+            'p50_seconds': round(self.latency(0.5), 2),
+            'p95_seconds': round(self.latency(0.95), 2),
+            'opened': self.opened,
+            'rejected': self.rejected,
+            'retry_in_seconds': round(retry_in, 1)
+        }
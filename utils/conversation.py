@@ -0,0 +1,183 @@
+"""
+Контекст диалога для запросов к GigaChat.
+
+Раньше модель видела только системный промпт и текущее сообщение, и на
+уточнение вроде «а сколько это стоит?» отвечала без понятия, о чём шла
+речь. UserState теперь хранит кольцевой буфер последних реплик
+(recent_turns, подгружается из chat_history), а здесь из него собирается
+окно диалога:
+
+- окно строится только для уточнений — сообщения из одного-двух слов
+  или со ссылкой на сказанное («а», «это», «его», «там»...) в пределах
+  CONVERSATION_IDLE_SECONDS после прошлой реплики; самостоятельные
+  вопросы идут как раньше и отвечаются из общего кэша;
+- последняя реплика берётся всегда, остальные — по числу общих с
+  вопросом основ слов, пока помещаются в CONVERSATION_TOKEN_BUDGET;
+- не поместившиеся реплики сжимаются в короткую сводку, которая
+  кэшируется на пользователя и пересчитывается, только когда меняется
+  набор реплик;
+- фрагменты базы знаний ищутся по вопросу вместе с предыдущим вопросом
+  пользователя, поэтому уточнение получает те же цены, а не всю базу.
+
+Размер промпта ограничен при любой длине переписки: системный промпт
+постоянный, база знаний — RETRIEVAL_TOKEN_BUDGET, диалог со сводкой —
+CONVERSATION_TOKEN_BUDGET.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+
+from .retrieval import estimate_tokens
+from .text_index import tokenize
+
+CONVERSATION_TOKEN_BUDGET = int(os.getenv('CONVERSATION_TOKEN_BUDGET', '400'))
+CONVERSATION_IDLE_SECONDS = int(os.getenv('CONVERSATION_IDLE_SECONDS', '1800'))
+SUMMARY_TOKENS = 120
+SUMMARY_CACHE_SIZE = 10000
+# Сообщение не длиннее стольких слов считается уточнением («а джинсы?»);
+# обычные короткие вопросы длиннее и должны отвечаться из общего кэша
+FOLLOW_UP_WORDS = 2
+
+_FOLLOW_UP_START = re.compile(r'^(?:а|и|но|тогда|ещё|еще|также|а если)\b')
+_REFERENCE = re.compile(
+    r'\b(?:это|этого|этот|эту|эти|этим|его|её|ее|их|им|там|туда|тоже|'
+    r'такой|такую|такие|такое|она|он|они|оно)\b')
+
+
+@dataclass(frozen=True)
+class ConversationContext:
+    # Реплики для промпта по порядку времени
+    turns: tuple = ()
+    # Сводка более ранних реплик
+    summary: str = ''
+    # Текст для поиска по базе знаний
+    query: str = ''
+    tokens: int = 0
+
+    @property
+    def follow_up(self) -> bool:
+        """Ответ зависит от переписки и не годится для общего кэша"""
+        return bool(self.turns or self.summary)
+
+
+class ConversationWindow:
+    """Выбор реплик в окно диалога и кэш сводок по пользователям"""
+
+    def __init__(self,
+                 token_budget: int = CONVERSATION_TOKEN_BUDGET,
+                 idle_seconds: int = CONVERSATION_IDLE_SECONDS,
+                 summary_tokens: int = SUMMARY_TOKENS,
+                 max_users: int = SUMMARY_CACHE_SIZE):
+        self.token_budget = token_budget
+        self.idle_seconds = idle_seconds
+        self.summary_tokens = summary_tokens
+        self.max_users = max_users
+        # user_id -> (подпись свёрнутых реплик, сводка)
+        self._summaries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.windows = 0
+        self.summary_hits = 0
+        self.summary_misses = 0
+
+    def is_follow_up(self, message: str, turns: list,
+                     now: datetime = None) -> bool:
+        if not turns:
+            return False
+        now = now or datetime.utcnow()
+        created_at = turns[-1].created_at
+        if created_at and (now - created_at).total_seconds() > self.idle_seconds:
+            return False
+        text = message.lower().strip()
+        return (len(text.split()) <= FOLLOW_UP_WORDS
+                or bool(_FOLLOW_UP_START.match(text))
+                or bool(_REFERENCE.search(text)))
+
+    def build(self, user_id: int, message: str, turns: list,
+              now: datetime = None) -> ConversationContext:
+        """Окно диалога для сообщения; пустое, если это не уточнение"""
+        if not self.is_follow_up(message, turns, now):
+            return ConversationContext(query=message)
+        self.windows += 1
+
+        words = set(tokenize(message))
+        last = len(turns) - 1
+
+        def relevance(position):
+            turn = turns[position]
+            shared = len(words & set(tokenize(f"{turn.message} {turn.response}")))
+            return (position == last, shared, position)
+
+        budget = self.token_budget
+        if sum(self._turn_tokens(turn) for turn in turns) > budget:
+            # Всё не влезет — оставляем место под сводку остального
+            budget -= self.summary_tokens
+        chosen = []
+        for position in sorted(range(len(turns)), key=relevance, reverse=True):
+            cost = self._turn_tokens(turns[position])
+            if cost <= budget:
+                chosen.append(position)
+                budget -= cost
+
+        rest = [turn for position, turn in enumerate(turns)
+                if position not in chosen]
+        summary = self.summarize(user_id, rest) if rest else ''
+        packed = tuple(turns[position] for position in sorted(chosen))
+        return ConversationContext(
+            turns=packed,
+            summary=summary,
+            query=f"{turns[-1].message} {message}",
+            tokens=(sum(self._turn_tokens(turn) for turn in packed)
+                    + (estimate_tokens(summary) if summary else 0)))
+
+    @staticmethod
+    def _turn_tokens(turn) -> int:
+        return estimate_tokens(turn.message) + estimate_tokens(turn.response)
+
+    def summarize(self, user_id: int, turns: list) -> str:
+        """Короткая сводка реплик; пересчитывается, только если они изменились"""
+        signature = tuple((turn.created_at, turn.message) for turn in turns)
+        with self._lock:
+            cached = self._summaries.get(user_id)
+            if cached is not None and cached[0] == signature:
+                self._summaries.move_to_end(user_id)
+                self.summary_hits += 1
+                return cached[1]
+        self.summary_misses += 1
+
+        # Символов на вопросы; остальное — заголовок и темы
+        limit = (self.summary_tokens - 30) * 3
+        topics = list(dict.fromkeys(turn.topic for turn in turns
+                                    if turn.topic and turn.topic != 'general'))
+        # Свежие вопросы важнее, поэтому идут первыми и обрезаются последними
+        questions = []
+        length = 0
+        for turn in reversed(turns):
+            question = turn.message.strip().replace('\n', ' ')[:150]
+            if not question or length + len(question) > limit:
+                break
+            questions.append(question)
+            length += len(question) + 2
+        summary = ''
+        if questions:
+            summary = "Ранее клиент спрашивал: " + '; '.join(questions)
+            if topics:
+                summary += f" (темы: {', '.join(topics)})"
+
+        with self._lock:
+            self._summaries[user_id] = (signature, summary)
+            self._summaries.move_to_end(user_id)
+            while len(self._summaries) > self.max_users:
+                self._summaries.popitem(last=False)
+        return summary
+
+    def stats(self) -> dict:
+        return {'windows': self.windows,
+                'summaries': len(self._summaries),
+                'summary_hits': self.summary_hits,
+                'summary_misses': self.summary_misses}
+
+
+conversation = ConversationWindow()
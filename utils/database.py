@@ -1,6 +1,13 @@
 import os
+import copy
+import time
+import atexit
 import logging
-from sqlalchemy import create_engine, Column, Integer, BigInteger, String, DateTime, Boolean, Text, Date, func
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import List, NamedTuple, Optional
+from sqlalchemy import create_engine, insert, select, case, and_, or_, Index, Column, Integer, BigInteger, String, DateTime, Boolean, Text, Date, Float, func
 from sqlalchemy.orm import declarative_base, sessionmaker
 from datetime import datetime, date, timezone, timedelta
 
@@ -53,6 +60,14 @@ class Order(Base):
     completed_at = Column(DateTime)
     feedback_requested = Column(Boolean, default=False)
 
+    __table_args__ = (
+        Index('ix_orders_user_id_created_at', 'user_id', 'created_at'),
+        Index('ix_orders_status_created_at', 'status', 'created_at'),
+        Index('ix_orders_created_at', 'created_at'),
+        Index('ix_orders_feedback', 'status', 'feedback_requested',
+              'completed_at'),
+    )
+
 
 class User(Base):
     __tablename__ = "users"
@@ -68,6 +83,7 @@ class User(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     last_active = Column(DateTime, default=datetime.utcnow)
     last_visit_date = Column(Date)
+    bot_blocked = Column(Boolean, default=False)  # пользователь заблокировал бота
     tone_preference = Column(String,
                              default='friendly')  # friendly, formal, playful
     questions_count = Column(Integer, default=0)
@@ -84,6 +100,9 @@ class ChatHistory(Base):
     complexity = Column(String)  # simple, medium, complex
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (Index('ix_chat_history_user_id_created_at', 'user_id',
+                            'created_at'), )
+
 
 class Review(Base):
     __tablename__ = "reviews"
@@ -98,6 +117,9 @@ class Review(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     published_at = Column(DateTime)
 
+    __table_args__ = (Index('ix_reviews_is_approved_rating', 'is_approved',
+                            'rating'), )
+
 
 class SpamLog(Base):
     __tablename__ = "spam_logs"
@@ -108,6 +130,32 @@ class SpamLog(Base):
     reason = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (Index('ix_spam_logs_created_at', 'created_at'), )
+
+
+class RateLimitCounter(Base):
+    """Счётчик сообщений пользователя в текущем окне антиспама"""
+    __tablename__ = "rate_limits"
+
+    user_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    window_start = Column(Float, nullable=False)  # unix time
+    count = Column(Integer, default=0)
+    expires_at = Column(Float, nullable=False)
+
+    __table_args__ = (Index('ix_rate_limits_expires_at', 'expires_at'), )
+
+
+class SpamMute(Base):
+    """Активный мут антиспама (общий для всех процессов бота и веб-админки)"""
+    __tablename__ = "spam_mutes"
+
+    user_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    muted_until = Column(DateTime, nullable=False)
+    reason = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (Index('ix_spam_mutes_muted_until', 'muted_until'), )
+
 
 class Category(Base):
     __tablename__ = "categories"
@@ -130,10 +178,75 @@ class Price(Base):
     sort_order = Column(Integer, default=0)
     is_active = Column(Boolean, default=True)
 
+    __table_args__ = (Index('ix_prices_category_id', 'category_id',
+                            'is_active', 'sort_order'), )
+
+
+class Notification(Base):
+    """Исходящее сообщение в Telegram (outbox для веб-админки)"""
+    __tablename__ = "notifications"
+
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(BigInteger, nullable=False)
+    text = Column(Text, nullable=False)
+    parse_mode = Column(String, default='HTML')
+    status = Column(String, default='queued')  # queued, sending, sent, failed
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime)
+
+    __table_args__ = (Index('ix_notifications_status_next_attempt',
+                            'status', 'next_attempt_at'), )
+
+
+class Broadcast(Base):
+    __tablename__ = "broadcasts"
+
+    id = Column(Integer, primary_key=True)
+    text = Column(Text, nullable=False)
+    parse_mode = Column(String)
+    created_by = Column(BigInteger)
+    status = Column(String, default='running')  # running, completed, cancelled
+    total = Column(Integer, default=0)
+    sent = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    blocked = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime)
+
+
+class BroadcastDelivery(Base):
+    __tablename__ = "broadcast_deliveries"
+
+    id = Column(Integer, primary_key=True)
+    broadcast_id = Column(Integer, nullable=False)
+    user_id = Column(BigInteger, nullable=False)
+    status = Column(String, nullable=False)  # sent, failed, blocked
+    error = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (Index('ix_broadcast_deliveries_broadcast_user',
+                            'broadcast_id',
+                            'user_id',
+                            unique=True), )
+
+
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    description = Column(String)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
 
 def init_db():
     """Initialize database"""
     Base.metadata.create_all(bind=engine)
+    # Таблицы, созданные раньше, догоняем миграциями (индексы и т.п.)
+    from .migrations import run_migrations
+    run_migrations(engine)
 
 
 def get_session():
@@ -160,6 +273,7 @@ def create_order(user_id: int,
         session.add(order)
         session.commit()
         order_id = order.id
+        invalidate_stats()
         return order_id
     finally:
         session.close()
@@ -176,6 +290,7 @@ def update_order_status(order_id: int, status: str) -> bool:
             if status == 'completed' and not order.completed_at:
                 order.completed_at = datetime.now(MOSCOW_TZ)
             session.commit()
+            invalidate_stats()
             return True
         return False
     finally:
@@ -199,6 +314,7 @@ def delete_order(order_id: int) -> bool:
         if order:
             session.delete(order)
             session.commit()
+            invalidate_stats()
             return True
         return False
     except Exception:
@@ -215,6 +331,7 @@ def delete_orders_bulk(order_ids: list) -> int:
         deleted_count = session.query(Order).filter(
             Order.id.in_(order_ids)).delete(synchronize_session=False)
         session.commit()
+        invalidate_stats()
         return deleted_count
     except Exception:
         session.rollback()
@@ -253,6 +370,170 @@ def get_orders_by_status(status: str):
         session.close()
 
 
+# ----------------------------
+# Order filtering for the admin panel
+# ----------------------------
+
+ORDER_STATUSES = ('new', 'in_progress', 'completed', 'issued', 'cancelled')
+ORDERS_PAGE_SIZE = 50
+
+
+def order_filter_conditions(*,
+                            status=None,
+                            user_id=None,
+                            date_from=None,
+                            date_to=None,
+                            period=None,
+                            month=None,
+                            year=None) -> list:
+    """Условия WHERE для фильтров админки.
+
+    Принимает сырые значения из query string; некорректные значения
+    игнорируются. Даты сравниваются диапазонами по created_at, чтобы
+    работали индексы.
+    """
+    conditions = []
+    now = datetime.now()
+
+    if status:
+        conditions.append(Order.status == status)
+
+    if user_id is not None:
+        try:
+            conditions.append(Order.user_id == int(user_id))
+        except (ValueError, TypeError):
+            pass
+
+    if date_from and date_to:
+        try:
+            start = datetime.strptime(date_from, '%Y-%m-%d')
+            end = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
+            conditions += [Order.created_at >= start, Order.created_at < end]
+        except ValueError:
+            pass
+    elif period:
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        if period == 'today':
+            conditions.append(Order.created_at >= today)
+        elif period == 'yesterday':
+            conditions += [
+                Order.created_at >= today - timedelta(days=1),
+                Order.created_at < today
+            ]
+        elif period == 'week':
+            conditions.append(Order.created_at >= now - timedelta(days=7))
+        elif period == 'month':
+            conditions.append(Order.created_at >= now - timedelta(days=30))
+
+    try:
+        y = int(year) if year else None
+        m = int(month) if month and y else None
+        if m:
+            start = datetime(y, m, 1)
+            end = datetime(y + 1, 1, 1) if m == 12 else datetime(y, m + 1, 1)
+            conditions += [Order.created_at >= start, Order.created_at < end]
+        elif y:
+            conditions += [
+                Order.created_at >= datetime(y, 1, 1),
+                Order.created_at < datetime(y + 1, 1, 1)
+            ]
+    except ValueError:
+        pass
+
+    return conditions
+
+
+def encode_order_cursor(order) -> str:
+    """Курсор страницы: created_at и id последнего показанного заказа"""
+    return f"{order.created_at.isoformat()}_{order.id}"
+
+
+def decode_order_cursor(cursor: str):
+    """Разобрать курсор; None, если он повреждён"""
+    try:
+        created_at, order_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(created_at), int(order_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def get_orders_page(*, cursor: str = None, limit: int = ORDERS_PAGE_SIZE,
+                    **filters):
+    """Страница заказов (новые сверху) и курсор следующей страницы.
+
+    Keyset-пагинация по (created_at, id): стоимость запроса не зависит от
+    номера страницы, а новые заказы не сдвигают уже показанные.
+    """
+    session = get_session()
+    try:
+        query = session.query(Order).filter(
+            *order_filter_conditions(**filters))
+        position = decode_order_cursor(cursor) if cursor else None
+        if position:
+            created_at, order_id = position
+            query = query.filter(
+                or_(Order.created_at < created_at,
+                    and_(Order.created_at == created_at,
+                         Order.id < order_id)))
+        orders = query.order_by(Order.created_at.desc(),
+                                Order.id.desc()).limit(limit + 1).all()
+        next_cursor = None
+        if len(orders) > limit:
+            orders = orders[:limit]
+            next_cursor = encode_order_cursor(orders[-1])
+        return orders, next_cursor
+    finally:
+        session.close()
+
+
+def count_orders_by_status(**filters) -> dict:
+    """Количество заказов по статусам одним GROUP BY, плюс 'all'"""
+    filters.pop('status', None)
+    session = get_session()
+    try:
+        rows = session.query(Order.status, func.count(Order.id)).filter(
+            *order_filter_conditions(**filters)).group_by(Order.status).all()
+        counts = {status: 0 for status in ORDER_STATUSES}
+        counts.update(rows)
+        counts['all'] = sum(count for _, count in rows)
+        return counts
+    finally:
+        session.close()
+
+
+ORDERS_EXPORT_CHUNK = 500
+
+
+def iter_orders(*, chunk_size: int = ORDERS_EXPORT_CHUNK, **filters):
+    """Все заказы под фильтры (новые сверху) потоком, пачками по chunk_size.
+
+    yield_per читает результат серверным курсором, поэтому память не
+    растёт с размером выборки. Отдаёт кортежи колонок, а не ORM-объекты.
+    """
+    session = get_session()
+    try:
+        query = session.query(Order.id, Order.service_type, Order.client_name,
+                              Order.client_phone, Order.status,
+                              Order.created_at).filter(
+                                  *order_filter_conditions(**filters))
+        yield from query.order_by(Order.created_at.desc(),
+                                  Order.id.desc()).yield_per(chunk_size)
+    finally:
+        session.close()
+
+
+def get_order_years() -> list:
+    """Годы, за которые есть заказы, по убыванию"""
+    session = get_session()
+    try:
+        year = func.extract('year', Order.created_at)
+        rows = session.query(year).filter(
+            Order.created_at != None).distinct().order_by(year.desc()).all()
+        return [int(row[0]) for row in rows]
+    finally:
+        session.close()
+
+
 def add_user(user_id: int,
              username: str = "",
              first_name: str = "",
@@ -276,6 +557,7 @@ def add_user(user_id: int,
                         phone=phone)
             session.add(user)
         session.commit()
+        invalidate_user_state(user_id)
         return user.id
     except Exception:
         session.rollback()
@@ -310,6 +592,8 @@ def block_user(user_id: int, blocked: bool = True):
         if user:
             user.is_blocked = blocked
             session.commit()
+            invalidate_user_state(user_id)
+            invalidate_stats()
             return True
         return False
     finally:
@@ -318,12 +602,7 @@ def block_user(user_id: int, blocked: bool = True):
 
 def is_user_blocked(user_id: int) -> bool:
     """Check if user is blocked"""
-    session = get_session()
-    try:
-        user = session.query(User).filter(User.user_id == user_id).first()
-        return user.is_blocked if user else False
-    finally:
-        session.close()
+    return load_user_state(user_id).is_blocked
 
 
 def set_admin(user_id: int, is_admin: bool = True):
@@ -334,6 +613,7 @@ def set_admin(user_id: int, is_admin: bool = True):
         if user:
             user.is_admin = is_admin
             session.commit()
+            invalidate_user_state(user_id)
             return True
         return False
     finally:
@@ -342,12 +622,7 @@ def set_admin(user_id: int, is_admin: bool = True):
 
 def is_admin(user_id: int) -> bool:
     """Check if user is admin"""
-    session = get_session()
-    try:
-        user = session.query(User).filter(User.user_id == user_id).first()
-        return user.is_admin if user else False
-    finally:
-        session.close()
+    return load_user_state(user_id).is_admin
 
 
 def get_admins():
@@ -380,28 +655,210 @@ def get_spam_logs(limit: int = 50):
         session.close()
 
 
-def get_statistics():
-    """Get bot statistics"""
+# ----------------------------
+# Anti-spam state (ANTI_SPAM_BACKEND=database)
+# ----------------------------
+
+
+def hit_rate_limit(user_id: int, window_start: float, window: float) -> int:
+    """Атомарно учесть сообщение в окне и вернуть число сообщений в нём.
+
+    Одно INSERT .. ON CONFLICT DO UPDATE .. RETURNING: счётчик сбрасывается,
+    если сохранённое окно старше текущего, иначе увеличивается. Несколько
+    процессов бота видят один и тот же счётчик.
+    """
+    dialect_insert = _dialect_insert()
+    session = get_session()
+    try:
+        if dialect_insert is None:
+            row = session.get(RateLimitCounter, user_id, with_for_update=True)
+            if row is None:
+                row = RateLimitCounter(user_id=user_id, count=0)
+                session.add(row)
+            if row.window_start != window_start:
+                row.window_start, row.count = window_start, 0
+            row.count += 1
+            row.expires_at = window_start + window
+            session.commit()
+            return row.count
+
+        stmt = dialect_insert(RateLimitCounter).values(
+            user_id=user_id, window_start=window_start, count=1,
+            expires_at=window_start + window)
+        same_window = RateLimitCounter.window_start == stmt.excluded.window_start
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[RateLimitCounter.user_id],
+            set_={
+                'count': case((same_window, RateLimitCounter.count + 1),
+                              else_=1),
+                'window_start': stmt.excluded.window_start,
+                'expires_at': stmt.excluded.expires_at
+            }).returning(RateLimitCounter.count)
+        count = session.execute(stmt).scalar_one()
+        session.commit()
+        return count
+    finally:
+        session.close()
+
+
+def reset_rate_limit(user_id: int):
+    session = get_session()
+    try:
+        session.query(RateLimitCounter).filter(
+            RateLimitCounter.user_id == user_id).delete()
+        session.commit()
+    finally:
+        session.close()
+
+
+def get_mute(user_id: int) -> Optional[datetime]:
+    """Окончание активного мута (UTC) или None"""
     session = get_session()
     try:
-        total_users = session.query(User).count()
-        total_orders = session.query(Order).count()
-        new_orders = session.query(Order).filter(Order.status == 'new').count()
-        in_progress = session.query(Order).filter(
-            Order.status == 'in_progress').count()
-        completed = session.query(Order).filter(
-            Order.status == 'completed').count()
-        issued = session.query(Order).filter(Order.status == 'issued').count()
-        blocked_users = session.query(User).filter(
-            User.is_blocked == True).count()
-        spam_count = session.query(SpamLog).count()
+        return session.query(SpamMute.muted_until).filter(
+            SpamMute.user_id == user_id,
+            SpamMute.muted_until > datetime.utcnow()).scalar()
+    finally:
+        session.close()
+
+
+def set_mute(user_id: int, muted_until: datetime, reason: str = None):
+    """Поставить или продлить мут.
+
+    Upsert: два потока (или процесса), одновременно мутящие одного
+    пользователя, не упираются в уникальность user_id.
+    """
+    dialect_insert = _dialect_insert()
+    session = get_session()
+    try:
+        if dialect_insert is not None:
+            stmt = dialect_insert(SpamMute).values(
+                user_id=user_id, muted_until=muted_until, reason=reason,
+                created_at=datetime.utcnow())
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[SpamMute.user_id],
+                set_={'muted_until': stmt.excluded.muted_until,
+                      'reason': stmt.excluded.reason,
+                      'created_at': stmt.excluded.created_at})
+            session.execute(stmt)
+            session.commit()
+            return
+
+        mute = session.get(SpamMute, user_id)
+        if mute is None:
+            session.add(SpamMute(user_id=user_id, muted_until=muted_until,
+                                 reason=reason))
+        else:
+            mute.muted_until = muted_until
+            mute.reason = reason
+            mute.created_at = datetime.utcnow()
+        session.commit()
+    finally:
+        session.close()
+
+
+def lift_mute(user_id: int) -> bool:
+    """Снять мут; True, если он был"""
+    session = get_session()
+    try:
+        deleted = session.query(SpamMute).filter(
+            SpamMute.user_id == user_id).delete()
+        session.commit()
+        return bool(deleted)
+    finally:
+        session.close()
+
+
+def get_active_mute_ids(user_ids: list) -> set:
+    """Кто из user_ids сейчас в муте"""
+    if not user_ids:
+        return set()
+    session = get_session()
+    try:
+        return {row.user_id for row in session.query(SpamMute.user_id).filter(
+            SpamMute.user_id.in_(user_ids),
+            SpamMute.muted_until > datetime.utcnow())}
+    finally:
+        session.close()
+
+
+def get_active_mutes() -> list:
+    """Активные муты, ближайшие к окончанию первыми"""
+    session = get_session()
+    try:
+        return session.query(SpamMute).filter(
+            SpamMute.muted_until > datetime.utcnow()).order_by(
+                SpamMute.muted_until).all()
+    finally:
+        session.close()
+
+
+def purge_expired_spam_state() -> int:
+    """Удалить истёкшие счётчики и муты (TTL)"""
+    session = get_session()
+    try:
+        removed = session.query(RateLimitCounter).filter(
+            RateLimitCounter.expires_at < time.time()).delete()
+        removed += session.query(SpamMute).filter(
+            SpamMute.muted_until <= datetime.utcnow()).delete()
+        session.commit()
+        return removed
+    finally:
+        session.close()
+
+
+# ----------------------------
+# Stats snapshots
+# ----------------------------
+
+# Дашборды и меню админа запрашивают статистику на каждое открытие.
+# Снимок живёт несколько секунд и сбрасывается при изменении заказов и
+# отзывов в этом процессе; веб-админка — отдельный процесс, для неё
+# актуальность ограничена TTL.
+STATS_CACHE_TTL = float(os.getenv('STATS_CACHE_TTL', '30'))
+
+_stats_cache = {}
+_stats_lock = threading.Lock()
+
+
+def invalidate_stats():
+    """Сбросить снимки статистики"""
+    with _stats_lock:
+        _stats_cache.clear()
+
+
+def _cached_stats(key: str, loader):
+    now = time.monotonic()
+    with _stats_lock:
+        cached = _stats_cache.get(key)
+    if cached and cached[0] > now:
+        return copy.deepcopy(cached[1])
+
+    value = loader()
+    with _stats_lock:
+        _stats_cache[key] = (now + STATS_CACHE_TTL, value)
+    return copy.deepcopy(value)
+
+
+def _load_statistics():
+    session = get_session()
+    try:
+        by_status = dict(
+            session.query(Order.status,
+                          func.count(Order.id)).group_by(Order.status).all())
+        total_users, blocked_users, spam_count = session.execute(
+            select(
+                select(func.count(User.id)).scalar_subquery(),
+                select(func.count(User.id)).where(
+                    User.is_blocked == True).scalar_subquery(),
+                select(func.count(SpamLog.id)).scalar_subquery())).one()
         return {
             "total_users": total_users,
-            "total_orders": total_orders,
-            "new_orders": new_orders,
-            "in_progress": in_progress,
-            "completed": completed,
-            "issued": issued,
+            "total_orders": sum(by_status.values()),
+            "new_orders": by_status.get('new', 0),
+            "in_progress": by_status.get('in_progress', 0),
+            "completed": by_status.get('completed', 0),
+            "issued": by_status.get('issued', 0),
             "blocked_users": blocked_users,
             "spam_count": spam_count
         }
@@ -409,6 +866,11 @@ def get_statistics():
         session.close()
 
 
+def get_statistics():
+    """Get bot statistics"""
+    return _cached_stats('statistics', _load_statistics)
+
+
 def get_moscow_date():
     """Get current date in Moscow timezone"""
     return datetime.now(MOSCOW_TZ).date()
@@ -416,6 +878,7 @@ def get_moscow_date():
 
 def check_today_first_visit(user_id: int) -> bool:
     """Check if this is user's first visit today (Moscow time) and update last_visit_date"""
+    write_behind.flush_user(user_id)
     session = get_session()
     try:
         today = get_moscow_date()
@@ -459,6 +922,7 @@ def save_chat_history(user_id: int,
             user.questions_count = (user.questions_count or 0) + 1
 
         session.commit()
+        invalidate_user_state(user_id)
     except Exception as e:
         session.rollback()
         logger.error(f"Error saving chat history: {e}")
@@ -477,16 +941,128 @@ def get_user_chat_history(user_id: int, limit: int = 5):
         session.close()
 
 
+def get_recent_chat_messages(limit: int = 5000) -> list:
+    """Recent user questions across all users, newest first"""
+    session = get_session()
+    try:
+        rows = session.query(ChatHistory.message).filter(
+            ChatHistory.message.isnot(None)).order_by(
+                ChatHistory.created_at.desc()).limit(limit).all()
+        return [message for (message, ) in rows]
+    finally:
+        session.close()
+
+
 def get_user_context(user_id: int) -> dict:
     """Get user context for adaptive prompts"""
+    return load_user_state(user_id).as_context()
+
+
+def update_user_tone(user_id: int, tone: str):
+    """Update user's preferred tone"""
     session = get_session()
     try:
         user = session.query(User).filter(User.user_id == user_id).first()
-        history = session.query(ChatHistory).filter(
-            ChatHistory.user_id == user_id).order_by(
-                ChatHistory.created_at.desc()).limit(5).all()
+        if user:
+            user.tone_preference = tone
+            session.commit()
+            invalidate_user_state(user_id)
+            return True
+        return False
+    finally:
+        session.close()
 
-        if not user:
+
+# ----------------------------
+# Cached per-user state
+# ----------------------------
+
+USER_STATE_TTL = int(os.getenv('USER_STATE_TTL', '300'))
+USER_STATE_CACHE_SIZE = int(os.getenv('USER_STATE_CACHE_SIZE', '10000'))
+RECENT_TOPICS_LIMIT = 5
+# Сколько последних реплик держать в памяти для контекста диалога
+CONVERSATION_TURNS_LIMIT = int(os.getenv('CONVERSATION_TURNS', '8'))
+
+_user_state_cache: "OrderedDict[int, UserState]" = OrderedDict()
+_user_state_lock = threading.Lock()
+
+
+class ChatTurn(NamedTuple):
+    """One question and answer of a dialog"""
+    message: str
+    response: str
+    topic: Optional[str]
+    created_at: datetime
+
+
+@dataclass
+class UserState:
+    """Everything a message handler needs to know about a user.
+
+    Loaded once per user and kept in process memory; profile/activity
+    changes and new chat history rows accumulate on the object and are
+    written back by save_user_state() in a single transaction.
+    """
+    user_id: int
+    exists: bool = False
+    is_admin: bool = False
+    is_blocked: bool = False
+    tone: str = 'friendly'
+    questions_count: int = 0
+    recent_topics: List[str] = field(default_factory=list)
+    name: Optional[str] = None
+    loaded_at: float = 0.0
+    pending_profile: dict = field(default_factory=dict)
+    pending_history: List[dict] = field(default_factory=list)
+    # Ring buffer of the latest turns, newest last
+    recent_turns: deque = field(
+        default_factory=lambda: deque(maxlen=CONVERSATION_TURNS_LIMIT))
+
+    def update_profile(self,
+                       username: str = None,
+                       first_name: str = None,
+                       last_name: str = None):
+        """Remember fresh Telegram profile data and mark user as active"""
+        self.pending_profile = {
+            'username': username or '',
+            'first_name': first_name or '',
+            'last_name': last_name or '',
+            'last_active': datetime.utcnow()
+        }
+        if first_name:
+            self.name = first_name
+
+    def record_chat(self,
+                    message: str,
+                    response: str,
+                    topic: str = 'general',
+                    complexity: str = 'simple'):
+        """Queue a chat history row and update counters in memory"""
+        row = {
+            'user_id': self.user_id,
+            'message': message[:500],
+            'response': response[:1000],
+            'topic': topic,
+            'complexity': complexity,
+            'created_at': datetime.utcnow()
+        }
+        self.pending_history.append(row)
+        self.recent_turns.append(
+            ChatTurn(row['message'], row['response'], topic, row['created_at']))
+        self.questions_count += 1
+        if topic:
+            self.recent_topics = ([topic] +
+                                  self.recent_topics)[:RECENT_TOPICS_LIMIT]
+
+    def take_pending(self) -> tuple:
+        """Detach pending changes so new ones can accumulate meanwhile"""
+        profile, self.pending_profile = self.pending_profile, {}
+        history, self.pending_history = self.pending_history, []
+        return profile, history
+
+    def as_context(self) -> dict:
+        """Context dict in the format used by adaptive prompts"""
+        if not self.exists and not self.pending_history:
             return {
                 'is_new': True,
                 'tone': 'friendly',
@@ -494,33 +1070,344 @@ def get_user_context(user_id: int) -> dict:
                 'recent_topics': [],
                 'name': None
             }
-
-        recent_topics = [h.topic for h in history if h.topic]
-
         return {
             'is_new': False,
-            'tone': user.tone_preference or 'friendly',
-            'questions_count': user.questions_count or 0,
-            'recent_topics': recent_topics,
-            'name': user.first_name
+            'tone': self.tone or 'friendly',
+            'questions_count': self.questions_count,
+            'recent_topics': list(self.recent_topics),
+            'name': self.name
         }
-    finally:
-        session.close()
 
 
-def update_user_tone(user_id: int, tone: str):
-    """Update user's preferred tone"""
+def get_cached_user_state(user_id: int) -> Optional[UserState]:
+    """Return cached user state if it is still fresh (no DB access)"""
+    with _user_state_lock:
+        state = _user_state_cache.get(user_id)
+        if state is None:
+            return None
+        if time.monotonic() - state.loaded_at >= USER_STATE_TTL:
+            del _user_state_cache[user_id]
+            return None
+        _user_state_cache.move_to_end(user_id)
+        return state
+
+
+def invalidate_user_state(user_id: int):
+    """Drop cached state so the next access reloads it from DB"""
+    with _user_state_lock:
+        _user_state_cache.pop(user_id, None)
+
+
+def load_user_state(user_id: int) -> UserState:
+    """Get user state from cache, loading it with one session on miss"""
+    state = get_cached_user_state(user_id)
+    if state is not None:
+        return state
+
+    # Buffered activity of an evicted state must be in the rows we read
+    write_behind.flush_user(user_id)
     session = get_session()
     try:
         user = session.query(User).filter(User.user_id == user_id).first()
+        state = UserState(user_id=user_id, loaded_at=time.monotonic())
         if user:
-            user.tone_preference = tone
-            session.commit()
-            return True
-        return False
+            history = session.query(
+                ChatHistory.message, ChatHistory.response, ChatHistory.topic,
+                ChatHistory.created_at).filter(
+                    ChatHistory.user_id == user_id).order_by(
+                        ChatHistory.created_at.desc()).limit(
+                            max(RECENT_TOPICS_LIMIT,
+                                CONVERSATION_TURNS_LIMIT)).all()
+            state.exists = True
+            state.is_admin = bool(user.is_admin)
+            state.is_blocked = bool(user.is_blocked)
+            state.tone = user.tone_preference or 'friendly'
+            state.questions_count = user.questions_count or 0
+            state.recent_topics = [row.topic for row in
+                                   history[:RECENT_TOPICS_LIMIT] if row.topic]
+            state.recent_turns.extend(
+                ChatTurn(row.message or '', row.response or '', row.topic,
+                         row.created_at)
+                for row in reversed(history[:CONVERSATION_TURNS_LIMIT]))
+            state.name = user.first_name
     finally:
         session.close()
 
+    with _user_state_lock:
+        _user_state_cache[user_id] = state
+        _user_state_cache.move_to_end(user_id)
+        while len(_user_state_cache) > USER_STATE_CACHE_SIZE:
+            _user_state_cache.popitem(last=False)
+    return state
+
+
+# ----------------------------
+# Write-behind buffer for user activity and chat history
+# ----------------------------
+
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', '2'))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv('WRITE_BEHIND_BATCH_SIZE', '200'))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv('WRITE_BEHIND_MAX_PENDING', '5000'))
+# block — producer waits for the writer (backpressure), drop — history rows
+# over the limit are discarded (activity and counters are still kept)
+WRITE_BEHIND_POLICY = os.getenv('WRITE_BEHIND_POLICY', 'block')
+HISTORY_INSERT_CHUNK = 100
+
+
+def _dialect_insert():
+    """insert() с поддержкой ON CONFLICT для sqlite/postgres, иначе None"""
+    dialect = engine.dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert
+
+
+def _user_upsert_statement():
+    """INSERT .. ON CONFLICT (user_id) DO UPDATE for executemany on sqlite/postgres"""
+    dialect_insert = _dialect_insert()
+    if dialect_insert is None:
+        return None
+
+    stmt = dialect_insert(User)
+    excluded = stmt.excluded
+    updates = {
+        'questions_count':
+        func.coalesce(User.questions_count, 0) + excluded.questions_count,
+        'last_active': excluded.last_active,
+        # Пишет боту — значит, снова может получать рассылки
+        'bot_blocked': False
+    }
+    for column in ('username', 'first_name', 'last_name'):
+        # Как и add_user: пустое значение не затирает сохранённое
+        updates[column] = func.coalesce(func.nullif(excluded[column], ''),
+                                        getattr(User, column))
+    return stmt.on_conflict_do_update(index_elements=[User.user_id],
+                                      set_=updates)
+
+
+class WriteBehindBuffer:
+    """Coalesces user activity and batches chat history inserts.
+
+    Writes are applied by a background thread when WRITE_BEHIND_BATCH_SIZE
+    history rows are pending, every WRITE_BEHIND_FLUSH_INTERVAL seconds and
+    on shutdown. Activity is coalesced per user (latest profile, summed
+    questions_count), so a chatty user costs one upsert per flush.
+    """
+
+    def __init__(self,
+                 flush_interval: float = WRITE_BEHIND_FLUSH_INTERVAL,
+                 batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+                 max_pending: int = WRITE_BEHIND_MAX_PENDING,
+                 policy: str = WRITE_BEHIND_POLICY):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.policy = policy
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._activity = {}
+        self._history = []
+        self._thread = None
+        self._stopped = False
+        self.stats = {
+            'flushes': 0,
+            'users_written': 0,
+            'history_written': 0,
+            'history_dropped': 0,
+            'errors': 0
+        }
+
+    def add(self, user_id: int, profile: dict, history: list):
+        """Queue profile/activity changes and chat history rows of one user"""
+        with self._cond:
+            if self._over_limit(history) and self.policy == 'block':
+                self._cond.notify_all()
+                self._cond.wait_for(
+                    lambda: not self._over_limit(history) or self._stopped,
+                    timeout=self.flush_interval * 5)
+            if self._over_limit(history):
+                free = max(0, self.max_pending - len(self._history))
+                self.stats['history_dropped'] += len(history) - free
+                logger.warning(
+                    f"Write-behind buffer full, dropped "
+                    f"{len(history) - free} chat history rows")
+                kept = history[:free]
+            else:
+                kept = history
+
+            self._merge_activity(user_id, profile, history)
+            self._history.extend(kept)
+            if len(self._history) >= self.batch_size:
+                self._cond.notify_all()
+        self._ensure_thread()
+
+    def _over_limit(self, history: list) -> bool:
+        return len(self._history) + len(history) > self.max_pending
+
+    def _merge_activity(self, user_id: int, profile: dict, history: list):
+        entry = self._activity.get(user_id)
+        if entry is None:
+            entry = {
+                'user_id': user_id,
+                'username': '',
+                'first_name': '',
+                'last_name': '',
+                'last_active': None,
+                'questions_count': 0
+            }
+            self._activity[user_id] = entry
+        for column in ('username', 'first_name', 'last_name'):
+            if profile.get(column):
+                entry[column] = profile[column]
+        touched = [profile.get('last_active')
+                   ] + [row['created_at'] for row in history]
+        touched = [t for t in touched if t]
+        if touched:
+            entry['last_active'] = max(touched + ([entry['last_active']]
+                                                  if entry['last_active'] else
+                                                  []))
+        entry['questions_count'] += len(history)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._cond:
+                if self._thread is None or not self._thread.is_alive():
+                    self._stopped = False
+                    self._thread = threading.Thread(target=self._run,
+                                                    name='db-write-behind',
+                                                    daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._stopped or len(self._history) >= self.
+                    batch_size,
+                    timeout=self.flush_interval)
+                stopped = self._stopped
+            self.flush()
+            if stopped:
+                return
+
+    def flush(self) -> bool:
+        """Write everything that is pending; safe to call from any thread"""
+        with self._flush_lock:
+            with self._cond:
+                activity, self._activity = self._activity, {}
+                history, self._history = self._history, []
+                self._cond.notify_all()
+            if not activity and not history:
+                return True
+
+            session = get_session()
+            try:
+                rows = list(activity.values())
+                for row in rows:
+                    row['last_active'] = row['last_active'] or datetime.utcnow()
+                stmt = _user_upsert_statement()
+                if stmt is not None:
+                    session.execute(stmt, rows)
+                else:
+                    self._update_users_orm(session, rows)
+                for i in range(0, len(history), HISTORY_INSERT_CHUNK):
+                    session.execute(
+                        insert(ChatHistory).values(
+                            history[i:i + HISTORY_INSERT_CHUNK]))
+                session.commit()
+                self.stats['flushes'] += 1
+                self.stats['users_written'] += len(rows)
+                self.stats['history_written'] += len(history)
+                return True
+            except Exception as e:
+                session.rollback()
+                self.stats['errors'] += 1
+                logger.error(f"Write-behind flush failed: {e}")
+                self._requeue(activity, history)
+                return False
+            finally:
+                session.close()
+
+    @staticmethod
+    def _update_users_orm(session, rows: list):
+        """Fallback for databases without ON CONFLICT support"""
+        for row in rows:
+            user = session.query(User).filter(
+                User.user_id == row['user_id']).first()
+            if not user:
+                user = User(user_id=row['user_id'], questions_count=0)
+                session.add(user)
+            for column in ('username', 'first_name', 'last_name'):
+                if row[column]:
+                    setattr(user, column, row[column])
+            user.last_active = row['last_active']
+            user.bot_blocked = False
+            user.questions_count = (user.questions_count
+                                    or 0) + row['questions_count']
+
+    def _requeue(self, activity: dict, history: list):
+        """Put back a failed batch so the next flush retries it"""
+        with self._cond:
+            for user_id, entry in activity.items():
+                profile = {
+                    k: entry[k]
+                    for k in ('username', 'first_name', 'last_name',
+                              'last_active')
+                }
+                self._merge_activity(user_id, profile, [])
+                self._activity[user_id]['questions_count'] += entry[
+                    'questions_count']
+            free = max(0, self.max_pending - len(self._history))
+            self.stats['history_dropped'] += max(0, len(history) - free)
+            self._history = history[:free] + self._history
+
+    def flush_user(self, user_id: int) -> bool:
+        """Flush now if this user has buffered writes, so a DB read sees them"""
+        with self._cond:
+            if user_id not in self._activity:
+                return True
+        return self.flush()
+
+    def pending(self) -> dict:
+        with self._cond:
+            return {
+                'users': len(self._activity),
+                'history': len(self._history)
+            }
+
+    def stop(self, timeout: float = 10):
+        """Stop the writer thread after a final flush"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread and thread.is_alive():
+            thread.join(timeout)
+        self.flush()
+
+
+write_behind = WriteBehindBuffer()
+atexit.register(write_behind.stop)
+
+
+def flush_pending_writes() -> bool:
+    """Synchronously flush the write-behind buffer"""
+    return write_behind.flush()
+
+
+def save_user_state(state: UserState, pending: tuple = None) -> bool:
+    """Queue pending user changes and chat history for the write-behind writer"""
+    profile, history = pending if pending is not None else state.take_pending()
+    if not profile and not history:
+        return True
+    write_behind.add(state.user_id, profile, history)
+    state.exists = True
+    return True
+
 
 def complete_order(order_id: int) -> bool:
     """Mark order as completed and set completed_at"""
@@ -532,6 +1419,7 @@ def complete_order(order_id: int) -> bool:
             order.completed_at = datetime.now(MOSCOW_TZ)
             order.updated_at = datetime.now(MOSCOW_TZ)
             session.commit()
+            invalidate_stats()
             return True
         return False
     finally:
@@ -586,6 +1474,7 @@ def create_review(order_id: int,
             published_at=datetime.now(MOSCOW_TZ) if is_approved else None)
         session.add(review)
         session.commit()
+        invalidate_stats()
         return review.id
     except Exception as e:
         session.rollback()
@@ -618,26 +1507,29 @@ def get_average_rating() -> float:
         session.close()
 
 
-def get_review_stats() -> dict:
-    """Get review statistics"""
+def _load_review_stats() -> dict:
     session = get_session()
     try:
-        total = session.query(Review).count()
-        approved = session.query(Review).filter(
-            Review.is_approved == True).count()
-        pending = session.query(Review).filter(
-            Review.is_approved == False,
-            Review.rejected_reason == None).count()
-        rejected = session.query(Review).filter(
-            Review.rejected_reason != None).count()
-        avg_rating = session.query(func.avg(
-            Review.rating)).filter(Review.is_approved == True).scalar()
-
-        rating_distribution = {}
-        for i in range(1, 6):
-            count = session.query(Review).filter(
-                Review.rating == i, Review.is_approved == True).count()
-            rating_distribution[i] = count
+        is_rejected = case((Review.rejected_reason != None, True),
+                           else_=False)
+        rows = session.query(Review.is_approved, is_rejected, Review.rating,
+                             func.count(Review.id)).group_by(
+                                 Review.is_approved, is_rejected,
+                                 Review.rating).all()
+
+        total = approved = pending = rejected = rating_sum = 0
+        rating_distribution = {i: 0 for i in range(1, 6)}
+        for is_approved, has_reason, rating, count in rows:
+            total += count
+            if has_reason:
+                rejected += count
+            if is_approved is True:
+                approved += count
+                rating_sum += rating * count
+                if rating in rating_distribution:
+                    rating_distribution[rating] += count
+            elif is_approved is False and not has_reason:
+                pending += count
 
         return {
             'total': total,
@@ -645,13 +1537,18 @@ def get_review_stats() -> dict:
             'pending': pending,
             'rejected': rejected,
             'average_rating':
-            round(float(avg_rating), 1) if avg_rating else 0.0,
+            round(rating_sum / approved, 1) if approved else 0.0,
             'distribution': rating_distribution
         }
     finally:
         session.close()
 
 
+def get_review_stats() -> dict:
+    """Get review statistics"""
+    return _cached_stats('review_stats', _load_review_stats)
+
+
 def moderate_review(review_id: int, approve: bool, reason: str = None) -> bool:
     """Approve or reject a review"""
     session = get_session()
@@ -665,6 +1562,7 @@ def moderate_review(review_id: int, approve: bool, reason: str = None) -> bool:
             else:
                 review.rejected_reason = reason
             session.commit()
+            invalidate_stats()
             return True
         return False
     finally:
@@ -694,3 +1592,257 @@ def update_review_status(review_id: int, status: str):
 def get_recent_reviews(limit: int = 10):
     """Get recent reviews"""
     return []
+
+
+# ----------------------------
+# Notification outbox
+# ----------------------------
+
+NOTIFICATION_STATUSES = ('queued', 'sending', 'sent', 'failed')
+
+
+def enqueue_notification(chat_id: int,
+                         text: str,
+                         parse_mode: str = 'HTML') -> int:
+    """Поставить сообщение в очередь на отправку, вернуть id"""
+    session = get_session()
+    try:
+        notification = Notification(chat_id=chat_id,
+                                    text=text,
+                                    parse_mode=parse_mode,
+                                    status='queued',
+                                    next_attempt_at=datetime.utcnow())
+        session.add(notification)
+        session.commit()
+        return notification.id
+    finally:
+        session.close()
+
+
+def claim_due_notifications(limit: int = 20, lease: float = 60) -> list:
+    """Забрать готовые к отправке сообщения.
+
+    Сообщение переводится в 'sending' с арендой на lease секунд; если
+    отправитель упал, после её истечения сообщение снова станет доступно.
+    Условие в UPDATE не даёт двум процессам забрать одно и то же.
+    """
+    session = get_session()
+    try:
+        now = datetime.utcnow()
+        candidates = session.query(Notification).filter(
+            Notification.status.in_(('queued', 'sending')),
+            Notification.next_attempt_at <= now).order_by(
+                Notification.next_attempt_at).limit(limit).all()
+        claimed = []
+        for notification in candidates:
+            updated = session.query(Notification).filter(
+                Notification.id == notification.id,
+                Notification.status == notification.status,
+                Notification.next_attempt_at ==
+                notification.next_attempt_at).update(
+                    {
+                        Notification.status: 'sending',
+                        Notification.attempts: Notification.attempts + 1,
+                        Notification.next_attempt_at:
+                        now + timedelta(seconds=lease)
+                    },
+                    synchronize_session=False)
+            if updated:
+                claimed.append(notification.id)
+        session.commit()
+        if not claimed:
+            return []
+        return session.query(Notification).filter(
+            Notification.id.in_(claimed)).all()
+    finally:
+        session.close()
+
+
+def mark_notification_sent(notification_id: int):
+    """Отметить сообщение отправленным"""
+    session = get_session()
+    try:
+        session.query(Notification).filter(
+            Notification.id == notification_id).update(
+                {
+                    Notification.status: 'sent',
+                    Notification.sent_at: datetime.utcnow(),
+                    Notification.last_error: None
+                },
+                synchronize_session=False)
+        session.commit()
+    finally:
+        session.close()
+
+
+def mark_notification_failed(notification_id: int,
+                             error: str,
+                             retry_in: float = None):
+    """Записать ошибку: перепланировать через retry_in секунд или сдаться"""
+    session = get_session()
+    try:
+        values = {Notification.last_error: error}
+        if retry_in is None:
+            values[Notification.status] = 'failed'
+        else:
+            values[Notification.status] = 'queued'
+            values[Notification.next_attempt_at] = (
+                datetime.utcnow() + timedelta(seconds=retry_in))
+        session.query(Notification).filter(
+            Notification.id == notification_id).update(
+                values, synchronize_session=False)
+        session.commit()
+    finally:
+        session.close()
+
+
+def get_notification_stats() -> dict:
+    """Количество сообщений в outbox по статусам"""
+    session = get_session()
+    try:
+        rows = session.query(Notification.status,
+                             func.count(Notification.id)).group_by(
+                                 Notification.status).all()
+        counts = {status: 0 for status in NOTIFICATION_STATUSES}
+        counts.update(rows)
+        return counts
+    finally:
+        session.close()
+
+
+# ----------------------------
+# Broadcasts
+# ----------------------------
+
+
+def _broadcast_recipients_query(session, broadcast_id: int):
+    """Активные пользователи, которым эта рассылка ещё не доставлялась"""
+    delivered = session.query(BroadcastDelivery.id).filter(
+        BroadcastDelivery.broadcast_id == broadcast_id,
+        BroadcastDelivery.user_id == User.user_id).exists()
+    return session.query(User).filter(User.is_blocked == False,
+                                      User.bot_blocked == False, ~delivered)
+
+
+def create_broadcast(text: str,
+                     created_by: int = None,
+                     parse_mode: str = None) -> int:
+    """Создать рассылку и посчитать получателей"""
+    session = get_session()
+    try:
+        broadcast = Broadcast(text=text,
+                              parse_mode=parse_mode,
+                              created_by=created_by,
+                              status='running')
+        session.add(broadcast)
+        session.flush()
+        broadcast.total = _broadcast_recipients_query(session,
+                                                      broadcast.id).count()
+        session.commit()
+        return broadcast.id
+    finally:
+        session.close()
+
+
+def get_broadcast(broadcast_id: int):
+    """Get broadcast by id"""
+    session = get_session()
+    try:
+        return session.query(Broadcast).filter(
+            Broadcast.id == broadcast_id).first()
+    finally:
+        session.close()
+
+
+def get_unfinished_broadcasts():
+    """Рассылки, прерванные остановкой бота"""
+    session = get_session()
+    try:
+        return session.query(Broadcast).filter(
+            Broadcast.status == 'running').order_by(Broadcast.id).all()
+    finally:
+        session.close()
+
+
+def count_broadcast_recipients(broadcast_id: int) -> int:
+    """Сколько получателей осталось"""
+    session = get_session()
+    try:
+        return _broadcast_recipients_query(session, broadcast_id).count()
+    finally:
+        session.close()
+
+
+def get_broadcast_recipients(broadcast_id: int,
+                             after_id: int = 0,
+                             limit: int = 500) -> list:
+    """Страница получателей: [(users.id, user_id)], keyset по users.id"""
+    session = get_session()
+    try:
+        return [
+            tuple(row) for row in _broadcast_recipients_query(
+                session, broadcast_id).filter(User.id > after_id).order_by(
+                    User.id).with_entities(User.id, User.user_id).limit(
+                        limit).all()
+        ]
+    finally:
+        session.close()
+
+
+def record_broadcast_deliveries(broadcast_id: int, results: list) -> bool:
+    """Записать пачку результатов [(user_id, status, error)] одной транзакцией.
+
+    Пользователи со статусом 'blocked' помечаются bot_blocked и больше не
+    попадают в рассылки, пока снова не напишут боту.
+    """
+    if not results:
+        return True
+    session = get_session()
+    try:
+        session.execute(insert(BroadcastDelivery), [{
+            'broadcast_id': broadcast_id,
+            'user_id': user_id,
+            'status': status,
+            'error': error[:255] if error else None,
+            'created_at': datetime.utcnow()
+        } for user_id, status, error in results])
+
+        counts = {'sent': 0, 'failed': 0, 'blocked': 0}
+        for _, status, _ in results:
+            counts[status] += 1
+        blocked_ids = [
+            user_id for user_id, status, _ in results if status == 'blocked'
+        ]
+        if blocked_ids:
+            session.query(User).filter(User.user_id.in_(blocked_ids)).update(
+                {User.bot_blocked: True}, synchronize_session=False)
+        session.query(Broadcast).filter(Broadcast.id == broadcast_id).update(
+            {
+                Broadcast.sent: Broadcast.sent + counts['sent'],
+                Broadcast.failed: Broadcast.failed + counts['failed'],
+                Broadcast.blocked: Broadcast.blocked + counts['blocked']
+            },
+            synchronize_session=False)
+        session.commit()
+        return True
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Error recording broadcast deliveries: {e}")
+        return False
+    finally:
+        session.close()
+
+
+def finish_broadcast(broadcast_id: int, status: str = 'completed'):
+    """Закрыть рассылку"""
+    session = get_session()
+    try:
+        session.query(Broadcast).filter(Broadcast.id == broadcast_id).update(
+            {
+                Broadcast.status: status,
+                Broadcast.finished_at: datetime.utcnow()
+            },
+            synchronize_session=False)
+        session.commit()
+    finally:
+        session.close()
@@ -1,20 +1,68 @@
 import os
+import time
+import asyncio
 import logging
+from collections import Counter
 from gigachat import GigaChat
 from gigachat.models import Chat, Messages, MessagesRole
-from .cache import cache
+from .cache import cache, make_cache_key, SingleFlight
+from .semantic_cache import semantic_cache
+from .keyword_matcher import matcher
 from .knowledge_loader import knowledge
-from .adaptive_prompts import generate_adaptive_prompt, get_context_summary, detect_topic, analyze_question_complexity
-from .database import get_user_context, save_chat_history
+from .retrieval import retriever
+from .conversation import conversation
+from .intents import intents
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .adaptive_prompts import classify_message, compile_prompt, get_context_summary
+from .async_database import load_user_state, save_user_state
 
 logger = logging.getLogger(__name__)
 
 MAX_TOKENS = 100
 
+# Вопрос, который лучше передать мастеру
+ESCALATION_KEYWORDS = [
+    'сложн', 'особ', 'нестандарт', 'индивидуальн',
+    'срочно', 'сегодня', 'консультац', 'записаться',
+    'жалоб', 'претенз', 'брак', 'переделать'
+]
+# Модель не уверена в ответе
+UNCERTAIN_PHRASES = [
+    'не могу', 'затрудняюсь', 'сложно сказать',
+    'нужно посмотреть', 'зависит от', 'уточнить'
+]
+matcher.set_group('escalation', ESCALATION_KEYWORDS)
+matcher.set_group('uncertain', UNCERTAIN_PHRASES)
+
+# Одновременных запросов к GigaChat и предельное время ответа, секунд
+GIGACHAT_CONCURRENCY = int(os.getenv('GIGACHAT_CONCURRENCY', '10'))
+GIGACHAT_TIMEOUT = float(os.getenv('GIGACHAT_TIMEOUT', '30'))
+# Показывать ответ по мере генерации (если вызывающий передал on_partial)
+GIGACHAT_STREAMING = os.getenv('GIGACHAT_STREAMING', '1') == '1'
+# Простые вопросы («сколько стоит», «где вы») отвечать из базы знаний,
+# не дожидаясь модели, — только если в ней нашёлся уверенный ответ
+# (оценка BM25 не ниже ROUTE_SIMPLE_MIN_SCORE)
+ROUTE_SIMPLE_LOCAL = os.getenv('ROUTE_SIMPLE_LOCAL', '0') == '1'
+ROUTE_SIMPLE_MIN_SCORE = float(os.getenv('ROUTE_SIMPLE_MIN_SCORE', '10'))
+# Уверенно распознанные справочные вопросы (адрес, график, оплата, цены)
+# отвечать из базы знаний до кэшей и модели
+ROUTE_INTENTS = os.getenv('ROUTE_INTENTS', '1') == '1'
+# Если медиана ответа модели дольше, обычные вопросы тоже идут в базу знаний
+AI_LATENCY_BUDGET = float(os.getenv('AI_LATENCY_BUDGET', '6'))
+
 
 class GigaChatAPI:
     def __init__(self):
         self.client = None
+        self._semaphore = asyncio.Semaphore(GIGACHAT_CONCURRENCY)
+        self._inflight = SingleFlight()
+        self.breaker = CircuitBreaker('gigachat')
+        # Куда ушли вопросы, не попавшие в кэш
+        self.routes = Counter()
+        self._streaming = GIGACHAT_STREAMING
+        self.streamed = 0
+        self.stream_fallbacks = 0
+        self._first_chunk_total = 0.0
         self._init_client()
     
     def _init_client(self):
@@ -47,11 +95,17 @@ class GigaChatAPI:
             logger.error(f"Fallback search error: {e}")
         return None, False
     
-    async def get_response(self, message: str, user_id: int = None) -> tuple[str, bool]:
+    async def get_response(self, message: str, user_id: int = None,
+                           user_state=None, on_partial=None) -> tuple[str, bool]:
         """
         Get response from GigaChat with adaptive prompts and context.
         Returns (response_text, needs_human_help) tuple.
         needs_human_help=True when AI couldn't give a good answer.
+        user_state: cached UserState from the handler; the caller is then
+        responsible for save_user_state(). Without it the state is loaded
+        and saved here.
+        on_partial: async callback with the text generated so far; when
+        given, the answer is streamed (cached answers arrive in one piece).
         """
         needs_human = False
         
@@ -62,43 +116,115 @@ class GigaChatAPI:
             return "Извините, сервис временно недоступен. Позвоните нам: +7 (968) 396-91-52", True
         
         try:
-            user_context = get_user_context(user_id) if user_id else {
+            owns_state = user_state is None and bool(user_id)
+            if owns_state:
+                user_state = await load_user_state(user_id)
+            user_context = user_state.as_context() if user_state else {
                 'is_new': True, 'tone': 'friendly', 'questions_count': 0, 
                 'recent_topics': [], 'name': None
             }
             
-            adaptive_prompt = generate_adaptive_prompt(user_context, message)
-            knowledge_text = knowledge.get_all_knowledge()[:2500]
-            full_system_prompt = adaptive_prompt + knowledge_text
+            await retriever.refresh()
+            # Классификация сообщения — один раз, дальше передаётся готовой
+            profile = classify_message(message)
+            prompt = compile_prompt(user_context, profile)
+            # Ответ зависит от вопроса, промпта (тон, знакомство, время
+            # суток, сложность) и базы знаний; имя в хэш промпта не входит
+            cache_variant = (prompt.key, retriever.version)
+            # Уточнение («а джинсы?») отвечается с учётом прошлых реплик,
+            # такой ответ не берётся из общего кэша и не кладётся в него
+            dialog = conversation.build(
+                user_id, message,
+                list(user_state.recent_turns) if user_state else [])
+            
+            if not dialog.follow_up:
+                local = intents.answer(message) if ROUTE_INTENTS else None
+                if local:
+                    logger.info(f"Intent {local[0]} for: {message[:30]}")
+                    self.routes['intent'] += 1
+                    await self._record_answer(user_state, owns_state, message,
+                                              local[1], profile)
+                    return local[1], False
+
+                cached = cache.get(message, cache_variant)
+                if cached:
+                    logger.info(f"Cache hit for: {message[:30]}")
+                    await self._record_answer(user_state, owns_state, message,
+                                              cached, profile)
+                    return cached, self._check_needs_human(message, cached)
+                
+                # Перефразированный вопрос: ищем близкий среди уже отвеченных
+                semantic_cache.sync_knowledge(retriever.version, retriever.documents)
+                similar = semantic_cache.get(message, cache_variant)
+                if similar:
+                    logger.info(f"Semantic cache hit for: {message[:30]}")
+                    cache.set(message, similar, cache_variant)
+                    await self._record_answer(user_state, owns_state, message,
+                                              similar, profile)
+                    return similar, self._check_needs_human(message, similar)
+
+            route = self._route(message, profile, dialog)
+            if route != 'model':
+                fallback, found = self._get_fallback_response(message)
+                if found:
+                    self.routes[route] += 1
+                    await self._record_answer(user_state, owns_state, message,
+                                              fallback, profile)
+                    return fallback, False
+                if route == 'circuit_open':
+                    self.routes['unavailable'] += 1
+                    return "Извините, сервис временно недоступен. Позвоните нам: +7 (968) 396-91-52", True
+            self.routes['model'] += 1
+
+            # Только фрагменты базы знаний, относящиеся к вопросу (для
+            # уточнения — вместе с предыдущим вопросом)
+            knowledge_text = retriever.context_for(dialog.query)
+            full_system_prompt = prompt.text + knowledge_text
             
-            context_info = get_context_summary(user_context, message)
+            context_info = get_context_summary(user_context, message, profile)
+            if dialog.follow_up:
+                context_info['dialog_turns'] = len(dialog.turns)
+                context_info['dialog_tokens'] = dialog.tokens
             logger.info(f"Adaptive context: {context_info}")
             
             payload = Chat(
-                messages=[
-                    Messages(
-                        role=MessagesRole.SYSTEM,
-                        content=full_system_prompt
-                    ),
-                    Messages(
-                        role=MessagesRole.USER,
-                        content=message
-                    )
-                ],
+                messages=self._build_messages(full_system_prompt, dialog,
+                                              message),
                 max_tokens=MAX_TOKENS,
                 temperature=0.7
             )
             
-            response = self.client.chat(payload)
-            logger.info(f"GigaChat response received for: {message[:30]}")
+            name = user_context.get('name')
             
-            if response and hasattr(response, 'choices') and response.choices:
-                answer = response.choices[0].message.content
-                
-                if user_id:
-                    topic = detect_topic(message)
-                    complexity = analyze_question_complexity(message)
-                    save_chat_history(user_id, message, answer, topic, complexity)
+            async def ask_model():
+                answer = await self._complete(payload, on_partial)
+                logger.info(f"GigaChat response received for: {message[:30]}")
+                if answer is None:
+                    return None, False
+                # Обращение по имени и ответ на уточнение не должны уйти
+                # другим пользователям
+                shareable = (bool(answer) and not dialog.follow_up
+                             and not (name and name in answer))
+                if shareable:
+                    cache.set(message, answer, cache_variant)
+                    semantic_cache.add(message, answer, cache_variant)
+                return answer, shareable
+            
+            if dialog.follow_up:
+                answer, _ = await ask_model()
+            else:
+                # Одинаковые вопросы, заданные одновременно, ждут один запрос
+                (answer, shareable), leader = await self._inflight.do(
+                    make_cache_key(message, cache_variant), ask_model)
+                if not leader:
+                    if shareable:
+                        logger.info(f"Coalesced request for: {message[:30]}")
+                    else:
+                        answer, _ = await ask_model()
+            
+            if answer is not None:
+                await self._record_answer(user_state, owns_state, message,
+                                          answer, profile)
                 
                 needs_human = self._check_needs_human(message, answer)
                 return answer, needs_human
@@ -108,6 +234,20 @@ class GigaChatAPI:
                 return fallback, False
             
             return "Не удалось получить ответ. Попробуйте переформулировать вопрос или позвоните: +7 (968) 396-91-52", True
+        except CircuitOpenError:
+            # Автомат разомкнулся, пока готовился запрос
+            fallback, found = self._get_fallback_response(message)
+            if found:
+                return fallback, False
+            return "Извините, сервис временно недоступен. Позвоните нам: +7 (968) 396-91-52", True
+        except asyncio.TimeoutError:
+            logger.warning(f"GigaChat timeout ({GIGACHAT_TIMEOUT}s) for: {message[:30]}")
+            
+            fallback, found = self._get_fallback_response(message)
+            if found:
+                return fallback, False
+            
+            return "Извините, ответ занимает слишком много времени 🧵 Попробуйте ещё раз или позвоните нам: +7 (968) 396-91-52", True
         except Exception as e:
             logger.error(f"GigaChat error: {e}")
             
@@ -117,37 +257,165 @@ class GigaChatAPI:
             
             return "Ой, что-то пошло не так 🧵 Попробуйте позже или позвоните нам: +7 (968) 396-91-52", True
     
+    def _route(self, message: str, profile, dialog) -> str:
+        """Кто отвечает на вопрос, не найденный в кэше.
+
+        circuit_open — модель недоступна; local_simple — простой вопрос с
+        уверенным ответом в базе знаний (иначе общая справка вместо ответа);
+        local_slow — модель сейчас медленнее AI_LATENCY_BUDGET, а вопрос не
+        сложный; model — GigaChat. Уточнения в диалоге всегда идут в модель.
+        """
+        if not self.breaker.available():
+            return 'circuit_open'
+        if dialog.follow_up:
+            return 'model'
+        if (ROUTE_SIMPLE_LOCAL and profile.complexity == 'simple'
+                and self._confident_match(message)):
+            return 'local_simple'
+        if (profile.complexity == 'medium'
+                and self.breaker.latency() > AI_LATENCY_BUDGET):
+            return 'local_slow'
+        return 'model'
+    
+    @staticmethod
+    def _confident_match(message: str) -> bool:
+        """В базе знаний есть FAQ или строка прайса именно про этот вопрос"""
+        try:
+            results = knowledge.search(message, 1)
+        except Exception as e:
+            logger.error(f"Knowledge search error: {e}")
+            return False
+        return bool(results) and results[0][3] >= ROUTE_SIMPLE_MIN_SCORE
+    
+    def get_metrics(self) -> dict:
+        """Счётчики кэшей ответов и объединения одинаковых запросов"""
+        return {'breaker': self.breaker.stats(),
+                'routes': dict(self.routes),
+                'cache': cache.stats(),
+                'semantic_cache': semantic_cache.stats(),
+                'single_flight': self._inflight.stats(),
+                'conversation': conversation.stats(),
+                'intents': intents.stats(),
+                'streaming': {
+                    'streamed': self.streamed,
+                    'fallbacks': self.stream_fallbacks,
+                    'avg_first_chunk_ms': round(
+                        self._first_chunk_total * 1000 / self.streamed)
+                    if self.streamed else 0}}
+    
+    @staticmethod
+    def _build_messages(system_prompt: str, dialog, message: str) -> list:
+        """Системный промпт, окно диалога и текущий вопрос"""
+        if dialog.summary:
+            system_prompt = f"{system_prompt}\n\n{dialog.summary}"
+        messages = [Messages(role=MessagesRole.SYSTEM, content=system_prompt)]
+        for turn in dialog.turns:
+            messages.append(Messages(role=MessagesRole.USER, content=turn.message))
+            messages.append(Messages(role=MessagesRole.ASSISTANT,
+                                     content=turn.response))
+        messages.append(Messages(role=MessagesRole.USER, content=message))
+        return messages
+    
+    async def _chat(self, payload):
+        """Асинхронный запрос к GigaChat с лимитом параллельности и таймаутом.
+
+        achat не занимает event loop, пока модель думает; отмена задачи
+        (пользователь прислал новое сообщение) обрывает и HTTP-запрос.
+        """
+        async with self._semaphore:
+            return await asyncio.wait_for(self.client.achat(payload),
+                                          GIGACHAT_TIMEOUT)
+    
+    async def _complete(self, payload, on_partial=None):
+        """Текст ответа модели или None; итог учитывает автомат защиты"""
+        self.breaker.acquire()
+        started = time.monotonic()
+        try:
+            answer = await self._request(payload, on_partial)
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception:
+            self.breaker.record(False, time.monotonic() - started)
+            raise
+        self.breaker.record(answer is not None, time.monotonic() - started)
+        return answer
+    
+    async def _request(self, payload, on_partial=None):
+        """Запрос к модели; потоком, если есть кому показывать"""
+        if on_partial is not None and self._streaming:
+            try:
+                return await self._chat_stream(payload, on_partial)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                raise
+            except Exception as e:
+                # Потоковый режим недоступен — тот же запрос целиком
+                logger.warning(f"GigaChat streaming failed, falling back: {e}")
+                self.stream_fallbacks += 1
+                if isinstance(e, (AttributeError, NotImplementedError)):
+                    self._streaming = False
+        response = await self._chat(payload)
+        if not (response and hasattr(response, 'choices') and response.choices):
+            return None
+        return response.choices[0].message.content
+    
+    async def _chat_stream(self, payload, on_partial):
+        """Потоковый запрос: on_partial получает накопленный текст.
+
+        Частоту правок сообщения ограничивает сам on_partial; здесь
+        действуют тот же лимит параллельности и общий таймаут. Ошибка
+        on_partial не прерывает запрос: его могут ждать объединённые
+        вопросы других пользователей, показ просто прекращается.
+        """
+        async with self._semaphore:
+            async with asyncio.timeout(GIGACHAT_TIMEOUT):
+                started = time.monotonic()
+                parts = []
+                async for chunk in self.client.astream(payload):
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    if not parts:
+                        self._first_chunk_total += time.monotonic() - started
+                    parts.append(delta)
+                    if on_partial is None:
+                        continue
+                    try:
+                        await on_partial(''.join(parts))
+                    except Exception as e:
+                        logger.debug(f"Streaming callback failed: {e}")
+                        on_partial = None
+        if not parts:
+            raise ValueError("empty stream")
+        self.streamed += 1
+        return ''.join(parts)
+    
+    async def _record_answer(self, user_state, owns_state: bool,
+                             message: str, answer: str, profile) -> None:
+        """Записать вопрос и ответ в историю пользователя"""
+        if not user_state:
+            return
+        user_state.record_chat(message, answer, profile.topic,
+                               profile.complexity)
+        if owns_state:
+            await save_user_state(user_state)
+    
     def _check_needs_human(self, question: str, answer: str) -> bool:
         """Определяет, нужна ли помощь человека"""
-        complex_keywords = [
-            'сложн', 'особ', 'нестандарт', 'индивидуальн',
-            'срочно', 'сегодня', 'консультац', 'записаться',
-            'жалоб', 'претенз', 'брак', 'переделать'
-        ]
-        
-        question_lower = question.lower()
-        for keyword in complex_keywords:
-            if keyword in question_lower:
-                return True
-        
-        uncertain_phrases = [
-            'не могу', 'затрудняюсь', 'сложно сказать',
-            'нужно посмотреть', 'зависит от', 'уточнить'
-        ]
-        answer_lower = answer.lower()
-        for phrase in uncertain_phrases:
-            if phrase in answer_lower:
-                return True
-        
-        return False
+        return (matcher.has(question, 'escalation') or
+                matcher.has(answer, 'uncertain'))
 
 
 gigachat = GigaChatAPI()
 
 
-async def get_ai_response(text: str, user_id: int = None) -> tuple[str, bool]:
+async def get_ai_response(text: str, user_id: int = None,
+                          user_state=None, on_partial=None) -> tuple[str, bool]:
     """
     Get AI response from GigaChat with adaptive context.
     Returns (response_text, needs_human_help) tuple.
     """
-    return await gigachat.get_response(text, user_id)
+    return await gigachat.get_response(text, user_id, user_state=user_state,
+                                       on_partial=on_partial)
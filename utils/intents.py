@@ -0,0 +1,244 @@
+"""
+Ответы на типовые вопросы без GigaChat.
+
+В KnowledgeLoader давно есть готовые ответы про адрес, график, оплату,
+сроки и цены, но использовались они только при сбое модели. Здесь
+классификатор намерений на одной скомпилированной регулярке определяет
+тему вопроса и уверенность; при уверенности не ниже INTENT_CONFIDENCE
+ответ берётся из базы знаний до кэшей и модели — за доли миллисекунды.
+
+Уверенность снижают признаки вопроса, на который шаблон не ответит:
+рассуждение («почему», «что лучше»), длинное сообщение, две темы сразу;
+жалоба, просьба позвать мастера или вопрос о своём заказе обнуляют её.
+Вопрос о цене конкретной работы отвечается, только если она нашлась в
+прайсе или FAQ.
+
+`python -m utils.intents --replay N` прогоняет классификатор по
+последним N вопросам из chat_history и печатает долю отвеченных локально,
+время ответа и сколько запросов к GigaChat не понадобилось бы.
+"""
+import os
+import re
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from .knowledge_loader import knowledge
+
+INTENT_CONFIDENCE = float(os.getenv('INTENT_CONFIDENCE', '0.75'))
+# Длиннее — скорее рассказ о проблеме, чем справочный вопрос
+INTENT_MAX_WORDS = 12
+
+# (тема, вес, регулярка); 1.0 — признак сам по себе достаточный
+INTENT_PATTERNS = [
+    ('contacts', 1.0, r'\bадрес'),
+    ('contacts', 1.0, r'\bгде\s+(?:вы|вас|ваш|находит|располож|мастерск|ателье)'),
+    ('contacts', 1.0, r'\bкак\s+(?:к\s+вам\s+|до\s+вас\s+)?(?:добраться|доехать|пройти|найти)'),
+    ('contacts', 1.0, r'\b(?:телефон|номер\s+телефона|whatsapp|ватсап|вотсап)'),
+    ('contacts', 0.5, r'\bномер'),
+    ('contacts', 0.5, r'\b(?:где|метро|мцд|ховрино|бусиново)\b'),
+    ('schedule', 1.0, r'\b(?:график|режим\s+работы|часы\s+работы)'),
+    ('schedule', 1.0, r'\bдо\s+скольки\b'),
+    ('schedule', 1.0, r'\bво\s+сколько\s+(?:вы\s+)?(?:открыва|закрыва|работа)'),
+    ('schedule', 1.0, r'\b(?:работаете|открыты)\b.*\b(?:сегодня|завтра|выходн|суббот|воскрес|праздн)'),
+    ('schedule', 0.5, r'\b(?:выходн|работаете|открыты)'),
+    ('payment', 1.0, r'\b(?:оплат|сбп|наличн|картой|безнал)'),
+    ('payment', 0.5, r'\bпереводом\b'),
+    ('timing', 1.0, r'\b(?:как\s+долго|сколько\s+(?:по\s+времени|времени|дней|ждать))'),
+    ('timing', 1.0, r'\bкогда\s+(?:будет\s+)?готов'),
+    ('timing', 0.5, r'\b(?:срок|срочн)'),
+    ('warranty', 1.0, r'\bгаранти'),
+    ('prices', 1.0, r'\b(?:прайс|расценк)'),
+    ('prices', 1.0, r'\b(?:ваши|какие|какие\s+у\s+вас)\s+цены\b'),
+    ('price_item', 1.0, r'\b(?:сколько\s+(?:стоит|стоят|будет\s+стоить)|цена|стоимость|почём\b|почем\b)'),
+]
+
+# Вопрос требует рассуждения — справочный ответ его не закроет
+_REASONING = re.compile(
+    r'\b(?:почему|зачем|посоветуй|подскаж|что\s+лучше|как\s+лучше|можно\s+ли|'
+    r'разниц|стоит\s+ли|что\s+делать)')
+# Вопрос о своём заказе («номер заказа», «до скольки ждать заказ») —
+# ответ зависит от заказа, а не от справки
+_ORDER = re.compile(r'\b(?:заказ|квитанц)')
+# Жалоба или просьба о мастере — не отвечаем шаблоном
+_HANDOVER = re.compile(
+    r'\b(?:жалоб|претенз|брак|переделать|испортил|мастер(?!ск)|менеджер|'
+    r'консультац|записаться)')
+
+_PATTERN = re.compile('|'.join(f'(?P<p{number}>{pattern})'
+                               for number, (_, _, pattern)
+                               in enumerate(INTENT_PATTERNS)))
+
+
+@dataclass(frozen=True)
+class Intent:
+    name: Optional[str]
+    confidence: float
+
+
+class IntentClassifier:
+    def __init__(self, threshold: float = INTENT_CONFIDENCE):
+        self.threshold = threshold
+        self.answered = 0
+        self.declined = 0
+
+    def classify(self, text: str) -> Intent:
+        """Тема вопроса и уверенность от 0 до 1"""
+        lowered = text.lower()
+        scores = {}
+        for match in _PATTERN.finditer(lowered):
+            name, weight, _ = INTENT_PATTERNS[int(match.lastgroup[1:])]
+            scores[name] = scores.get(name, 0.0) + weight
+        if not scores:
+            return Intent(None, 0.0)
+        # Общий вопрос о ценах и вопрос о цене работы — одна тема
+        if 'prices' in scores and 'price_item' in scores:
+            del scores['price_item']
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        name, best = ranked[0]
+        if _HANDOVER.search(lowered) or _ORDER.search(lowered):
+            return Intent(name, 0.0)
+        confidence = min(best, 1.0)
+        if len(ranked) > 1:
+            confidence *= 1 - min(ranked[1][1], 1.0) / 2
+        if _REASONING.search(lowered):
+            confidence *= 0.5
+        if len(text.split()) > INTENT_MAX_WORDS:
+            confidence *= 0.6
+        return Intent(name, round(confidence, 3))
+
+    def answer(self, text: str) -> Optional[tuple]:
+        """(тема, ответ) для уверенно распознанного вопроса, иначе None"""
+        intent = self.classify(text)
+        if intent.name is None or intent.confidence < self.threshold:
+            self.declined += 1
+            return None
+        if intent.name == 'price_item':
+            # Только если работа нашлась в прайсе или FAQ
+            response = knowledge.search_answer(text)
+        else:
+            response = knowledge.category_answer(intent.name)
+        if not response:
+            self.declined += 1
+            return None
+        self.answered += 1
+        return intent.name, response
+
+    def stats(self) -> dict:
+        total = self.answered + self.declined
+        return {'answered': self.answered,
+                'declined': self.declined,
+                'answer_rate': self.answered / total if total else 0.0}
+
+
+intents = IntentClassifier()
+
+# Размеченные вопросы: тема, если отвечать локально, иначе None
+SAMPLE_QUESTIONS = [
+    ("Какой у вас адрес?", 'contacts'),
+    ("Где вы находитесь?", 'contacts'),
+    ("Как до вас добраться от метро?", 'contacts'),
+    ("Дайте номер телефона", 'contacts'),
+    ("Есть WhatsApp?", 'contacts'),
+    ("График работы какой?", 'schedule'),
+    ("До скольки вы сегодня работаете?", 'schedule'),
+    ("Работаете в воскресенье?", 'schedule'),
+    ("Во сколько открываетесь?", 'schedule'),
+    ("Можно оплатить картой?", 'payment'),
+    ("Принимаете наличные?", 'payment'),
+    ("Оплата по СБП есть?", 'payment'),
+    ("Сколько дней ждать?", 'timing'),
+    ("Когда будет готово?", 'timing'),
+    ("Есть гарантия на работу?", 'warranty'),
+    ("Пришлите прайс", 'prices'),
+    ("Какие у вас цены?", 'prices'),
+    ("Сколько стоит подшить брюки?", 'price_item'),
+    ("Сколько стоит укоротить джинсы?", 'price_item'),
+    ("Почему молния на куртке расходится и что лучше, заменить или починить?", None),
+    ("Хочу оставить жалобу, брак после ремонта", None),
+    ("Посоветуйте, можно ли ушить платье из шёлка по фигуре?", None),
+    ("Как лучше поступить с дыркой на пуховике?", None),
+    ("Какой номер моего заказа?", None),
+    ("До скольки ждать заказ?", None),
+    ("Когда будет готов мой заказ?", None),
+    ("Номер квитанции потеряла, что делать?", None),
+    ("Привет!", None),
+    ("Спасибо большое", None),
+    ("У меня старое пальто бабушки, хочу перешить его в современное, "
+     "подскажите что можно сделать и сколько это займёт", None),
+]
+
+
+def replay(messages: list, model_latency: float = 2.5) -> dict:
+    """Прогнать вопросы через классификатор, как если бы он стоял перед моделью.
+
+    model_latency — типичное время ответа GigaChat, секунд (для оценки
+    сэкономленного времени).
+    """
+    classifier = IntentClassifier()
+    by_intent = {}
+    durations = []
+    for message in messages:
+        started = time.perf_counter()
+        result = classifier.answer(message)
+        elapsed = time.perf_counter() - started
+        if result:
+            durations.append(elapsed)
+            by_intent[result[0]] = by_intent.get(result[0], 0) + 1
+    durations.sort()
+    answered = len(durations)
+    return {
+        'messages': len(messages),
+        'answered_locally': answered,
+        'answer_rate': round(answered / len(messages), 3) if messages else 0.0,
+        'gigachat_calls_avoided': answered,
+        'by_intent': by_intent,
+        'local_ms_p50': round(durations[answered // 2] * 1000, 3) if durations else 0.0,
+        'local_ms_p95': round(durations[int(answered * 0.95)] * 1000, 3) if durations else 0.0,
+        'latency_saved_seconds': round(answered * model_latency - sum(durations), 1)
+    }
+
+
+def sample_accuracy() -> dict:
+    """Точность на SAMPLE_QUESTIONS: верная тема или верный отказ"""
+    classifier = IntentClassifier()
+    correct = 0
+    wrong = []
+    for question, expected in SAMPLE_QUESTIONS:
+        result = classifier.answer(question)
+        actual = result[0] if result else None
+        if actual == expected:
+            correct += 1
+        else:
+            wrong.append((question, expected, actual))
+    return {'sample_questions': len(SAMPLE_QUESTIONS),
+            'sample_accuracy': round(correct / len(SAMPLE_QUESTIONS), 3),
+            'sample_errors': wrong}
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Локальные ответы на типовые вопросы")
+    parser.add_argument('--replay', type=int, metavar='N', default=5000,
+                        help="прогнать последние N вопросов из chat_history")
+    parser.add_argument('--model-latency', type=float, default=2.5,
+                        help="типичное время ответа GigaChat, секунд")
+    parser.add_argument('query', nargs='*', help="вопрос для проверки")
+    args = parser.parse_args()
+    if args.query:
+        from .intents import intents
+        question = ' '.join(args.query)
+        print(intents.classify(question))
+        print(intents.answer(question))
+    else:
+        from .database import get_recent_chat_messages, init_db
+        init_db()
+        history = get_recent_chat_messages(args.replay)
+        # Без истории — размеченные примеры, чтобы отчёт было с чем сравнить
+        report = replay(history or [q for q, _ in SAMPLE_QUESTIONS],
+                        args.model_latency)
+        report['source'] = 'chat_history' if history else 'samples'
+        report.update(sample_accuracy())
+        for key, value in report.items():
+            print(f"{key}: {value}")
@@ -0,0 +1,210 @@
+"""
+Поиск ключевых слов всех категорий за один проход по тексту.
+
+Антиспам (чёрный и белый списки), определение темы и сложности вопроса
+и проверка «нужен ли человек» раньше каждый раз перебирали свой список
+слов через `word in text.lower()`. Здесь все списки собраны в одно
+регулярное выражение: движок re проходит текст один раз и находит все
+вхождения, включая вложенные («сколько» внутри «сколько стоит»).
+
+Слова ищутся как подстроки — так же, как раньше, поэтому префиксы
+вроде «инвестиц» или «куртк» продолжают работать. Списки можно менять
+на лету через set_group/add_words/remove_words.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+
+SCAN_CACHE_SIZE = 256
+
+
+def _trie_regex(words, repeats: bool = False) -> str:
+    """Регулярка-префиксное дерево: общие начала слов проверяются один раз.
+
+    Окончание слова внутри дерева — жадная необязательная группа, поэтому
+    в каждой позиции совпадает самое длинное слово. С repeats=True каждая
+    буква может повторяться («бляяя»).
+    """
+    quantifier = '+' if repeats else ''
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def render(node):
+        branches = [re.escape(char) + quantifier + render(child)
+                    for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return '(?:' + body + ')?' if '' in node else body
+
+    return render(trie)
+
+
+class KeywordMatcher:
+    """Набор именованных групп слов и общий скомпилированный поиск"""
+
+    def __init__(self):
+        self._groups = OrderedDict()
+        self._lock = threading.Lock()
+        # (регулярка, {найденная строка: группы всех слов-префиксов}); меняется целиком
+        self._compiled = (None, {})
+        # Один и тот же текст проверяют несколько модулей подряд
+        self._cache = OrderedDict()
+        self.version = 0
+
+    # ----- списки слов -----
+
+    def set_group(self, group: str, words) -> None:
+        """Заменить слова группы"""
+        with self._lock:
+            self._groups[group] = list(dict.fromkeys(w.lower() for w in words if w))
+            self._rebuild()
+
+    def add_words(self, group: str, words) -> None:
+        with self._lock:
+            current = self._groups.setdefault(group, [])
+            for word in words:
+                word = word.lower()
+                if word and word not in current:
+                    current.append(word)
+            self._rebuild()
+
+    def remove_words(self, group: str, words) -> None:
+        with self._lock:
+            removed = {w.lower() for w in words}
+            self._groups[group] = [w for w in self._groups.get(group, [])
+                                   if w not in removed]
+            self._rebuild()
+
+    def words(self, group: str) -> list:
+        return list(self._groups.get(group, ()))
+
+    def _rebuild(self) -> None:
+        keywords = {}
+        for group, words in self._groups.items():
+            for word in words:
+                keywords.setdefault(word, []).append(group)
+        if not keywords:
+            self._compiled = (None, {})
+        else:
+            # В каждой позиции совпадает самое длинное слово, а более
+            # короткие слова с той же позиции — его префиксы
+            pattern = re.compile('(?=(' + _trie_regex(keywords) + '))')
+            hits = {}
+            for word in keywords:
+                hits[word] = [(prefix, group)
+                              for prefix, groups in keywords.items()
+                              if word.startswith(prefix)
+                              for group in groups]
+            self._compiled = (pattern, hits)
+        self._cache = OrderedDict()
+        self.version += 1
+
+    # ----- поиск -----
+
+    def scan(self, text: str) -> dict:
+        """{группа: [найденные слова в порядке появления], ...} за один проход.
+
+        Результат кэшируется и общий для всех вызывающих — не изменять.
+        """
+        cache = self._cache
+        result = cache.get(text)
+        if result is not None:
+            return result
+        pattern, hits = self._compiled
+        result = {}
+        if pattern is not None and text:
+            for match in pattern.finditer(text.lower()):
+                for word, group in hits[match.group(1)]:
+                    found = result.setdefault(group, [])
+                    if word not in found:
+                        found.append(word)
+        cache[text] = result
+        if len(cache) > SCAN_CACHE_SIZE:
+            cache.popitem(last=False)
+        return result
+
+    def first(self, text: str, group: str):
+        """Первое найденное слово группы или None"""
+        found = self.scan(text).get(group)
+        return found[0] if found else None
+
+    def has(self, text: str, group: str) -> bool:
+        return group in self.scan(text)
+
+
+matcher = KeywordMatcher()
+
+
+def benchmark(messages: int = 10000) -> dict:
+    """Сравнить циклы `word in text` со сканированием matcher.
+
+    legacy — прежние проверки с выходом на первом совпадении, loops — все
+    слова всех групп циклом (то, что matcher возвращает за один проход).
+    """
+    import random
+
+    # Импорт регистрирует группы; при запуске через -m этот файл — __main__,
+    # поэтому берём экземпляр из пакета
+    from . import adaptive_prompts, anti_spam, gigachat_api  # noqa: F401
+    from .keyword_matcher import matcher
+
+    rng = random.Random(42)
+    vocabulary = []
+    for group in matcher._groups:
+        vocabulary.extend(matcher.words(group))
+    filler = ('здравствуйте подскажите пожалуйста мне нужно вещь '
+              'сегодня завтра вечером дочке сыну старую новую').split()
+    samples = [' '.join(rng.choice(filler if rng.random() < 0.8 else vocabulary)
+                        for _ in range(rng.randint(3, 25)))
+               for _ in range(messages)]
+    groups = {group: matcher.words(group) for group in matcher._groups}
+
+    def loops(text):
+        text_lower = text.lower()
+        return {group: [w for w in words if w in text_lower]
+                for group, words in groups.items()}
+
+    def legacy(text):
+        # Как раньше: каждая проверка сама приводит текст к нижнему регистру
+        # и перебирает свой список до первого совпадения
+        for group in ('whitelist', 'spam', 'topic:repair', 'topic:price',
+                      'topic:info', 'topic:fabric', 'complexity:simple',
+                      'complexity:complex', 'escalation'):
+            text_lower = text.lower()
+            any(w in text_lower for w in groups[group])
+
+    results = {'messages': messages, 'groups': len(groups),
+               'keywords': sum(len(w) for w in groups.values())}
+    mismatches = 0
+    for text in samples:
+        expected = {g: sorted(w) for g, w in loops(text).items() if w}
+        actual = {g: sorted(w) for g, w in matcher.scan(text).items()}
+        mismatches += expected != actual
+    results['mismatches'] = mismatches
+
+    for name, func in (('legacy', legacy), ('loops', loops),
+                       ('matcher', matcher.scan)):
+        matcher._cache = OrderedDict()
+        started = time.perf_counter()
+        for text in samples:
+            func(text)
+        results[f'{name}_us_per_message'] = round(
+            (time.perf_counter() - started) * 1e6 / messages, 2)
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Поиск ключевых слов")
+    parser.add_argument('--benchmark', type=int, metavar='N', default=10000,
+                        help="сравнить с циклами на N синтетических сообщениях")
+    args = parser.parse_args()
+    for key, value in benchmark(args.benchmark).items():
+        print(f"{key}: {value}")
@@ -1,14 +1,22 @@
 import os
+from types import MappingProxyType
 from typing import Optional
 
+from .knowledge_loader import KNOWLEDGE_DIR, directory_signature
+
 class KnowledgeBase:
-    def __init__(self):
-        self.data_dir = 'data/knowledge_base'
-        self.knowledge = {}
+    def __init__(self, data_dir: str = KNOWLEDGE_DIR):
+        self.data_dir = data_dir
+        # Словарь не изменяется, при перезагрузке подменяется целиком
+        self.knowledge = MappingProxyType({})
+        self.version = 0
+        self._signature = None
         self._load_knowledge()
-    
+
     def _load_knowledge(self):
         """Load knowledge base files"""
+        signature = directory_signature(self.data_dir)
+        knowledge = {}
         if os.path.exists(self.data_dir):
             for filename in os.listdir(self.data_dir):
                 if filename.endswith('.txt'):
@@ -16,8 +24,21 @@ class KnowledgeBase:
                     try:
                         with open(filepath, 'r', encoding='utf-8') as f:
                             category = filename.replace('.txt', '')
-                            self.knowledge[category] = f.read()
+                            knowledge[category] = f.read()
                     except Exception:
                         pass
+        self.knowledge = MappingProxyType(knowledge)
+        self._signature = signature
+        self.version += 1
+
+    def reload_if_changed(self) -> bool:
+        """Перечитать файлы, если они изменились"""
+        if directory_signature(self.data_dir) == self._signature:
+            return False
+        self._load_knowledge()
+        return True
+
+    def get(self, category: str) -> Optional[str]:
+        return self.knowledge.get(category)
 
 kb = KnowledgeBase()
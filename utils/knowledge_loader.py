@@ -1,32 +1,189 @@
 import os
 import json
+import logging
 import re
+from dataclasses import dataclass
+from types import MappingProxyType
+
+from .cache import normalize_text
+from .text_index import BM25Index
+
+KNOWLEDGE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'data', 'knowledge_base')
+PRICES_FILE = "Цены на услуги.txt"
+FAQ_FILE = "Ответы на вопросы.md"
+
+# Ниже этой оценки BM25 совпадение считается случайным
+SEARCH_MIN_SCORE = float(os.getenv('KNOWLEDGE_SEARCH_MIN_SCORE', '2.0'))
+
+# Начало слова -> тема; при нескольких совпадениях побеждает верхнее
+SEARCH_KEYWORDS = [
+    ('цен', 'prices'),
+    ('прайс', 'prices'),
+    ('стоим', 'prices'),
+    ('сколько', 'prices'),
+    ('адрес', 'contacts'),
+    ('где', 'contacts'),
+    ('находит', 'contacts'),
+    ('метро', 'contacts'),
+    ('телефон', 'contacts'),
+    ('whatsapp', 'contacts'),
+    ('график', 'schedule'),
+    ('работает', 'schedule'),
+    ('время', 'schedule'),
+    ('выходн', 'schedule'),
+    ('срок', 'timing'),
+    ('долго', 'timing'),
+    ('быстро', 'timing'),
+    ('срочн', 'urgent'),
+    ('оплат', 'payment'),
+    ('картой', 'payment'),
+    ('наличн', 'payment'),
+    ('гарант', 'warranty'),
+    ('услуг', 'services'),
+    ('ремонт', 'services'),
+    ('подгонк', 'services'),
+    ('укорот', 'services'),
+    ('штопк', 'services'),
+]
+_KEYWORD_RANKS = {keyword: rank for rank, (keyword, _) in enumerate(SEARCH_KEYWORDS)}
+_KEYWORD_LENGTHS = sorted({len(keyword) for keyword in _KEYWORD_RANKS})
+_PRICE_TAB = re.compile(r'\s*\t\s*')
+KNOWLEDGE_EXTENSIONS = ('.txt', '.md')
+
+logger = logging.getLogger(__name__)
+
+
+def directory_signature(directory: str) -> tuple:
+    """(имя, mtime, размер) файлов базы знаний — меняется при любой правке"""
+    if not os.path.isdir(directory):
+        return ()
+    signature = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith(KNOWLEDGE_EXTENSIONS):
+            stat = entry.stat()
+            signature.append((entry.name, stat.st_mtime_ns, stat.st_size))
+    return tuple(sorted(signature))
+
+
+def read_knowledge_files(directory: str) -> dict:
+    """Содержимое всех файлов базы знаний: {имя файла: текст}"""
+    files = {}
+    for name, _, _ in directory_signature(directory):
+        with open(os.path.join(directory, name), 'r', encoding='utf-8') as f:
+            files[name] = f.read()
+    return files
+
+
+@dataclass(frozen=True)
+class KnowledgeSnapshot:
+    """Неизменяемый срез базы знаний: всё, что читают обработчики"""
+    version: int
+    signature: tuple
+    files: MappingProxyType
+    prices: MappingProxyType
+    prices_by_category: MappingProxyType
+    faq: MappingProxyType
+    index: BM25Index
+    entries: tuple
+
 
 class KnowledgeLoader:
-    """Загрузчик знаний из файлов"""
+    """Загрузчик знаний из файлов.
+
+    Все данные лежат в одном KnowledgeSnapshot. Перезагрузка строит новый
+    снимок целиком и подменяет ссылку одним присваиванием, поэтому
+    читатели видят либо старую, либо новую базу, но не смесь.
+    """
     
-    def __init__(self):
-        self.prices = {}
-        self.prices_by_category = {}
-        self.faq = {}
+    def __init__(self, directory: str = KNOWLEDGE_DIR):
+        self.directory = directory
+        self._failed_signature = None
+        self._snapshot = self._build_snapshot({}, 0, None)
         self.load_all()
     
-    def load_all(self):
-        """Загрузить все данные"""
-        self.load_prices()
-        self.load_faq()
+    @property
+    def snapshot(self) -> KnowledgeSnapshot:
+        return self._snapshot
+    
+    @property
+    def version(self) -> int:
+        """Растёт при каждой перезагрузке; входит в ключи кэша ответов"""
+        return self._snapshot.version
     
-    def load_prices(self):
-        """Загрузить цены из файла"""
-        prices_file = "workshop-bot/data/knowledge_base/Цены на услуги.txt"
-        if os.path.exists(prices_file):
-            with open(prices_file, 'r', encoding='utf-8') as f:
-                content = f.read()
-                self.prices = {
-                    "raw": content,
-                    "formatted": self._format_prices(content)
-                }
-                self.prices_by_category = self._parse_prices_by_category(content)
+    @property
+    def prices(self):
+        return self._snapshot.prices
+    
+    @property
+    def prices_by_category(self):
+        return self._snapshot.prices_by_category
+    
+    @property
+    def faq(self):
+        return self._snapshot.faq
+    
+    def load_all(self) -> KnowledgeSnapshot:
+        """Загрузить все данные и атомарно заменить снимок"""
+        # Подпись берём до чтения: правка во время чтения даст ещё одну перезагрузку
+        signature = directory_signature(self.directory)
+        files = read_knowledge_files(self.directory)
+        snapshot = self._build_snapshot(files, self._snapshot.version + 1,
+                                        signature)
+        self._snapshot = snapshot
+        return snapshot
+    
+    def reload_if_changed(self) -> bool:
+        """Перечитать базу, если файлы изменились. Ошибка оставляет старый снимок"""
+        signature = directory_signature(self.directory)
+        if signature in (self._snapshot.signature, self._failed_signature):
+            return False
+        try:
+            snapshot = self.load_all()
+        except Exception as e:
+            # Повторим, когда файл снова изменится
+            self._failed_signature = signature
+            logger.error(f"Knowledge reload failed, keeping v{self.version}: {e}")
+            return False
+        logger.info(f"Knowledge base reloaded: v{snapshot.version}, "
+                    f"{len(snapshot.faq.get('parsed', {}))} FAQ, "
+                    f"{len(snapshot.prices_by_category)} price categories")
+        return True
+    
+    def _build_snapshot(self, files: dict, version: int,
+                        signature) -> KnowledgeSnapshot:
+        """Разобрать тексты файлов в новый снимок"""
+        prices = {}
+        prices_by_category = {}
+        faq = {}
+        content = files.get(PRICES_FILE)
+        if content is not None:
+            prices = {
+                "raw": content,
+                "formatted": self._format_prices(content)
+            }
+            prices_by_category = {
+                category: tuple(lines) for category, lines
+                in self._parse_prices_by_category(content).items()
+            }
+        content = files.get(FAQ_FILE)
+        if content is not None:
+            faq = {
+                "raw": content,
+                "parsed": MappingProxyType(self._parse_faq(content))
+            }
+        index, entries = self._build_index(faq.get('parsed', {}),
+                                           prices_by_category)
+        return KnowledgeSnapshot(
+            version=version,
+            signature=signature,
+            files=MappingProxyType(dict(files)),
+            prices=MappingProxyType(prices),
+            prices_by_category=MappingProxyType(prices_by_category),
+            faq=MappingProxyType(faq),
+            index=index,
+            entries=tuple(entries))
     
     def _parse_prices_by_category(self, content):
         """Разбить цены на категории"""
@@ -109,17 +266,6 @@ class KnowledgeLoader:
         
         return faq_dict
     
-    def load_faq(self):
-        """Загрузить FAQ из файла"""
-        faq_file = "workshop-bot/data/knowledge_base/Ответы на вопросы.md"
-        if os.path.exists(faq_file):
-            with open(faq_file, 'r', encoding='utf-8') as f:
-                content = f.read()
-                self.faq = {
-                    "raw": content,
-                    "parsed": self._parse_faq(content)
-                }
-    
     def get_prices(self):
         """Получить форматированные цены"""
         return self.prices.get('formatted', 'Цены не загружены')
@@ -175,83 +321,101 @@ class KnowledgeLoader:
     
     def get_all_knowledge(self):
         """Получить всё знание для GigaChat"""
-        prices = self.get_price_raw()
-        faq_text = "\n\n".join([f"В: {q}\nО: {a}" for q, a in self.faq.get('parsed', {}).items()])
+        snapshot = self._snapshot
+        prices = snapshot.prices.get('raw', '')
+        faq_text = "\n\n".join([f"В: {q}\nО: {a}" for q, a in snapshot.faq.get('parsed', {}).items()])
         return f"ПРАЙС-ЛИСТ:\n{prices}\n\nFAQ:\n{faq_text}"
 
+    @staticmethod
+    def _build_index(faq: dict, prices_by_category: dict) -> tuple:
+        """Инвертированный индекс по вопросам и ответам FAQ и строкам прайса"""
+        index = BM25Index()
+        entries = []
+        for question, answer in faq.items():
+            # Совпадение с формулировкой вопроса важнее, чем с текстом ответа
+            index.add(f"{question}\n{question}\n{answer}")
+            entries.append(('faq', question, answer))
+        for category, lines in prices_by_category.items():
+            for line in lines:
+                index.add(f"{category}\n{line}")
+                entries.append(('price', category, line))
+        index.prepare()
+        return index, entries
+
+    def search(self, query: str, limit: int = 5) -> list:
+        """
+        Ранжированный поиск по FAQ и прайсу.
+        Возвращает [(вид, заголовок, текст, оценка), ...], вид — 'faq' или 'price'.
+        """
+        snapshot = self._snapshot
+        return [snapshot.entries[doc_id] + (score,)
+                for doc_id, score in snapshot.index.search(query, limit)
+                if score >= SEARCH_MIN_SCORE]
+
+    def _match_category(self, query: str):
+        """Тема вопроса по ключевым словам: префиксы слов ищутся в словаре"""
+        best = None
+        for word in normalize_text(query).split():
+            for length in _KEYWORD_LENGTHS:
+                rank = _KEYWORD_RANKS.get(word[:length])
+                if rank is not None and (best is None or rank < best):
+                    best = rank
+        return SEARCH_KEYWORDS[best][1] if best is not None else None
+
     def search_knowledge(self, query: str) -> str:
         """
         Поиск ответа в базе знаний по ключевым словам.
         Используется как фоллбэк при недоступности GigaChat.
         """
-        query_lower = query.lower()
-        results = []
+        matched_category = self._match_category(query)
         
-        # Ключевые слова для поиска
-        keywords = {
-            'цен': ('prices', 'Информация о ценах'),
-            'прайс': ('prices', 'Прайс-лист'),
-            'стоим': ('prices', 'Стоимость услуг'),
-            'сколько': ('prices', 'Цены на услуги'),
-            'адрес': ('contacts', 'Контакты'),
-            'где': ('contacts', 'Как нас найти'),
-            'находит': ('contacts', 'Адрес мастерской'),
-            'метро': ('contacts', 'Как добраться'),
-            'телефон': ('contacts', 'Контакты'),
-            'whatsapp': ('contacts', 'Контакты'),
-            'график': ('schedule', 'График работы'),
-            'работает': ('schedule', 'Режим работы'),
-            'время': ('schedule', 'Часы работы'),
-            'выходн': ('schedule', 'График работы'),
-            'срок': ('timing', 'Сроки выполнения'),
-            'долго': ('timing', 'Время выполнения'),
-            'быстро': ('timing', 'Сроки'),
-            'срочн': ('urgent', 'Срочные услуги'),
-            'оплат': ('payment', 'Способы оплаты'),
-            'картой': ('payment', 'Оплата'),
-            'наличн': ('payment', 'Оплата'),
-            'гарант': ('warranty', 'Гарантия'),
-            'услуг': ('services', 'Наши услуги'),
-            'ремонт': ('services', 'Услуги ремонта'),
-            'подгонк': ('services', 'Подгонка одежды'),
-            'укорот': ('services', 'Подгонка одежды'),
-            'штопк': ('services', 'Художественная штопка'),
-        }
+        if matched_category not in ('prices', 'services'):
+            answer = self.category_answer(matched_category)
+            if answer:
+                return answer
         
-        matched_category = None
-        for keyword, (category, description) in keywords.items():
-            if keyword in query_lower:
-                matched_category = category
-                break
+        # Конкретный ответ FAQ или строка прайса лучше общей справки
+        answer = self.search_answer(query)
+        if answer:
+            return answer
         
-        if matched_category == 'prices':
-            return self._get_prices_fallback()
-        elif matched_category == 'contacts':
+        return self.category_answer(matched_category)
+    
+    def category_answer(self, category: str):
+        """Готовая справка по теме (контакты, график, оплата, цены...)"""
+        if category == 'contacts':
             return self._get_contacts_fallback()
-        elif matched_category == 'schedule':
+        elif category == 'schedule':
             return self._get_schedule_fallback()
-        elif matched_category in ('timing', 'urgent'):
+        elif category in ('timing', 'urgent'):
             return self._get_timing_fallback()
-        elif matched_category == 'payment':
+        elif category == 'payment':
             return self._get_payment_fallback()
-        elif matched_category == 'warranty':
+        elif category == 'warranty':
             return self._get_warranty_fallback()
-        elif matched_category == 'services':
+        elif category == 'prices':
+            return self._get_prices_fallback()
+        elif category == 'services':
             return self._get_services_fallback()
-        
-        # Поиск в FAQ
-        faq_answer = self._search_faq(query_lower)
-        if faq_answer:
-            return faq_answer
-        
         return None
     
+    def search_answer(self, query: str):
+        """Лучший ответ FAQ или найденные строки прайса"""
+        results = self.search(query)
+        if not results:
+            return None
+        kind, title, text, _ = results[0]
+        if kind == 'faq':
+            return text
+        lines = [f"• {_PRICE_TAB.sub(' — ', line.strip())}"
+                 for k, _, line, _ in results if k == 'price']
+        return "💰 Нашлось в прайсе:\n\n" + "\n".join(lines)
+    
     def _search_faq(self, query: str) -> str:
-        """Поиск в FAQ по ключевым словам"""
-        faq = self.faq.get('parsed', {})
-        for question, answer in faq.items():
-            if any(word in question.lower() for word in query.split() if len(word) > 3):
-                return answer
+        """Лучший ответ FAQ на вопрос"""
+        for kind, _, text, _ in self.search(query):
+            if kind == 'faq':
+                return text
         return None
     
     def _get_prices_fallback(self) -> str:
@@ -331,5 +495,88 @@ class KnowledgeLoader:
         )
 
 
+def benchmark(entries: int = 10000, queries: int = 1000) -> dict:
+    """Сравнить перебор FAQ и поиск по индексу на синтетической базе.
+
+    Половина запросов — перефразированные вопросы из базы (проверяется,
+    что найден вопрос про ту же работу и вещь), половина — вопросы, на
+    которые в базе ответа нет.
+    """
+    import random
+    import time
+
+    rng = random.Random(42)
+    garments = ['брюки', 'джинсы', 'юбку', 'платье', 'куртку', 'пальто',
+                'пуховик', 'шубу', 'пиджак', 'рубашку', 'шторы', 'сумку']
+    works = ['подшить', 'укоротить', 'ушить', 'расшить', 'заменить молнию',
+             'заменить подкладку', 'зашить дырку', 'пришить пуговицы',
+             'поставить заплатку', 'почистить', 'удлинить рукава']
+    extras = ['срочно', 'из кожи', 'с манжетами', 'на тесьме', 'детские',
+              'зимние', 'с подкладкой', 'из шерсти', 'льняные', 'вечерние']
+    misses = ['есть ли парковка у торгового центра', 'принимаете ли обувь',
+              'продаёте ли подарочные сертификаты', 'можно с собакой']
+
+    faq = {}
+    topics = {}
+    while len(faq) < entries:
+        topic = (rng.choice(works), rng.choice(garments), rng.choice(extras))
+        question = f"Можно ли {' '.join(topic)}? (вариант {len(faq)})"
+        faq[question] = (f"Да, стоимость от {rng.randrange(200, 5000, 50)} руб. "
+                         f"(вариант {len(faq)})")
+        topics[faq[question]] = topic
+    faq_md = ''.join(f"**{q}**\n{a}\n\n" for q, a in faq.items())
+
+    loader = KnowledgeLoader.__new__(KnowledgeLoader)
+    started = time.perf_counter()
+    loader._snapshot = loader._build_snapshot({FAQ_FILE: faq_md}, 1, None)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    samples = []
+    for i in range(queries):
+        if i % 2:
+            samples.append((rng.choice(misses), None))
+        else:
+            topic = topics[rng.choice(list(faq.values()))]
+            samples.append((f"сколько будет стоить {topic[2]} {topic[0]} "
+                            f"{topic[1]}", topic))
+
+    def linear(query):
+        # Прежний _search_faq: первое частичное совпадение слова
+        for question, answer in faq.items():
+            if any(word in question.lower() for word in query.split() if len(word) > 3):
+                return answer
+        return None
+
+    results = {'entries': entries, 'queries': queries,
+               'index_build_ms': round(build_ms, 1)}
+    for name, func in (('linear', linear), ('index', loader._search_faq)):
+        correct = 0
+        started = time.perf_counter()
+        for query, topic in samples:
+            answer = func(query)
+            if topics.get(answer) == topic:
+                correct += 1
+        elapsed = time.perf_counter() - started
+        results[f'{name}_ms_per_query'] = round(elapsed * 1000 / queries, 3)
+        results[f'{name}_accuracy'] = round(correct / queries, 3)
+    return results
+
+
 # Глобальный экземпляр
 knowledge = KnowledgeLoader()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Поиск по базе знаний")
+    parser.add_argument('--benchmark', type=int, metavar='N',
+                        help="сравнить перебор и индекс на N синтетических вопросах FAQ")
+    parser.add_argument('query', nargs='*', help="вопрос для поиска")
+    args = parser.parse_args()
+    if args.benchmark:
+        for key, value in benchmark(args.benchmark).items():
+            print(f"{key}: {value}")
+    else:
+        for kind, title, text, score in knowledge.search(' '.join(args.query)):
+            print(f"{score:6.2f}  [{kind}] {title}\n        {text[:100]}")
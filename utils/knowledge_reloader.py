@@ -0,0 +1,66 @@
+"""
+Горячая перезагрузка базы знаний.
+
+Фоновый поток раз в KNOWLEDGE_POLL_INTERVAL секунд сравнивает mtime и
+размер файлов data/knowledge_base с последней загрузкой. Если что-то
+изменилось, источник (KnowledgeLoader, KnowledgeBase) разбирает файлы в
+новый снимок и подменяет его целиком, а номер версии растёт — по нему
+сбрасываются кэши ответов и индекс фрагментов для промптов. Править
+файлы можно без перезапуска бота.
+"""
+import logging
+import os
+import threading
+
+from .knowledge_base import kb
+from .knowledge_loader import knowledge
+
+logger = logging.getLogger(__name__)
+
+KNOWLEDGE_POLL_INTERVAL = float(os.getenv('KNOWLEDGE_POLL_INTERVAL', '5'))
+
+
+class KnowledgeReloader:
+    """Поток, опрашивающий файлы базы знаний"""
+
+    def __init__(self, sources: list, interval: float = KNOWLEDGE_POLL_INTERVAL):
+        self.sources = sources
+        self.interval = interval
+        self.reloads = 0
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Запустить опрос (повторный вызов ничего не делает)"""
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='knowledge-reloader',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def check(self) -> bool:
+        """Проверить все источники один раз; True, если что-то перечитано"""
+        changed = False
+        for source in self.sources:
+            try:
+                if source.reload_if_changed():
+                    changed = True
+            except Exception as e:
+                logger.error(f"Knowledge reload check failed: {e}")
+        if changed:
+            self.reloads += 1
+        return changed
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.check()
+
+
+knowledge_reloader = KnowledgeReloader([knowledge, kb])
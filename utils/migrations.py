@@ -0,0 +1,226 @@
+"""
+Версионированные миграции схемы БД.
+
+init_db() создаёт недостающие таблицы через create_all, но не умеет
+менять уже существующие (добавлять индексы, колонки). Для этого здесь
+ведётся упорядоченный список миграций; применённые версии хранятся в
+таблице schema_migrations, так что workshop.db и Postgres обновляются
+на месте при следующем запуске.
+
+Запуск вручную:
+    python -m utils.migrations                  # применить миграции
+    python -m utils.migrations --status         # показать версии
+    python -m utils.migrations --benchmark 100000
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, inspect, text
+
+from .database import Base, SchemaMigration, engine as default_engine
+
+logger = logging.getLogger(__name__)
+
+# (имя индекса, таблица, колонки) — повторяют __table_args__ моделей
+HOT_PATH_INDEXES = [
+    # get_user_orders: WHERE user_id = ? ORDER BY created_at DESC
+    ("ix_orders_user_id_created_at", "orders", "user_id, created_at"),
+    # get_orders_by_status: WHERE status = ? ORDER BY created_at DESC
+    ("ix_orders_status_created_at", "orders", "status, created_at"),
+    # get_all_orders: ORDER BY created_at DESC LIMIT n
+    ("ix_orders_created_at", "orders", "created_at"),
+    # get_orders_pending_feedback
+    ("ix_orders_feedback", "orders",
+     "status, feedback_requested, completed_at"),
+    # load_user_state / get_user_chat_history
+    ("ix_chat_history_user_id_created_at", "chat_history",
+     "user_id, created_at"),
+    # get_spam_logs: ORDER BY created_at DESC
+    ("ix_spam_logs_created_at", "spam_logs", "created_at"),
+    # get_review_stats / get_average_rating
+    ("ix_reviews_is_approved_rating", "reviews", "is_approved, rating"),
+    # get_prices_by_category: WHERE category_id = ? AND is_active
+    ("ix_prices_category_id", "prices", "category_id, is_active, sort_order"),
+]
+
+
+def _create_hot_path_indexes(conn):
+    for name, table, columns in HOT_PATH_INDEXES:
+        conn.execute(
+            text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+
+def _add_users_bot_blocked(conn):
+    columns = {column['name'] for column in inspect(conn).get_columns('users')}
+    if 'bot_blocked' not in columns:
+        conn.execute(
+            text("ALTER TABLE users ADD COLUMN bot_blocked BOOLEAN DEFAULT FALSE"))
+
+
+# Порядок важен: новые миграции добавляются только в конец
+MIGRATIONS = [
+    (1, "Indexes for hot order/chat/review/price queries",
+     _create_hot_path_indexes),
+    (2, "users.bot_blocked for broadcast delivery", _add_users_bot_blocked),
+]
+
+
+def get_applied_versions(engine=None) -> set:
+    """Версии миграций, уже применённых к базе"""
+    engine = engine or default_engine
+    SchemaMigration.__table__.create(bind=engine, checkfirst=True)
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text("SELECT version FROM schema_migrations")).fetchall()
+    return {row[0] for row in rows}
+
+
+def run_migrations(engine=None) -> list:
+    """Применить все непримененные миграции, вернуть список их версий"""
+    engine = engine or default_engine
+    applied = get_applied_versions(engine)
+    done = []
+    for version, description, upgrade in MIGRATIONS:
+        if version in applied:
+            continue
+        # Каждая миграция — отдельная транзакция вместе с записью о версии
+        with engine.begin() as conn:
+            upgrade(conn)
+            conn.execute(SchemaMigration.__table__.insert().values(
+                version=version,
+                description=description,
+                applied_at=datetime.utcnow()))
+        logger.info(f"Applied migration {version}: {description}")
+        done.append(version)
+    return done
+
+
+# ----------------------------
+# Benchmark
+# ----------------------------
+
+BENCHMARK_QUERIES = {
+    "get_user_orders":
+    "SELECT * FROM orders WHERE user_id = :user_id ORDER BY created_at DESC",
+    "get_orders_by_status":
+    "SELECT * FROM orders WHERE status = 'issued' ORDER BY created_at DESC LIMIT 50",
+    "get_all_orders":
+    "SELECT * FROM orders ORDER BY created_at DESC LIMIT 50",
+    "get_orders_pending_feedback":
+    "SELECT * FROM orders WHERE status = 'completed' AND completed_at <= :cutoff "
+    "AND feedback_requested = 0",
+    "load_user_state (history)":
+    "SELECT topic FROM chat_history WHERE user_id = :user_id "
+    "ORDER BY created_at DESC LIMIT 5",
+    "get_spam_logs":
+    "SELECT * FROM spam_logs ORDER BY created_at DESC LIMIT 50",
+}
+
+
+def _fill_benchmark_db(engine, orders: int):
+    now = datetime.utcnow()
+    statuses = ['new', 'in_progress', 'completed', 'issued', 'cancelled']
+    users = max(1, orders // 5)
+    with engine.begin() as conn:
+        conn.execute(
+            text("INSERT INTO orders (user_id, service_type, status, created_at, "
+                 "completed_at, feedback_requested) VALUES "
+                 "(:user_id, 'pants', :status, :created_at, :completed_at, "
+                 ":feedback)"),
+            [{
+                'user_id': i % users,
+                'status': statuses[i % 5] if i % 50 else 'completed',
+                'created_at': now - timedelta(minutes=i),
+                'completed_at': now - timedelta(minutes=i) if i % 5 == 2 else None,
+                # Отзыв уже запрошен у всех, кроме заказов последней недели
+                'feedback': i > 10000
+            } for i in range(orders)])
+        conn.execute(
+            text("INSERT INTO chat_history (user_id, message, topic, created_at) "
+                 "VALUES (:user_id, 'q', 'price', :created_at)"),
+            [{
+                'user_id': i % users,
+                'created_at': now - timedelta(minutes=i)
+            } for i in range(orders)])
+        conn.execute(
+            text("INSERT INTO spam_logs (user_id, message, reason, created_at) "
+                 "VALUES (:user_id, 'spam', 'test', :created_at)"),
+            [{
+                'user_id': i,
+                'created_at': now - timedelta(minutes=i)
+            } for i in range(orders // 10)])
+
+
+def _time_queries(engine, repeat: int) -> dict:
+    params = {
+        'user_id': 42,
+        'cutoff': datetime.utcnow() - timedelta(days=3)
+    }
+    results = {}
+    with engine.connect() as conn:
+        for name, sql in BENCHMARK_QUERIES.items():
+            statement = text(sql)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                conn.execute(statement, params).fetchall()
+            results[name] = (time.perf_counter() - start) / repeat * 1000
+    return results
+
+
+def benchmark(orders: int = 100000, repeat: int = 20) -> dict:
+    """Сравнить время горячих запросов до и после миграции индексов"""
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    bench_engine = create_engine(f"sqlite:///{path}")
+    try:
+        Base.metadata.create_all(bind=bench_engine)
+        with bench_engine.begin() as conn:
+            for name, _, _ in HOT_PATH_INDEXES:
+                conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        _fill_benchmark_db(bench_engine, orders)
+
+        before = _time_queries(bench_engine, repeat)
+        run_migrations(bench_engine)
+        after = _time_queries(bench_engine, repeat)
+    finally:
+        bench_engine.dispose()
+        os.remove(path)
+
+    print(f"{orders} orders, {orders} chat rows, avg of {repeat} runs (ms)")
+    print(f"{'query':32} {'no index':>10} {'indexed':>10}")
+    for name in BENCHMARK_QUERIES:
+        print(f"{name:32} {before[name]:10.3f} {after[name]:10.3f}")
+    return {'before': before, 'after': after}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Миграции схемы БД")
+    parser.add_argument('--status',
+                        action='store_true',
+                        help="показать применённые версии")
+    parser.add_argument('--benchmark',
+                        type=int,
+                        metavar='ORDERS',
+                        help="замерить запросы на временной SQLite базе")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.benchmark:
+        benchmark(args.benchmark)
+    elif args.status:
+        applied = get_applied_versions()
+        for version, description, _ in MIGRATIONS:
+            mark = 'x' if version in applied else ' '
+            print(f"[{mark}] {version}: {description}")
+    else:
+        Base.metadata.create_all(bind=default_engine)
+        done = run_migrations()
+        print(f"Applied: {done}" if done else "Schema is up to date")
+
+
+if __name__ == '__main__':
+    main()
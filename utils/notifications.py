@@ -0,0 +1,160 @@
+"""
+Фоновая отправка уведомлений из outbox (таблица notifications).
+
+Веб-админка не ходит в Bot API внутри HTTP-запроса: она только кладёт
+сообщение в очередь (enqueue), а отдельный поток забирает готовые записи
+и отправляет их через общий requests.Session с пулом соединений.
+Ошибки сети и 5xx повторяются с экспоненциальной задержкой, на 429
+выдерживается retry_after из ответа Telegram.
+"""
+import logging
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import database
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_BATCH_SIZE = 20
+NOTIFY_POLL_INTERVAL = float(os.getenv('NOTIFY_POLL_INTERVAL', '5'))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv('NOTIFY_MAX_ATTEMPTS', '5'))
+NOTIFY_BACKOFF_BASE = 5  # секунд, удваивается с каждой попыткой
+NOTIFY_BACKOFF_MAX = 600
+NOTIFY_HTTP_TIMEOUT = 10
+
+
+class NotificationDispatcher:
+    """Поток, отправляющий сообщения из outbox в Telegram"""
+
+    def __init__(self, token: str = None):
+        self.token = token
+        self._session = None
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self.stats = {'sent': 0, 'retried': 0, 'failed': 0, 'rate_limited': 0}
+
+    # ----- public API -----
+
+    def start(self):
+        """Запустить поток отправки (повторный вызов ничего не делает)"""
+        if not self.token:
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run,
+                                            name='notification-dispatcher',
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def enqueue(self, chat_id: int, text: str, parse_mode: str = 'HTML') -> int:
+        """Поставить сообщение в очередь и разбудить поток"""
+        notification_id = database.enqueue_notification(chat_id, text, parse_mode)
+        self.start()
+        self._wakeup.set()
+        return notification_id
+
+    def status(self) -> dict:
+        """Счётчики outbox и состояние потока для API админки"""
+        result = database.get_notification_stats()
+        result['dispatcher'] = {
+            'enabled': bool(self.token),
+            'running': bool(self._thread and self._thread.is_alive()),
+            **self.stats
+        }
+        return result
+
+    # ----- internals -----
+
+    def _http(self) -> requests.Session:
+        if self._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+            session.mount('https://', adapter)
+            self._session = session
+        return self._session
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                batch = database.claim_due_notifications(NOTIFY_BATCH_SIZE)
+            except Exception as e:
+                logger.error(f"Notification outbox read failed: {e}")
+                batch = []
+
+            for notification in batch:
+                if self._stopped.is_set():
+                    break
+                self._deliver(notification)
+
+            # Полная пачка — возможно, в очереди есть ещё, не ждём
+            if len(batch) < NOTIFY_BATCH_SIZE:
+                self._wakeup.wait(NOTIFY_POLL_INTERVAL)
+                self._wakeup.clear()
+
+    def _deliver(self, notification):
+        retry_in, error = self._send(notification)
+        try:
+            if error is None:
+                database.mark_notification_sent(notification.id)
+                self.stats['sent'] += 1
+                return
+
+            if retry_in is not None and notification.attempts < NOTIFY_MAX_ATTEMPTS:
+                self.stats['retried'] += 1
+                logger.warning(f"Notification {notification.id} to {notification.chat_id} "
+                               f"failed ({error}), retry in {retry_in:.0f}s")
+            else:
+                retry_in = None
+                self.stats['failed'] += 1
+                logger.error(f"Notification {notification.id} to {notification.chat_id} "
+                             f"failed permanently: {error}")
+            database.mark_notification_failed(notification.id, error, retry_in)
+        except Exception as e:
+            # Аренда истечёт, и сообщение будет отправлено повторно
+            logger.error(f"Failed to update notification {notification.id}: {e}")
+
+    def _send(self, notification):
+        """Отправить одно сообщение: (через сколько повторить, ошибка)"""
+        backoff = min(NOTIFY_BACKOFF_BASE * 2**(notification.attempts - 1),
+                      NOTIFY_BACKOFF_MAX)
+        try:
+            response = self._http().post(
+                f"https://api.telegram.org/bot{self.token}/sendMessage",
+                json={
+                    'chat_id': notification.chat_id,
+                    'text': notification.text,
+                    'parse_mode': notification.parse_mode
+                },
+                timeout=NOTIFY_HTTP_TIMEOUT)
+        except requests.RequestException as e:
+            return backoff, str(e)
+
+        if response.status_code == 200:
+            logger.info(f"Notification sent to user {notification.chat_id}")
+            return None, None
+
+        error = f"{response.status_code}: {response.text[:200]}"
+        if response.status_code == 429:
+            self.stats['rate_limited'] += 1
+            try:
+                retry_after = response.json()['parameters']['retry_after']
+            except (ValueError, KeyError, TypeError):
+                retry_after = backoff
+            return float(retry_after), error
+        if response.status_code >= 500:
+            return backoff, error
+        # 400/403: чат не найден, бот заблокирован — повтор не поможет
+        return None, error
@@ -122,6 +122,20 @@ def format_prices_text(slug: str) -> str:
     return text
 
 
+def get_price_list() -> list:
+    """Весь активный прайс одним запросом: [(категория, услуга, цена), ...]"""
+    session = get_session()
+    try:
+        return [tuple(row) for row in session.query(
+            Category.name, Price.name, Price.price
+        ).join(Category, Category.id == Price.category_id).filter(
+            Category.is_active == True,
+            Price.is_active == True
+        ).order_by(Category.sort_order, Price.sort_order).all()]
+    finally:
+        session.close()
+
+
 def delete_category(slug: str) -> bool:
     """Удалить категорию (деактивировать)"""
     session = get_session()
@@ -0,0 +1,194 @@
+"""
+Выбор фрагментов базы знаний для промпта GigaChat.
+
+Раньше в каждый промпт уходили первые 2500 символов всей базы знаний:
+большая часть прайса до модели не доходила, а токены тратились на
+нерелевантный текст. Теперь файлы data/knowledge_base и таблица prices
+режутся на фрагменты (ответ FAQ, абзац, категория прайса), фрагменты
+индексируются BM25 при запуске бота, и на вопрос в промпт попадают
+только лучшие RETRIEVAL_TOP_K фрагментов в пределах RETRIEVAL_TOKEN_BUDGET.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from .async_database import run_in_db_executor
+from .knowledge_loader import PRICES_FILE, knowledge
+from .prices import get_price_list
+from .text_index import BM25Index
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', '4'))
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv('RETRIEVAL_TOKEN_BUDGET', '600'))
+# Как часто перечитывать прайс из БД (его меняют из другого процесса)
+RETRIEVAL_REFRESH_INTERVAL = int(os.getenv('RETRIEVAL_REFRESH_INTERVAL', '600'))
+CHUNK_CHARS = 700
+HEADING_CHARS = 60
+
+_SEPARATOR = re.compile(r'\n\s*(?:-{3,}\s*)?\n')
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов: ~3 символа русского текста на токен"""
+    return len(text) // 3 + 1
+
+
+@dataclass(frozen=True)
+class Chunk:
+    source: str
+    text: str
+
+    def render(self) -> str:
+        return f"[{self.source}]\n{self.text}"
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.render())
+
+
+def _is_heading(paragraph: str) -> bool:
+    return ('\n' not in paragraph and len(paragraph) <= HEADING_CHARS
+            and (paragraph.startswith('#') or paragraph.isupper()))
+
+
+def split_document(source: str, content: str) -> list:
+    """Разбить текст на фрагменты по абзацам, помня текущий заголовок"""
+    chunks = []
+    section = None
+    for paragraph in _SEPARATOR.split(content):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if _is_heading(paragraph):
+            section = paragraph.lstrip('#').strip()
+            continue
+        title = f"{source} / {section}" if section else source
+        # Длинный абзац режем по строкам
+        block = []
+        for line in paragraph.split('\n'):
+            if block and sum(len(l) for l in block) + len(line) > CHUNK_CHARS:
+                chunks.append(Chunk(title, '\n'.join(block)))
+                block = []
+            block.append(line)
+        chunks.append(Chunk(title, '\n'.join(block)))
+    return chunks
+
+
+def _price_chunks(source: str, categories: dict) -> list:
+    """Одна категория прайса — один фрагмент"""
+    return [Chunk(f"{source} / {category}", '\n'.join(lines))
+            for category, lines in categories.items() if lines]
+
+
+def load_chunks(snapshot, price_rows: list = ()) -> list:
+    """Фрагменты файлов из снимка базы знаний и прайса из БД"""
+    chunks = []
+    for filename in sorted(snapshot.files):
+        source = os.path.splitext(filename)[0]
+        if filename == PRICES_FILE:
+            chunks.extend(_price_chunks(source, snapshot.prices_by_category))
+        else:
+            chunks.extend(split_document(source, snapshot.files[filename]))
+
+    by_category = OrderedDict()
+    for category, name, price in price_rows:
+        by_category.setdefault(category, []).append(f"{name} — {price}")
+    chunks.extend(_price_chunks("Прайс", by_category))
+    return chunks
+
+
+class KnowledgeRetriever:
+    """BM25-индекс фрагментов базы знаний"""
+
+    def __init__(self,
+                 top_k: int = RETRIEVAL_TOP_K,
+                 token_budget: int = RETRIEVAL_TOKEN_BUDGET):
+        self.top_k = top_k
+        self.token_budget = token_budget
+        # (фрагменты, индекс) меняются вместе одним присваиванием
+        self._state = ((), BM25Index())
+        # Растёт, когда меняется содержимое индекса; входит в ключи кэша
+        self.version = 0
+        self._knowledge_version = None
+        self._price_rows = []
+        self._prices_loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def build(self, price_rows: list = None) -> None:
+        """Переиндексировать файлы и прайс (синхронно)"""
+        if price_rows is not None:
+            self._price_rows = price_rows
+        snapshot = knowledge.snapshot
+        chunks = tuple(load_chunks(snapshot, self._price_rows))
+        self._knowledge_version = snapshot.version
+        if chunks == self.chunks:
+            return
+        index = BM25Index()
+        for chunk in chunks:
+            index.add(f"{chunk.source}\n{chunk.text}")
+        index.prepare()
+        self._state = (chunks, index)
+        self.version += 1
+        logger.info(f"Knowledge index v{self.version}: {len(chunks)} chunks, "
+                    f"~{sum(c.tokens for c in chunks)} tokens")
+
+    @property
+    def chunks(self) -> tuple:
+        return self._state[0]
+
+    def _prices_stale(self) -> bool:
+        return (time.monotonic() - self._prices_loaded_at
+                > RETRIEVAL_REFRESH_INTERVAL)
+
+    async def refresh(self, force: bool = False) -> None:
+        """Перечитать прайс из БД и переиндексировать, если пора"""
+        if not (force or self._prices_stale() or
+                self._knowledge_version != knowledge.version):
+            return
+        async with self._lock:
+            price_rows = None
+            if force or self._prices_stale():
+                try:
+                    price_rows = await run_in_db_executor(get_price_list)
+                except Exception as e:
+                    logger.error(f"Failed to load prices for retrieval: {e}")
+                # При ошибке БД не повторяем запрос на каждом вопросе
+                self._prices_loaded_at = time.monotonic()
+            elif self._knowledge_version == knowledge.version:
+                return
+            try:
+                self.build(price_rows)
+            except Exception as e:
+                # Остаётся прежний индекс (при первом построении — пустой);
+                # до следующего изменения базы знаний не перестраиваем
+                logger.error(f"Failed to build knowledge index: {e}")
+                self._knowledge_version = knowledge.version
+
+    def retrieve(self, question: str) -> list:
+        """Лучшие фрагменты для вопроса в пределах бюджета токенов"""
+        chunks, index = self._state
+        selected = []
+        budget = self.token_budget
+        for doc_id, _ in index.search(question, self.top_k):
+            chunk = chunks[doc_id]
+            if chunk.tokens > budget:
+                continue
+            selected.append(chunk)
+            budget -= chunk.tokens
+        return selected
+
+    def context_for(self, question: str) -> str:
+        """Текст базы знаний для системного промпта"""
+        return '\n\n'.join(chunk.render() for chunk in self.retrieve(question))
+
+    def documents(self) -> list:
+        """Тексты фрагментов (корпус для IDF семантического кэша)"""
+        return [chunk.text for chunk in self.chunks]
+
+
+retriever = KnowledgeRetriever()
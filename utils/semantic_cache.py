@@ -0,0 +1,191 @@
+"""
+Семантический кэш ответов AI.
+
+Точный кэш (utils/cache.py) не узнаёт перефразированный вопрос. Здесь
+вопросы превращаются в векторы хешированных символьных n-грамм и
+основ слов (stem из text_index) с весами TF-IDF, векторы лежат в одной матрице NumPy, и
+ответ берётся из кэша, если косинусная близость к сохранённому вопросу
+выше порога. Поиск — одно умножение матрицы на вектор.
+
+IDF считается по текстам базы знаний; при смене версии базы знаний
+кэш очищается и IDF пересчитывается.
+"""
+import logging
+import math
+import os
+import re
+import time
+import zlib
+from collections import Counter
+
+import numpy as np
+
+from .cache import normalize_text
+from .text_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.85'))
+SEMANTIC_CACHE_SIZE = int(os.getenv('SEMANTIC_CACHE_SIZE', '500'))
+SEMANTIC_CACHE_TTL = int(os.getenv('SEMANTIC_CACHE_TTL', '86400'))
+SEMANTIC_CACHE_DIM = 2048
+
+_NUMBERS = re.compile(r'\d+')
+
+# Частые формулировки одного и того же намерения приводятся к одному слову
+SYNONYMS = [
+    (re.compile(r'\b(сколько стоит|сколько стоят|стоимость|почем|по чем|прайс)\b'), 'цена'),
+    (re.compile(r'\b(где вы находитесь|где находитесь|как вас найти|как добраться)\b'), 'адрес'),
+    (re.compile(r'\b(режим работы|часы работы|во сколько открываетесь)\b'), 'график'),
+]
+
+
+def _features(text: str) -> Counter:
+    """Символьные 3-граммы и сами основы слов без стоп-слов.
+
+    Основы, а не слова целиком: "подшить", "подшива" и "подшивка" дают
+    одни и те же признаки "подши".
+    """
+    features = Counter()
+    text = normalize_text(text)
+    for pattern, replacement in SYNONYMS:
+        text = pattern.sub(replacement, text)
+    for word in tokenize(text):
+        padded = f' {word} '
+        for i in range(len(padded) - 2):
+            features[padded[i:i + 3]] += 1
+        if len(word) > 2:
+            features['#' + word] += 1
+    return features
+
+
+def _bucket(feature: str) -> int:
+    # crc32 стабилен между запусками, в отличие от hash()
+    return zlib.crc32(feature.encode()) % SEMANTIC_CACHE_DIM
+
+
+class SemanticCache:
+    """Кэш «вопрос → ответ» с поиском по косинусной близости"""
+
+    def __init__(self,
+                 threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 max_entries: int = SEMANTIC_CACHE_SIZE,
+                 ttl: int = SEMANTIC_CACHE_TTL):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.idf = np.ones(SEMANTIC_CACHE_DIM, dtype=np.float32)
+        self.knowledge_version = None
+        # Строки матрицы нормированы, поэтому скалярное произведение = cos
+        self.vectors = np.zeros((max_entries, SEMANTIC_CACHE_DIM),
+                                dtype=np.float32)
+        self.variants = np.zeros(max_entries, dtype=np.int64)
+        self.created = np.zeros(max_entries, dtype=np.float64)
+        self.last_used = np.zeros(max_entries, dtype=np.float64)
+        self.uses = np.zeros(max_entries, dtype=np.int64)
+        self.answers = [None] * max_entries
+        self.numbers = [None] * max_entries
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # ----- IDF и векторы -----
+
+    def fit(self, documents: list) -> None:
+        """Посчитать IDF по корпусу (вопросы и ответы базы знаний)"""
+        df = np.zeros(SEMANTIC_CACHE_DIM, dtype=np.float32)
+        for doc in documents:
+            for bucket in {_bucket(f) for f in _features(doc)}:
+                df[bucket] += 1
+        n = len(documents)
+        self.idf = np.log((1 + n) / (1 + df)).astype(np.float32) + 1
+
+    def vectorize(self, text: str) -> np.ndarray:
+        vector = np.zeros(SEMANTIC_CACHE_DIM, dtype=np.float32)
+        for feature, count in _features(text).items():
+            vector[_bucket(feature)] += 1 + math.log(count)
+        vector *= self.idf
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def _variant_id(variant: tuple) -> int:
+        return zlib.crc32('\x1f'.join(str(v) for v in variant).encode())
+
+    # ----- кэш -----
+
+    def sync_knowledge(self, version, documents_loader) -> None:
+        """Сбросить кэш, если база знаний изменилась"""
+        if version == self.knowledge_version:
+            return
+        self.clear()
+        self.fit(documents_loader())
+        self.knowledge_version = version
+        logger.info(f"Semantic cache reset for knowledge version {version}")
+
+    def get(self, text: str, variant: tuple = ()):
+        """Ответ на достаточно близкий вопрос или None"""
+        if not self.size:
+            self.misses += 1
+            return None
+        now = time.time()
+        vector = self.vectorize(text)
+        scores = self.vectors[:self.size] @ vector
+        # Чужой вариант промпта и устаревшие записи не подходят
+        valid = ((self.variants[:self.size] == self._variant_id(variant)) &
+                 (self.created[:self.size] > now - self.ttl))
+        scores = np.where(valid, scores, -1.0)
+        best = int(np.argmax(scores))
+        # Числа (размеры, номера заказов) должны совпадать дословно
+        if (scores[best] < self.threshold or
+                self.numbers[best] != _NUMBERS.findall(text)):
+            self.misses += 1
+            return None
+        self.uses[best] += 1
+        self.last_used[best] = now
+        self.hits += 1
+        return self.answers[best]
+
+    def add(self, text: str, answer: str, variant: tuple = ()) -> None:
+        now = time.time()
+        if self.size < self.max_entries:
+            slot = self.size
+            self.size += 1
+        else:
+            slot = self._victim(now)
+            self.evictions += 1
+        self.vectors[slot] = self.vectorize(text)
+        self.variants[slot] = self._variant_id(variant)
+        self.created[slot] = now
+        self.last_used[slot] = now
+        self.uses[slot] = 0
+        self.answers[slot] = answer
+        self.numbers[slot] = _NUMBERS.findall(text)
+
+    def _victim(self, now: float) -> int:
+        """Слот для вытеснения: устаревший, иначе редко и давно нужный"""
+        expired = np.flatnonzero(self.created < now - self.ttl)
+        if expired.size:
+            return int(expired[0])
+        idle_hours = (now - self.last_used) / 3600
+        return int(np.argmin((self.uses + 1) / (1 + idle_hours)))
+
+    def clear(self) -> None:
+        self.size = 0
+        self.answers = [None] * self.max_entries
+        self.numbers = [None] * self.max_entries
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'knowledge_version': self.knowledge_version
+        }
+
+
+semantic_cache = SemanticCache()
@@ -0,0 +1,101 @@
+"""
+Полнотекстовый поиск по небольшим русским текстам.
+
+Слова нормализуются грубым стеммингом (отрезаем типичное окончание и
+берём префикс), поэтому «брюки», «брюк» и «брюками» дают один термин.
+BM25Index — инвертированный индекс «термин → документы» с ранжированием
+BM25: на запрос просматриваются только документы, где встречаются его
+термины, а не вся коллекция.
+"""
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+from operator import itemgetter
+
+from .cache import normalize_text
+
+STEM_LENGTH = 5
+
+# Окончания от длинных к коротким: отрезается первое подходящее
+_ENDINGS = re.compile(
+    r'(ями|ами|ого|его|ому|ему|ыми|ими|ться|тся|ешь|ете|ишь|ите'
+    r'|ая|яя|ое|ее|ые|ие|ый|ий|ой|ей|ую|юю|ом|ем|ам|ям|ах|ях|ов|ев'
+    r'|ть|ся|ия|ию|ии|ью|а|я|о|е|ы|и|у|ю|ь|й)$')
+
+STOP_WORDS = frozenset("""
+а без бы в вам вас ваш ваша ваше ваши во вот вы где да для до его ее если
+есть же за и из или им их к как ко когда кто ли мне мой мы на над не нет
+ни но ну о об от по под при про с со так там то тоже у уже хочу чем что
+чтобы это эта этот я можно надо нужно
+""".split())
+
+
+def stem(word: str) -> str:
+    """Грубая русская нормализация: без окончания, не длиннее STEM_LENGTH"""
+    if len(word) > 3:
+        stripped = _ENDINGS.sub('', word)
+        if len(stripped) >= 3:
+            word = stripped
+    return word[:STEM_LENGTH]
+
+
+def tokenize(text: str) -> list:
+    """Термины текста: нормализованные слова без стоп-слов"""
+    return [stem(word) for word in normalize_text(text).split()
+            if word not in STOP_WORDS]
+
+
+class BM25Index:
+    """Инвертированный индекс с ранжированием BM25"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        # термин -> [(номер документа, частота), ...]
+        self.postings = defaultdict(list)
+        self.doc_lengths = []
+        self.idf = {}
+        # Знаменатель BM25 без tf для каждого документа
+        self._norms = []
+
+    def add(self, text: str) -> int:
+        """Добавить документ, вернуть его номер"""
+        doc_id = len(self.doc_lengths)
+        terms = Counter(tokenize(text))
+        for term, tf in terms.items():
+            self.postings[term].append((doc_id, tf))
+        self.doc_lengths.append(sum(terms.values()))
+        self.idf.clear()
+        return doc_id
+
+    def prepare(self) -> None:
+        """Посчитать IDF и нормы; без вызова это сделает первый поиск"""
+        n = len(self.doc_lengths)
+        avg_length = (sum(self.doc_lengths) / n if n else 0.0) or 1.0
+        self._norms = [self.k1 * (1 - self.b + self.b * length / avg_length)
+                       for length in self.doc_lengths]
+        self.idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def search(self, query: str, limit: int = 5) -> list:
+        """[(номер документа, оценка), ...] по убыванию оценки"""
+        if not self.doc_lengths:
+            return []
+        if not self.idf:
+            self.prepare()
+        scores = defaultdict(float)
+        norms = self._norms
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            weight = idf * (self.k1 + 1)
+            for doc_id, tf in self.postings[term]:
+                scores[doc_id] += weight * tf / (tf + norms[doc_id])
+        return heapq.nlargest(limit, scores.items(), key=itemgetter(1))
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
@@ -5,6 +5,7 @@ Secure Flask admin application
 - Improved requires_auth decorator: returns JSON 401 for API requests
 - Centralized order filtering function (DRY)
 - CSV export with UTF-8 BOM for Excel
+- Telegram notifications go through a persistent outbox and a background dispatcher
 - Session cookie security flags
 
 Requirements (install in your venv):
@@ -22,18 +23,17 @@ Configure environment variables (recommended):
 Note: templates and utils.database module should exist (same API as in your original code).
 """
 
-from flask import Flask, render_template, jsonify, request, redirect, url_for, session, Response, make_response, current_app
+from flask import Flask, render_template, jsonify, request, redirect, url_for, session, Response, current_app
 from functools import wraps
 import sys
 import os
 import secrets
 import html
 import logging
-import requests
 from dotenv import load_dotenv
 import io
 import csv
-from datetime import datetime, timedelta
+from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_wtf import CSRFProtect
 
@@ -71,8 +71,11 @@ try:
         get_all_orders, get_all_users, get_spam_logs,
         get_statistics, update_order_status, get_orders_by_status,
         get_all_reviews, get_review_stats, moderate_review, get_average_rating,
-        get_order, delete_order, delete_orders_bulk
+        get_order, delete_order, delete_orders_bulk,
+        get_orders_page, count_orders_by_status, get_order_years, iter_orders,
+        get_active_mutes, lift_mute
     )
+    from utils.notifications import NotificationDispatcher
 except Exception as e:
     logger.critical(f"Failed to import database module: {e}")
     raise
@@ -147,6 +150,10 @@ if os.getenv('FORCE_SECURE_COOKIES') == '1' or os.getenv('FLASK_ENV') == 'produc
 # CSRF protection for forms (API routes will be exempted individually)
 csrf = CSRFProtect(app)
 
+# Telegram notifications are sent from a background thread via the outbox table
+notification_dispatcher = NotificationDispatcher(BOT_TOKEN)
+notification_dispatcher.start()
+
 logger.info(f"ADMIN_USERNAME loaded: '{ADMIN_USERNAME}'")
 logger.info("Application initialized.")
 
@@ -181,26 +188,15 @@ SERVICE_NAMES = {
 # Helpers
 # ----------------------------
 def send_telegram_notification(user_id: int, message: str) -> bool:
-    """Send Telegram notification; returns True on success"""
+    """Queue Telegram notification for the background dispatcher; returns True if queued"""
     if not BOT_TOKEN:
         logger.debug("BOT_TOKEN not configured; skipping Telegram notification")
         return False
     try:
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-        data = {
-            "chat_id": user_id,
-            "text": message,
-            "parse_mode": "HTML"
-        }
-        response = requests.post(url, json=data, timeout=10)
-        if response.status_code == 200:
-            logger.info(f"Notification sent to user {user_id}")
-            return True
-        else:
-            logger.warning(f"Telegram API returned {response.status_code}: {response.text}")
-            return False
+        notification_dispatcher.enqueue(user_id, message)
+        return True
     except Exception as e:
-        logger.error(f"Error sending Telegram notification: {e}")
+        logger.error(f"Error queueing Telegram notification: {e}")
         return False
 
 
@@ -243,60 +239,6 @@ def requires_auth(f):
         return f(*args, **kwargs)
     return decorated
 
-# ----------------------------
-# Centralized order filtering
-# ----------------------------
-
-def filter_orders(orders, *, user_id=None, date_from=None, date_to=None, period=None, month=None, year=None):
-    """Filter orders list based on provided parameters. Assumes orders have .created_at (datetime) and .user_id, .status."""
-    result = list(orders)
-    now = datetime.now()
-
-    if user_id is not None:
-        try:
-            uid = int(user_id)
-            result = [o for o in result if getattr(o, 'user_id', None) == uid]
-        except (ValueError, TypeError):
-            pass
-
-    if date_from and date_to:
-        try:
-            start = datetime.strptime(date_from, '%Y-%m-%d')
-            end = datetime.strptime(date_to, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
-            result = [o for o in result if getattr(o, 'created_at', None) and start <= o.created_at <= end]
-        except ValueError:
-            pass
-    elif period:
-        if period == 'today':
-            start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            result = [o for o in result if getattr(o, 'created_at', None) and o.created_at >= start_date]
-        elif period == 'yesterday':
-            start_date = (now - timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
-            end_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            result = [o for o in result if getattr(o, 'created_at', None) and start_date <= o.created_at < end_date]
-        elif period == 'week':
-            start_date = now - timedelta(days=7)
-            result = [o for o in result if getattr(o, 'created_at', None) and o.created_at >= start_date]
-        elif period == 'month':
-            start_date = now - timedelta(days=30)
-            result = [o for o in result if getattr(o, 'created_at', None) and o.created_at >= start_date]
-
-    if month and year:
-        try:
-            m = int(month)
-            y = int(year)
-            result = [o for o in result if getattr(o, 'created_at', None) and o.created_at.month == m and o.created_at.year == y]
-        except ValueError:
-            pass
-    elif year:
-        try:
-            y = int(year)
-            result = [o for o in result if getattr(o, 'created_at', None) and o.created_at.year == y]
-        except ValueError:
-            pass
-
-    return result
-
 # ----------------------------
 # Routes
 # ----------------------------
@@ -378,33 +320,30 @@ def orders():
     month_filter = request.args.get('month', None)
     year_filter = request.args.get('year', None)
 
-    all_orders = get_all_orders(limit=1000)
-
-    filtered = filter_orders(all_orders,
-                             user_id=user_id_filter,
-                             date_from=date_from,
-                             date_to=date_to,
-                             period=period,
-                             month=month_filter,
-                             year=year_filter)
-
-    counts = {
-        'all': len(filtered),
-        'new': len([o for o in filtered if getattr(o, 'status', 'none') == 'new']),
-        'in_progress': len([o for o in filtered if getattr(o, 'status', 'none') == 'in_progress']),
-        'completed': len([o for o in filtered if getattr(o, 'status', 'none') == 'completed']),
-        'issued': len([o for o in filtered if getattr(o, 'status', 'none') == 'issued']),
-        'cancelled': len([o for o in filtered if getattr(o, 'status', 'none') == 'cancelled']),
-    }
-
-    if status:
-        orders_list = [o for o in filtered if getattr(o, 'status', 'none') == status]
-    else:
-        orders_list = filtered
-
-    orders_list = sorted(orders_list, key=lambda x: getattr(x, 'created_at', datetime.min) or datetime.min, reverse=True)
-
-    years_available = sorted({o.created_at.year for o in get_all_orders(limit=1000) if getattr(o, 'created_at', None)}, reverse=True)
+    cursor = request.args.get('cursor', None)
+
+    filters = dict(user_id=user_id_filter,
+                   date_from=date_from,
+                   date_to=date_to,
+                   period=period,
+                   month=month_filter,
+                   year=year_filter)
+
+    counts = count_orders_by_status(**filters)
+    orders_list, next_cursor = get_orders_page(status=status, cursor=cursor, **filters)
+
+    next_url = None
+    if next_cursor:
+        args = request.args.to_dict()
+        args['cursor'] = next_cursor
+        next_url = url_for('orders', **args)
+    first_url = None
+    if cursor:
+        args = request.args.to_dict()
+        args.pop('cursor', None)
+        first_url = url_for('orders', **args)
+
+    years_available = get_order_years()
     if not years_available:
         years_available = [datetime.now().year]
 
@@ -418,7 +357,9 @@ def orders():
                           date_to=date_to,
                           month_filter=month_filter,
                           year_filter=year_filter,
-                          years_available=years_available)
+                          years_available=years_available,
+                          next_url=next_url,
+                          first_url=first_url)
 
 
 @app.route('/users')
@@ -440,7 +381,18 @@ def users():
 @requires_auth
 def spam():
     spam_list = get_spam_logs(limit=50)
-    return render_template('spam.html', spam_logs=spam_list)
+    # Бот пишет муты в spam_mutes при любом ANTI_SPAM_BACKEND и снимает
+    # удалённые отсюда в течение MUTE_CACHE_TTL секунд
+    return render_template('spam.html', spam_logs=spam_list,
+                           mutes=get_active_mutes())
+
+
+@app.route('/spam/unmute/<int:user_id>', methods=['POST'])
+@requires_auth
+def spam_unmute(user_id):
+    if lift_mute(user_id):
+        logger.info(f"Mute lifted for user {user_id} from admin panel")
+    return redirect(url_for('spam'))
 
 
 @app.route('/reviews')
@@ -553,14 +505,21 @@ def api_update_order_status(order_id):
     if success:
         if new_status in STATUS_MESSAGES and user_id:
             message = STATUS_MESSAGES[new_status].format(order_id=order_id)
-            notification_sent = send_telegram_notification(user_id, message)
-            logger.info(f"Status update notification for order {order_id}: sent={notification_sent}")
+            notification_queued = send_telegram_notification(user_id, message)
+            logger.info(f"Status update notification for order {order_id}: queued={notification_queued}")
 
         return jsonify({'success': True, 'order_id': order_id, 'status': new_status})
     else:
         return jsonify({'error': 'Failed to update status'}), 500
 
 
+@app.route('/api/notifications/status')
+@requires_auth
+@csrf.exempt
+def api_notifications_status():
+    return jsonify(notification_dispatcher.status())
+
+
 @app.route('/api/order/<int:order_id>/confirmation', methods=['POST'])
 @requires_auth
 @csrf.exempt
@@ -595,17 +554,12 @@ def api_export_csv():
     month_filter = request.args.get('month', None)
     year_filter = request.args.get('year', None)
 
-    all_orders = get_all_orders(limit=1000)
-
-    filtered = filter_orders(all_orders,
-                             date_from=date_from,
-                             date_to=date_to,
-                             period=period,
-                             month=month_filter,
-                             year=year_filter)
-
-    if status:
-        filtered = [o for o in filtered if getattr(o, 'status', None) == status]
+    filters = dict(status=status,
+                   date_from=date_from,
+                   date_to=date_to,
+                   period=period,
+                   month=month_filter,
+                   year=year_filter)
 
     STATUS_LABELS = {
         'new': 'Новый',
@@ -615,27 +569,33 @@ def api_export_csv():
         'cancelled': 'Отменён'
     }
 
-    output = io.StringIO()
-    # BOM for Excel (Windows) compatibility
-    output.write('\ufeff')
-    writer = csv.writer(output, delimiter=';')
-    writer.writerow(['ID', 'Услуга', 'Клиент', 'Телефон', 'Статус', 'Дата создания'])
-
-    for order in filtered:
-        writer.writerow([
-            getattr(order, 'id', ''),
-            SERVICE_NAMES.get(getattr(order, 'service_type', None), getattr(order, 'service_type', '') or ''),
-            getattr(order, 'client_name', '') or '',
-            getattr(order, 'client_phone', '') or '',
-            STATUS_LABELS.get(getattr(order, 'status', None), getattr(order, 'status', '')),
-            order.created_at.strftime('%d.%m.%Y %H:%M') if getattr(order, 'created_at', None) else ''
-        ])
-
-    output.seek(0)
+    def generate():
+        output = io.StringIO()
+        writer = csv.writer(output, delimiter=';')
+        # BOM for Excel (Windows) compatibility
+        output.write('\ufeff')
+        writer.writerow(['ID', 'Услуга', 'Клиент', 'Телефон', 'Статус', 'Дата создания'])
+
+        for i, (order_id, service_type, client_name, client_phone, order_status, created_at) in enumerate(iter_orders(**filters), 1):
+            writer.writerow([
+                order_id,
+                SERVICE_NAMES.get(service_type, service_type or ''),
+                client_name or '',
+                client_phone or '',
+                STATUS_LABELS.get(order_status, order_status),
+                created_at.strftime('%d.%m.%Y %H:%M') if created_at else ''
+            ])
+            # Flush to the client in chunks instead of building the whole file
+            if i % 500 == 0:
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate()
+
+        yield output.getvalue()
+
     filename = f"orders_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
 
-    response = make_response(output.getvalue())
-    response.headers['Content-Type'] = 'text/csv; charset=utf-8'
+    response = Response(generate(), content_type='text/csv; charset=utf-8')
     response.headers['Content-Disposition'] = f'attachment; filename={filename}'
     return response
 